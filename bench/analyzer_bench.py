@@ -0,0 +1,104 @@
+"""Microbenchmark: compiled prompt analyzer vs the previous substring-scan functions.
+
+Usage: python bench/analyzer_bench.py [--repeat N]
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+from analyzer import analyze_prompt  # noqa: E402
+
+# --- Previous implementation, kept verbatim for comparison ---
+ALLOWED = {
+    "ci","cd","cicd","devops","devsecops","security","sdlc","release","terraform","ansible","jenkins","spinnaker",
+    "argo","argocd","workflows","rollouts","shell","bash","kubernetes","helm","process","processes"
+}
+
+
+def is_allowed(text: str) -> bool:
+    t = text.lower()
+    return any(k in t for k in ALLOWED)
+
+
+def extract_ansible_requirements(prompt: str) -> Dict[str, Any]:
+    requirements = {"target_hosts": "all", "tasks": [], "variables": {}, "handlers": [], "roles": []}
+    prompt_lower = prompt.lower()
+    if "webserver" in prompt_lower or "web" in prompt_lower:
+        requirements["target_hosts"] = "webservers"
+    elif "database" in prompt_lower or "db" in prompt_lower:
+        requirements["target_hosts"] = "databases"
+    elif "load balancer" in prompt_lower or "lb" in prompt_lower:
+        requirements["target_hosts"] = "loadbalancers"
+    if "install" in prompt_lower or "package" in prompt_lower:
+        requirements["tasks"].append("package_installation")
+    if "configure" in prompt_lower or "config" in prompt_lower:
+        requirements["tasks"].append("configuration")
+    if "service" in prompt_lower or "start" in prompt_lower:
+        requirements["tasks"].append("service_management")
+    if "file" in prompt_lower or "copy" in prompt_lower:
+        requirements["tasks"].append("file_operations")
+    return requirements
+
+
+def extract_terraform_requirements(prompt: str) -> Dict[str, Any]:
+    requirements = {"provider": "aws", "resources": [], "variables": [], "outputs": []}
+    prompt_lower = prompt.lower()
+    if "aws" in prompt_lower or "amazon" in prompt_lower:
+        requirements["provider"] = "aws"
+    elif "azure" in prompt_lower:
+        requirements["provider"] = "azure"
+    elif "gcp" in prompt_lower or "google" in prompt_lower:
+        requirements["provider"] = "google"
+    if "ec2" in prompt_lower or "instance" in prompt_lower or "vm" in prompt_lower:
+        requirements["resources"].append("compute_instance")
+    if "vpc" in prompt_lower or "network" in prompt_lower:
+        requirements["resources"].append("network")
+    if "s3" in prompt_lower or "storage" in prompt_lower or "bucket" in prompt_lower:
+        requirements["resources"].append("storage")
+    if "rds" in prompt_lower or "database" in prompt_lower:
+        requirements["resources"].append("database")
+    if "load balancer" in prompt_lower or "alb" in prompt_lower:
+        requirements["resources"].append("load_balancer")
+    return requirements
+
+
+def legacy(text: str):
+    return is_allowed(text), extract_ansible_requirements(text), extract_terraform_requirements(text)
+
+
+INPUTS = {
+    "short prompt": "Create an Ansible playbook for installing nginx on web servers",
+    "200KB log": "\n".join(
+        f"2024-08-18T12:00:{i % 60:02d}Z INFO worker-{i % 17} request id={i * 7919} "
+        f"path=/api/v1/items/{i} status=200 latency_ms={i % 250} pipeline=deploy-{i % 5}"
+        for i in range(3000)
+    )[:200_000],
+    "200KB no keywords": ("lorem ipsum dolor sit amet quux " * 7000)[:200_000],
+}
+
+
+def timed(fn, text: str, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(text)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'input':<20}{'legacy ms':>12}{'analyzer ms':>14}{'speedup':>10}")
+    for name, text in INPUTS.items():
+        repeat = args.repeat * 100 if len(text) < 1000 else args.repeat
+        old = timed(legacy, text, repeat)
+        new = timed(analyze_prompt, text, repeat)
+        print(f"{name:<20}{old:>12.4f}{new:>14.4f}{old / new:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Offline stand-in for google.generativeai, for benchmarking the server without a Gemini key.
+
+install(profile) patches GenerativeModel and configure on the real SDK module, so the server's
+imports work unchanged. Profile keys (all optional, see DEFAULT_PROFILE):
+
+  latency_ms, latency_sigma   lognormal time of a non-streamed generation: median and shape
+  ttft_ms                     delay before the first streamed chunk
+  chunk_interval_ms           gap between streamed chunks
+  chunk_chars                 characters per streamed chunk
+  output_chars                size of each generated answer
+  error_rate                  fraction of calls failing with 500
+  throttle_rate               fraction of calls failing with 429
+  seed                        RNG seed, for repeatable runs
+
+Another stand-in can be swapped in with FAKE_GENAI_MODULE=<module>, as long as it has install(profile).
+"""
+import asyncio
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+DEFAULT_PROFILE: Dict[str, Any] = {
+    "latency_ms": 200,
+    "latency_sigma": 0.5,
+    "ttft_ms": 80,
+    "chunk_interval_ms": 20,
+    "chunk_chars": 40,
+    "output_chars": 1500,
+    "error_rate": 0.0,
+    "throttle_rate": 0.0,
+    "seed": 1,
+}
+
+_profile: Dict[str, Any] = dict(DEFAULT_PROFILE)
+_rng = random.Random(DEFAULT_PROFILE["seed"])
+
+
+class _FinishReason:
+    name = "STOP"
+
+
+class _Candidate:
+    finish_reason = _FinishReason()
+
+
+class _Usage:
+    def __init__(self, prompt_tokens: int, output_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+
+class _Response:
+    def __init__(self, text: str, usage: Optional[_Usage] = None):
+        self.text = text
+        self.candidates = [_Candidate()]
+        self.usage_metadata = usage
+
+
+def _body(system_instruction: Optional[str]) -> str:
+    """A fenced answer in the format the endpoint asks for, padded to output_chars"""
+    size = int(_profile["output_chars"])
+    system = (system_instruction or "").lower()
+    if "spinnaker" in system:
+        stage = '{"type": "wait", "name": "Wait", "refId": "%d", "waitTime": 30}'
+        stages = []
+        while sum(len(s) + 2 for s in stages) < size:
+            stages.append(stage % (len(stages) + 1))
+        return '{"name": "bench", "stages": [' + ", ".join(stages) + "]}"
+    if "terraform" in system:
+        fence, line = "hcl", 'resource "aws_s3_bucket" "b%d" {\n  bucket = "bench-%d"\n}\n'
+    else:
+        fence, line = "yaml", "    - name: step %d\n      debug:\n        msg: bench %d\n"
+    lines: List[str] = []
+    while sum(len(x) for x in lines) < size:
+        n = len(lines)
+        lines.append(line % (n, n))
+    if fence == "yaml":
+        lines.insert(0, "---\n- hosts: all\n  tasks:\n")
+    return f"```{fence}\n" + "".join(lines) + "```\n"
+
+
+def _latency() -> float:
+    return _rng.lognormvariate(0, float(_profile["latency_sigma"])) * float(_profile["latency_ms"]) / 1000
+
+
+def _maybe_fail():
+    from google.api_core import exceptions
+
+    roll = _rng.random()
+    if roll < _profile["throttle_rate"]:
+        raise exceptions.ResourceExhausted("fake quota exceeded")
+    if roll < _profile["throttle_rate"] + _profile["error_rate"]:
+        raise exceptions.InternalServerError("fake upstream error")
+
+
+class _Stream:
+    def __init__(self, text: str, usage: _Usage):
+        self._text = text
+        self._usage = usage
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        size = max(1, int(_profile["chunk_chars"]))
+        pieces = [self._text[i : i + size] for i in range(0, len(self._text), size)]
+        await asyncio.sleep(float(_profile["ttft_ms"]) / 1000)
+        for i, piece in enumerate(pieces):
+            if i:
+                await asyncio.sleep(float(_profile["chunk_interval_ms"]) / 1000)
+            yield _Response(piece, self._usage if i == len(pieces) - 1 else None)
+
+
+class FakeModel:
+    def __init__(self, model_name: str, system_instruction: Optional[str] = None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+
+    def _usage(self, contents: Any, text: str) -> _Usage:
+        return _Usage(max(1, len(str(contents)) // 4), max(1, len(text) // 4))
+
+    async def generate_content_async(self, contents, generation_config=None, safety_settings=None, stream=False, **kwargs):
+        _maybe_fail()
+        text = _body(self.system_instruction)
+        usage = self._usage(contents, text)
+        if stream:
+            return _Stream(text, usage)
+        await asyncio.sleep(_latency())
+        return _Response(text, usage)
+
+    def generate_content(self, contents, generation_config=None, safety_settings=None, **kwargs):
+        _maybe_fail()
+        time.sleep(_latency())
+        text = _body(self.system_instruction)
+        return _Response(text, self._usage(contents, text))
+
+    async def count_tokens_async(self, contents):
+        await asyncio.sleep(0.005)
+        return {"total_tokens": max(1, len(str(contents)) // 4)}
+
+    def count_tokens(self, contents):
+        return {"total_tokens": max(1, len(str(contents)) // 4)}
+
+
+def install(profile: Optional[Dict[str, Any]] = None):
+    """Route the SDK's GenerativeModel and configure to this stand-in"""
+    import google.generativeai as genai
+
+    _profile.clear()
+    _profile.update(DEFAULT_PROFILE)
+    _profile.update(profile or {})
+    _rng.seed(_profile["seed"])
+    genai.GenerativeModel = FakeModel
+    genai.configure = lambda **kwargs: None
@@ -0,0 +1,42 @@
+"""Run the FastAPI server against the fake Gemini backend.
+
+Usage: python bench/fake_server.py [--port 8090] [--workers 1]
+
+The profile comes from FAKE_GENAI_PROFILE (JSON, see fake_genai.DEFAULT_PROFILE). Each uvicorn
+worker imports this module, so the stand-in is installed in every worker before main loads.
+"""
+import argparse
+import importlib
+import json
+import os
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.join(BENCH_DIR, "..", "server")
+for path in (BENCH_DIR, SERVER_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+
+importlib.import_module(os.getenv("FAKE_GENAI_MODULE", "fake_genai")).install(
+    json.loads(os.getenv("FAKE_GENAI_PROFILE", "{}"))
+)
+
+from main import app  # noqa: E402,F401
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+    os.chdir(BENCH_DIR)
+    uvicorn.run("fake_server:app", host=args.host, port=args.port, workers=args.workers, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""Load benchmark: drive every endpoint of the server against the fake Gemini backend.
+
+Usage: python bench/load_bench.py [--requests N] [--concurrency C] [--only chat,ansible] [--compare OLD.json]
+
+Starts bench/fake_server.py (or targets --url), runs each scenario at the given concurrency and
+writes latency percentiles, requests/s, time-to-first-byte, error/status counts and server CPU/RSS
+to bench/results/load-<timestamp>.json. Needs httpx (pip install httpx).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+
+def _batch(i: int) -> Dict[str, Any]:
+    return {
+        "jobs": [
+            {"type": "ansible", "input": {"prompt": f"Ansible: install nginx on web servers, batch {i} job {j}"}}
+            for j in range(4)
+        ],
+        "concurrency": 4,
+    }
+
+
+# name -> (path, request body for request i)
+SCENARIOS: Dict[str, Tuple[str, Callable[[int], Dict[str, Any]]]] = {
+    "chat": ("/chat", lambda i: {"message": f"How should a CI/CD pipeline gate releases for service {i}?"}),
+    "chat-stream": ("/chat/stream", lambda i: {"message": f"Explain blue/green deploys in Kubernetes for app {i}"}),
+    "ansible": ("/ansible-generate", lambda i: {"prompt": f"Ansible playbook to install and configure nginx on web host {i}"}),
+    "ansible-stream": ("/ansible-generate/stream", lambda i: {"prompt": f"Ansible: install postgres on db host {i}"}),
+    "terraform": ("/terraform-generate", lambda i: {"prompt": f"Terraform for an AWS VPC and S3 bucket named logs-{i}"}),
+    "terraform-stream": ("/terraform-generate/stream", lambda i: {"prompt": f"Terraform EC2 instance web-{i} on AWS"}),
+    "spinnaker": ("/spinnaker-generate", lambda i: {"prompt": f"Spinnaker pipeline with manual judgment for service {i}"}),
+    "spinnaker-stream": ("/spinnaker-generate/stream", lambda i: {"prompt": f"Spinnaker canary pipeline for service {i}"}),
+    "batch": ("/batch-generate", _batch),
+}
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    """p50/p95/p99/max in milliseconds"""
+    out = {f"p{p}": percentile(values, p) for p in (50, 95, 99)}
+    out["max"] = max(values) if values else None
+    return {k: None if v is None else round(v * 1000, 2) for k, v in out.items()}
+
+
+class ProcessSampler:
+    """CPU seconds and peak RSS of a process and its children, read from /proc (Linux only)"""
+
+    def __init__(self, pid: Optional[int]):
+        self.pid = pid
+        self.available = pid is not None and os.path.exists(f"/proc/{pid}/stat")
+        self._ticks = os.sysconf("SC_CLK_TCK") if self.available else 100
+        self._page = os.sysconf("SC_PAGE_SIZE") if self.available else 4096
+        self.peak_rss = 0
+
+    def _tree(self) -> List[int]:
+        pids = [self.pid]
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            if ppid == self.pid:
+                pids.append(int(entry))
+        return pids
+
+    def cpu_seconds(self) -> float:
+        total = 0
+        for pid in self._tree():
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                total += int(fields[11]) + int(fields[12])
+            except (OSError, IndexError, ValueError):
+                continue
+        return total / self._ticks
+
+    def sample_rss(self):
+        rss = 0
+        for pid in self._tree():
+            try:
+                with open(f"/proc/{pid}/statm") as f:
+                    rss += int(f.read().split()[1]) * self._page
+            except (OSError, IndexError, ValueError):
+                continue
+        self.peak_rss = max(self.peak_rss, rss)
+
+
+async def one_request(client: httpx.AsyncClient, path: str, body: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    started = time.perf_counter()
+    ttfb = None
+    try:
+        async with client.stream("POST", path, json=body, headers=headers) as resp:
+            async for _ in resp.aiter_raw():
+                if ttfb is None:
+                    ttfb = time.perf_counter() - started
+            status = resp.status_code
+    except httpx.HTTPError as e:
+        return {"status": type(e).__name__, "latency": time.perf_counter() - started, "ttfb": ttfb}
+    return {"status": status, "latency": time.perf_counter() - started, "ttfb": ttfb}
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    name: str,
+    requests: int,
+    concurrency: int,
+    warmup: int,
+    headers: Dict[str, str],
+    sampler: ProcessSampler,
+) -> Dict[str, Any]:
+    path, body = SCENARIOS[name]
+    for i in range(warmup):
+        await one_request(client, path, body(-1 - i), headers)
+
+    queue: "asyncio.Queue[int]" = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(i)
+    results: List[Dict[str, Any]] = []
+
+    async def worker():
+        while not queue.empty():
+            i = queue.get_nowait()
+            results.append(await one_request(client, path, body(i), headers))
+
+    async def sample():
+        while True:
+            sampler.sample_rss()
+            await asyncio.sleep(0.2)
+
+    sampler.peak_rss = 0
+    sampling = asyncio.create_task(sample()) if sampler.available else None
+    cpu_before = sampler.cpu_seconds() if sampler.available else 0.0
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    cpu_used = sampler.cpu_seconds() - cpu_before if sampler.available else None
+    if sampling is not None:
+        sampling.cancel()
+        sampler.sample_rss()
+
+    statuses: Dict[str, int] = {}
+    for r in results:
+        statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+    ok = [r for r in results if r["status"] == 200]
+    return {
+        "path": path,
+        "requests": len(results),
+        "ok": len(ok),
+        "error_rate": round(1 - len(ok) / len(results), 4) if results else None,
+        "throttled": statuses.get("429", 0),
+        "statuses": statuses,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(results) / elapsed, 2) if elapsed else None,
+        "latency_ms": summarize([r["latency"] for r in ok]),
+        "ttfb_ms": summarize([r["ttfb"] for r in ok if r["ttfb"] is not None]),
+        "server_cpu_s": None if cpu_used is None else round(cpu_used, 3),
+        "server_cpu_pct": None if cpu_used is None else round(cpu_used / elapsed * 100, 1),
+        "server_rss_peak_mb": round(sampler.peak_rss / 2**20, 1) if sampler.available else None,
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port: int, workers: int, profile: Dict[str, Any]) -> subprocess.Popen:
+    env = dict(os.environ)
+    env["FAKE_GENAI_PROFILE"] = json.dumps(profile)
+    # Keep runs independent of each other: no on-disk response cache
+    env.setdefault("RESPONSE_CACHE_PATH", "")
+    return subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "fake_server.py"), "--port", str(port), "--workers", str(workers)],
+        env=env,
+    )
+
+
+async def wait_ready(url: str, proc: Optional[subprocess.Popen], timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=url) as client:
+        while time.monotonic() < deadline:
+            if proc is not None and proc.poll() is not None:
+                raise SystemExit(f"server exited with {proc.returncode}")
+            try:
+                if (await client.get("/")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise SystemExit(f"server at {url} not ready after {timeout}s")
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: Dict[str, Any], baseline_path: str):
+    """Print p95 latency and requests/s against an earlier result file"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nvs {baseline_path} ({baseline['meta'].get('git_revision')})")
+    print(f"{'scenario':<18}{'p95 ms':>10}{'was':>10}{'change':>9}{'rps':>9}{'was':>9}{'change':>9}")
+    for name, now in current["scenarios"].items():
+        old = baseline["scenarios"].get(name)
+        if old is None:
+            continue
+        p95, old_p95 = now["latency_ms"]["p95"], old["latency_ms"]["p95"]
+        rps, old_rps = now["rps"], old["rps"]
+        p95_change = f"{(p95 / old_p95 - 1) * 100:+.1f}%" if p95 and old_p95 else "-"
+        rps_change = f"{(rps / old_rps - 1) * 100:+.1f}%" if rps and old_rps else "-"
+        print(f"{name:<18}{p95 or 0:>10.1f}{old_p95 or 0:>10.1f}{p95_change:>9}{rps or 0:>9.1f}{old_rps or 0:>9.1f}{rps_change:>9}")
+
+
+async def bench(args) -> Dict[str, Any]:
+    profile = json.loads(args.profile) if args.profile else {}
+    proc = None
+    url = args.url
+    if url is None:
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        proc = start_server(port, args.workers, profile)
+    try:
+        await wait_ready(url, proc)
+        sampler = ProcessSampler(proc.pid if proc is not None else args.server_pid)
+        headers = {} if args.cache else {"X-Cache-Bypass": "1"}
+        names = args.only.split(",") if args.only else list(SCENARIOS)
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        scenarios = {}
+        async with httpx.AsyncClient(base_url=url, limits=limits, timeout=args.timeout) as client:
+            for name in names:
+                result = await run_scenario(
+                    client, name, args.requests, args.concurrency, args.warmup, headers, sampler
+                )
+                scenarios[name] = result
+                lat, ttfb = result["latency_ms"], result["ttfb_ms"]
+                print(
+                    f"{name:<18}{result['rps'] or 0:>8.1f} rps  p50 {lat['p50'] or 0:>8.1f}  p95 {lat['p95'] or 0:>8.1f}"
+                    f"  p99 {lat['p99'] or 0:>8.1f}  ttfb p50 {ttfb['p50'] or 0:>7.1f} ms  err {result['error_rate']:.2%}"
+                    f"  cpu {result['server_cpu_pct']}%  rss {result['server_rss_peak_mb']} MB"
+                )
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "url": args.url,
+            "workers": args.workers,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "cache": args.cache,
+            "profile": profile,
+        },
+        "scenarios": scenarios,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--only", help=f"comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--profile", help='fake backend profile as JSON, e.g. \'{"latency_ms": 800, "throttle_rate": 0.05}\'')
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the spawned server")
+    parser.add_argument("--url", help="benchmark an already running server instead of spawning one")
+    parser.add_argument("--server-pid", type=int, help="with --url, sample CPU/RSS of this process tree")
+    parser.add_argument("--cache", action="store_true", help="let the response cache serve repeats")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--out", help="result file (default bench/results/load-<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier result file to diff against")
+    args = parser.parse_args()
+
+    unknown = set(args.only.split(",")) - set(SCENARIOS) if args.only else set()
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    result = asyncio.run(bench(args))
+    out = args.out or os.path.join(RESULTS_DIR, f"load-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nwrote {out}")
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    main()
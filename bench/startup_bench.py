@@ -0,0 +1,161 @@
+"""Startup benchmark: import time, time to /ready and first-request latency, checked against budgets.
+
+Usage: python bench/startup_bench.py [--runs 5] [--import-budget-ms 1000] [--ready-budget-ms 15000]
+                                     [--first-request-budget-ms 1500]
+
+Import time is the median of --runs fresh interpreters importing server/main.py; the slowest
+imports main triggers are listed so a regression points at its cause. Time to ready and
+first-request latency come from bench/fake_server.py, so they measure the server, not Gemini.
+Writes bench/results/startup-<timestamp>.json and exits 1 when any budget is exceeded, for CI.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+from load_bench import BENCH_DIR, RESULTS_DIR, free_port, git_revision, start_server
+
+SERVER_DIR = os.path.join(BENCH_DIR, "..", "server")
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+
+def _server_env() -> Dict[str, str]:
+    env = dict(os.environ)
+    env.setdefault("GEMINI_API_KEY", "bench")
+    env.setdefault("RESPONSE_CACHE_PATH", "")
+    return env
+
+
+def import_seconds() -> float:
+    out = subprocess.run(
+        [sys.executable, "-W", "ignore", "-c", IMPORT_SNIPPET],
+        cwd=SERVER_DIR, env=_server_env(), capture_output=True, text=True, check=True,
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(limit: int = 8) -> List[Dict[str, Any]]:
+    """Imports made while main's body runs (not nested in another import), slowest first"""
+    out = subprocess.run(
+        [sys.executable, "-W", "ignore", "-X", "importtime", "-c", "import main"],
+        cwd=SERVER_DIR, env=_server_env(), capture_output=True, text=True, check=True,
+    )
+    modules = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        # main is at depth 1 (one space); its direct imports are indented by two more
+        if not cumulative.strip().isdigit() or len(name) - len(name.lstrip()) != 3:
+            continue
+        modules.append({"module": name.strip(), "ms": round(int(cumulative) / 1000, 1)})
+    return sorted(modules, key=lambda m: m["ms"], reverse=True)[:limit]
+
+
+async def ready_and_first_request(args) -> Dict[str, Any]:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    profile = json.loads(args.profile) if args.profile else {"latency_ms": 50, "latency_sigma": 0.1}
+    started = time.perf_counter()
+    proc = start_server(port, 1, profile)
+    try:
+        live = ready = None
+        async with httpx.AsyncClient(base_url=url, timeout=args.timeout) as client:
+            deadline = time.monotonic() + args.timeout
+            while ready is None:
+                if proc.poll() is not None:
+                    raise SystemExit(f"server exited with {proc.returncode}")
+                if time.monotonic() > deadline:
+                    raise SystemExit(f"server at {url} not ready after {args.timeout}s")
+                try:
+                    if live is None and (await client.get("/")).status_code == 200:
+                        live = time.perf_counter() - started
+                    resp = await client.get("/ready")
+                    if resp.status_code == 200:
+                        ready = time.perf_counter() - started
+                        warm = resp.json()
+                        break
+                except httpx.HTTPError:
+                    pass
+                await asyncio.sleep(0.05)
+
+            headers = {"X-Cache-Bypass": "1"}
+            latencies = []
+            for i in range(1 + args.warm_requests):
+                body = {"message": f"How should a CI/CD pipeline gate releases for service {i}?"}
+                t = time.perf_counter()
+                resp = await client.post("/chat", json=body, headers=headers)
+                resp.raise_for_status()
+                latencies.append(time.perf_counter() - t)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return {
+        "live_ms": round(live * 1000, 1) if live is not None else None,
+        "ready_ms": round(ready * 1000, 1),
+        "first_request_ms": round(latencies[0] * 1000, 1),
+        "warm_request_ms": round(statistics.median(latencies[1:]) * 1000, 1) if latencies[1:] else None,
+        "warm_up": warm,
+        "profile": profile,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters for the import measurement")
+    parser.add_argument("--warm-requests", type=int, default=5, help="requests after the first, for comparison")
+    parser.add_argument("--import-budget-ms", type=float, default=1000)
+    parser.add_argument("--ready-budget-ms", type=float, default=15000)
+    parser.add_argument("--first-request-budget-ms", type=float, default=1500)
+    parser.add_argument("--profile", help="fake backend profile as JSON (default: 50 ms generations)")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--out", help="result file (default bench/results/startup-<timestamp>.json)")
+    args = parser.parse_args()
+
+    imports = [import_seconds() for _ in range(args.runs)]
+    result: Dict[str, Any] = {
+        "import_ms": round(statistics.median(imports) * 1000, 1),
+        "import_runs_ms": [round(s * 1000, 1) for s in imports],
+        "slowest_imports": slowest_imports(),
+    }
+    result.update(asyncio.run(ready_and_first_request(args)))
+
+    budgets = {
+        "import_ms": args.import_budget_ms,
+        "ready_ms": args.ready_budget_ms,
+        "first_request_ms": args.first_request_budget_ms,
+    }
+    failures = []
+    for key, budget in budgets.items():
+        ok = result[key] <= budget
+        print(f"{key:<18}{result[key]:>10.1f} ms  budget {budget:>8.0f} ms  {'ok' if ok else 'OVER'}")
+        if not ok:
+            failures.append(key)
+    print(f"{'warm_request_ms':<18}{result['warm_request_ms'] or 0:>10.1f} ms")
+    print("slowest imports: " + ", ".join(f"{m['module']} {m['ms']} ms" for m in result["slowest_imports"]))
+
+    out = args.out or os.path.join(RESULTS_DIR, f"startup-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(
+            {
+                "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "git_revision": git_revision(), "budgets": budgets},
+                **result,
+            },
+            f,
+            indent=2,
+        )
+    print(f"\nwrote {out}")
+    if failures:
+        sys.exit(f"over budget: {', '.join(failures)}")
+
+
+if __name__ == "__main__":
+    main()
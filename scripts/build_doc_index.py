@@ -0,0 +1,170 @@
+"""Snapshot the grounding docs and build the server's local retrieval index.
+
+Usage: python scripts/build_doc_index.py [--fetch] [--snapshots DIR] [--index DIR]
+                                         [--repo-files 200] [--timeout 20]
+
+--fetch downloads the pages in CORE_DOC_URLS and the markdown/YAML files of CORE_GH_REPOS
+(web/src/lib/sources.ts, the same list the web bootstrap sends to Pinecone) into the snapshot
+directory, one JSON file per document. Without it, the index is rebuilt from the snapshots
+already on disk, so builds are offline and repeatable. Any .md or .txt file dropped into the
+snapshot directory is indexed as well. Set GH_TOKEN to lift GitHub's API rate limit.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+import urllib.request
+from html.parser import HTMLParser
+from typing import Dict, Iterator, List, Tuple
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "server"))
+from retrieval import RETRIEVAL_INDEX_PATH, build_index  # noqa: E402
+
+SOURCES_TS = os.path.join(ROOT, "web", "src", "lib", "sources.ts")
+DEFAULT_SNAPSHOTS = os.path.join(ROOT, "server", ".cache", "doc-snapshots")
+REPO_EXTENSIONS = ("md", "yaml", "yml")
+MAX_FILE_BYTES = 256 * 1024
+
+
+def read_sources(path: str = SOURCES_TS) -> Tuple[List[str], List[str]]:
+    """CORE_DOC_URLS and CORE_GH_REPOS as declared in sources.ts"""
+    with open(path) as f:
+        source = f.read()
+
+    def array(name: str) -> List[str]:
+        match = re.search(name + r"[^=]*=\s*\[(.*?)\];", source, re.S)
+        if not match:
+            return []
+        body = re.sub(r"//[^\n]*", "", match.group(1))
+        return re.findall(r"[\"']([^\"']+)[\"']", body)
+
+    return array("CORE_DOC_URLS"), array("CORE_GH_REPOS")
+
+
+class _TextExtractor(HTMLParser):
+    """Title and visible text of a page, dropping script/style/noscript like the web crawler"""
+
+    SKIP = {"script", "style", "noscript"}
+
+    def __init__(self):
+        super().__init__()
+        self.title = ""
+        self.parts: List[str] = []
+        self._skip = 0
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self._skip += 1
+        elif tag == "title":
+            self._in_title = True
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP and self._skip:
+            self._skip -= 1
+        elif tag == "title":
+            self._in_title = False
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+        elif not self._skip:
+            self.parts.append(data)
+
+
+def _get(url: str, timeout: float, headers: Dict[str, str] = None) -> bytes:
+    request = urllib.request.Request(url, headers={"User-Agent": "shipsense-doc-index", **(headers or {})})
+    with urllib.request.urlopen(request, timeout=timeout) as resp:
+        return resp.read()
+
+
+def fetch_page(url: str, timeout: float) -> Dict[str, str]:
+    parser = _TextExtractor()
+    parser.feed(_get(url, timeout).decode("utf-8", "replace"))
+    text = re.sub(r"\s+", " ", " ".join(parser.parts)).strip()
+    return {"url": url, "title": parser.title.strip() or url, "text": text}
+
+
+def fetch_repo(repo: str, limit: int, timeout: float) -> Iterator[Dict[str, str]]:
+    headers = {"Accept": "application/vnd.github+json"}
+    if os.getenv("GH_TOKEN"):
+        headers["Authorization"] = f"Bearer {os.environ['GH_TOKEN']}"
+    tree = json.loads(_get(f"https://api.github.com/repos/{repo}/git/trees/HEAD?recursive=1", timeout, headers))
+    files = [
+        n["path"] for n in tree.get("tree", [])
+        if n.get("type") == "blob"
+        and n["path"].rsplit(".", 1)[-1].lower() in REPO_EXTENSIONS
+        and n.get("size", 0) < MAX_FILE_BYTES
+    ]
+    # Top-level and docs/ files first: they are the ones worth grounding on
+    files.sort(key=lambda p: (not p.lower().startswith("docs/") and "/" in p, p))
+    for path in files[:limit]:
+        try:
+            text = _get(f"https://raw.githubusercontent.com/{repo}/HEAD/{path}", timeout).decode("utf-8", "replace")
+        except OSError as e:
+            print(f"  skip {repo}:{path}: {e}", file=sys.stderr)
+            continue
+        yield {"url": f"https://github.com/{repo}/blob/HEAD/{path}", "title": f"{repo}: {path}", "text": text}
+
+
+def save_snapshot(directory: str, doc: Dict[str, str]):
+    name = hashlib.sha1(doc["url"].encode("utf-8")).hexdigest()[:16] + ".json"
+    with open(os.path.join(directory, name), "w") as f:
+        json.dump({**doc, "fetched": time.strftime("%Y-%m-%dT%H:%M:%S")}, f)
+
+
+def fetch(directory: str, repo_files: int, timeout: float) -> int:
+    os.makedirs(directory, exist_ok=True)
+    urls, repos = read_sources()
+    saved = 0
+    for url in urls:
+        try:
+            save_snapshot(directory, fetch_page(url, timeout))
+            saved += 1
+        except OSError as e:
+            print(f"skip {url}: {e}", file=sys.stderr)
+    for repo in repos:
+        try:
+            for doc in fetch_repo(repo, repo_files, timeout):
+                save_snapshot(directory, doc)
+                saved += 1
+        except (OSError, ValueError) as e:
+            print(f"skip {repo}: {e}", file=sys.stderr)
+    return saved
+
+
+def load_snapshots(directory: str) -> Iterator[Dict[str, str]]:
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.endswith(".json"):
+            with open(path) as f:
+                yield json.load(f)
+        elif name.endswith((".md", ".txt")):
+            with open(path, errors="replace") as f:
+                yield {"url": "file://" + os.path.abspath(path), "title": name, "text": f.read()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fetch", action="store_true", help="download fresh snapshots before building")
+    parser.add_argument("--snapshots", default=DEFAULT_SNAPSHOTS)
+    parser.add_argument("--index", default=RETRIEVAL_INDEX_PATH)
+    parser.add_argument("--repo-files", type=int, default=200, help="files fetched per GitHub repo")
+    parser.add_argument("--timeout", type=float, default=20)
+    args = parser.parse_args()
+
+    if args.fetch:
+        print(f"fetched {fetch(args.snapshots, args.repo_files, args.timeout)} documents into {args.snapshots}")
+    if not os.path.isdir(args.snapshots):
+        sys.exit(f"no snapshots in {args.snapshots}; run with --fetch first")
+    started = time.perf_counter()
+    stats = build_index(load_snapshots(args.snapshots), args.index)
+    print(json.dumps({**stats, "seconds": round(time.perf_counter() - started, 2), "index": args.index}))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,73 +1,178 @@
+"""Run DevOps prompts through the server's generation pipeline, without the HTTP layer.
+
+Usage:
+  python scripts/tmp_run_gemini.py "Give a Jenkins pipeline for building a Node app"
+  python scripts/tmp_run_gemini.py --input jobs.jsonl --output results.jsonl [--concurrency 8] [--rpm 60] [--no-cache]
+  cat jobs.jsonl | python scripts/tmp_run_gemini.py --input - --output results.jsonl
+
+Each input line is a /batch-generate job, {"id", "type", "input"}, with type chat, ansible,
+terraform or spinnaker (default chat). A line without "input" uses its other fields as the
+input, so {"type": "ansible", "prompt": "..."} works, as does {"prompt": "..."} for chat. Lines
+without an id are numbered by position.
+
+Jobs run concurrently with the server's own guardrail, routing, caching, validation and quota
+handling. Each result is appended to the output as soon as it finishes, in the /batch-generate
+result format. A rerun skips ids the output already has an ok result for, so an interrupted run
+resumes where it stopped and failed jobs are retried. A throughput/latency/token summary goes to
+stderr; the exit status is 1 when any job failed.
+"""
+import argparse
+import asyncio
+import json
 import os
+import statistics
 import sys
-import google.generativeai as genai
+import time
+from typing import Any, Dict, List, Set
 
-ALLOWED = {
-    "ci","cd","cicd","devops","terraform","ansible","jenkins","spinnaker",
-    "argo","argocd","workflows","rollouts","decsecops","shell","bash","kubernetes","helm"
-}
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+# Concurrency is bounded here; the server's admission queue would only shed batch jobs
+os.environ.setdefault("ADMISSION_ENABLED", "0")
+import main  # noqa: E402
+from governor import TokenBucket  # noqa: E402
+from upstream import configure  # noqa: E402
 
-SYSTEM_POLICY = (
-    "You are a Responsible DevOps assistant. Only answer questions about CI/CD, DevOps, Terraform, Ansible, "
-    "Jenkins, Spinnaker, Argo (CD/Workflows/Rollouts), DecSecOps, and Shell scripting. "
-    "If the user asks anything outside these topics, politely refuse and suggest DevOps topics."
-)
 
-def is_allowed(text: str) -> bool:
-    t = text.lower()
-    return any(k in t for k in ALLOWED)
+def parse_job(line: str, number: int) -> main.BatchJob:
+    obj = json.loads(line)
+    job_type = obj.get("type", "chat")
+    payload = obj.get("input")
+    if payload is None:
+        payload = {k: v for k, v in obj.items() if k not in ("id", "type")}
+        if job_type == "chat" and "message" not in payload and "prompt" in payload:
+            payload["message"] = payload.pop("prompt")
+    return main.BatchJob(type=job_type, input=payload, id=str(obj.get("id", number)))
 
 
-def main():
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        print("GEMINI_API_KEY env var not set", file=sys.stderr)
-        sys.exit(1)
+def read_jobs(path: str) -> List[main.BatchJob]:
+    source = sys.stdin if path == "-" else open(path)
+    jobs = []
+    with source:
+        for number, line in enumerate(source, 1):
+            if not line.strip():
+                continue
+            try:
+                jobs.append(parse_job(line, number))
+            except (ValueError, AttributeError) as e:
+                sys.exit(f"{path}:{number}: not a job: {e}")
+    ids = [job.id for job in jobs]
+    if len(set(ids)) != len(ids):
+        sys.exit(f"{path}: job ids must be unique, or the output can't be resumed")
+    return jobs
 
-    prompt = "Give a Jenkins pipeline for building a Node app"
-    if len(sys.argv) > 1:
-        prompt = " ".join(sys.argv[1:])
 
-    if not is_allowed(prompt):
-        print("REFUSED: Out-of-scope. Allowed topics: DevOps/CI/CD (Terraform, Ansible, Jenkins, Spinnaker, Argo, DecSecOps, Shell)")
-        return
+def completed(path: str) -> Set[str]:
+    """Ids already answered ok in an earlier run's output"""
+    done: Set[str] = set()
+    if path == "-" or not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # Cut off by a crash mid-write; that job runs again
+                continue
+            if result.get("status") == "ok":
+                done.add(str(result.get("id")))
+    return done
 
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel("gemini-2.5-pro", system_instruction=SYSTEM_POLICY)
 
-    input_tokens = 0
-    try:
-        ct = model.count_tokens(prompt)
-        input_tokens = getattr(ct, "total_tokens", 0) or (ct.get("total_tokens") if isinstance(ct, dict) else 0)
-    except Exception:
-        pass
-
-    resp = model.generate_content(
-        prompt,
-        generation_config={
-            "temperature": 0.4,
-            "top_p": 0.9,
-            "max_output_tokens": 2048,
+def summarize(lines: List[Dict[str, Any]], skipped: int, seconds: float) -> Dict[str, Any]:
+    latencies = sorted(line["elapsed_ms"] for line in lines)
+    tokens = {"input": 0, "output": 0, "total": 0}
+    for line in lines:
+        usage = (line.get("result") or {}).get("tokens") or {}
+        for key in tokens:
+            tokens[key] += usage.get(key, 0)
+    ok = sum(line["status"] == "ok" for line in lines)
+    return {
+        "jobs": len(lines) + skipped,
+        "skipped": skipped,
+        "ok": ok,
+        "errors": len(lines) - ok,
+        "cache_hits": sum(line.get("cache") in ("HIT", "SIMILAR") for line in lines),
+        "seconds": round(seconds, 2),
+        "jobs_per_second": round(len(lines) / seconds, 2) if seconds else None,
+        "latency_ms": {
+            "p50": round(statistics.median(latencies), 1) if latencies else None,
+            "p95": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] if latencies else None,
+            "max": latencies[-1] if latencies else None,
         },
-        safety_settings=[
-            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        ],
-    )
+        "tokens": tokens,
+    }
+
 
-    output_text = resp.text if hasattr(resp, "text") else str(resp)
+async def run_batch(args) -> int:
+    jobs = read_jobs(args.input)
+    done = completed(args.output)
+    pending = [(index, job) for index, job in enumerate(jobs) if job.id not in done]
+    limit = asyncio.Semaphore(max(1, args.concurrency))
+    bucket = TokenBucket(args.rpm) if args.rpm > 0 else None
 
-    output_tokens = 0
+    async def run(index: int, job: main.BatchJob) -> Dict[str, Any]:
+        async with limit:
+            if bucket is not None:
+                await bucket.acquire()
+            return await main.run_batch_job(index, job, args.no_cache)
+
+    out = sys.stdout if args.output == "-" else open(args.output, "a")
+    started = time.perf_counter()
+    tasks = [asyncio.create_task(run(index, job)) for index, job in pending]
+    lines: List[Dict[str, Any]] = []
     try:
-        ct2 = model.count_tokens(output_text)
-        output_tokens = getattr(ct2, "total_tokens", 0) or (ct2.get("total_tokens") if isinstance(ct2, dict) else 0)
-    except Exception:
-        pass
+        for next_done in asyncio.as_completed(tasks):
+            line = await next_done
+            # One line per finished job, flushed, so a crash loses at most the jobs still running
+            out.write(json.dumps(line) + "\n")
+            out.flush()
+            lines.append(line)
+            if args.output != "-" and not args.quiet:
+                print(f"[{len(lines)}/{len(pending)}] {line['id']} {line['status']} {line['elapsed_ms']:.0f} ms", file=sys.stderr)
+    finally:
+        for task in tasks:
+            task.cancel()
+        if out is not sys.stdout:
+            out.close()
+        main.validation.shutdown()
+
+    summary = summarize(lines, len(jobs) - len(pending), time.perf_counter() - started)
+    print(json.dumps({"summary": summary}), file=sys.stderr)
+    return 1 if summary["errors"] else 0
+
+
+async def run_one(prompt: str):
+    # GEMINI_MODEL pins a model; otherwise the server's router picks the tier
+    result = await main.run_chat(main.ChatIn(message=prompt, model=os.getenv("GEMINI_MODEL")))
+    main.validation.shutdown()
+    print("OUTPUT:\n" + result["output"])
+    print("\nTOKENS:", result["tokens"])
+    if "route" in result:
+        print("ROUTE:", result["route"])
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("prompt", nargs="*", help="one chat prompt (without --input)")
+    parser.add_argument("--input", help="JSONL jobs file, or - for stdin")
+    parser.add_argument("--output", default="-", help="JSONL results file, appended to and resumed from (default stdout)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rpm", type=float, default=0, help="job starts per minute (0: no limit beyond GEMINI_RPM)")
+    parser.add_argument("--no-cache", action="store_true", help="skip the response cache, e.g. to regenerate references")
+    parser.add_argument("--quiet", action="store_true", help="no per-job progress on stderr")
+    args = parser.parse_args()
+
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        print("GEMINI_API_KEY env var not set", file=sys.stderr)
+        sys.exit(1)
+    configure(api_key)
+
+    if args.input:
+        sys.exit(asyncio.run(run_batch(args)))
+    prompt = " ".join(args.prompt) or "Give a Jenkins pipeline for building a Node app"
+    asyncio.run(run_one(prompt))
 
-    print("OUTPUT:\n" + output_text)
-    print("\nTOKENS:", {"input": input_tokens, "output": output_tokens, "total": input_tokens + output_tokens})
 
 if __name__ == "__main__":
-    main()
+    main_cli()
@@ -0,0 +1,256 @@
+import asyncio
+import contextvars
+import math
+import os
+import re
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Mapping, Optional
+
+from metrics import ABANDONED, SHED, current_endpoint, stage
+from upstream import MAX_CONCURRENCY
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") not in ("0", "false", "no")
+# Admitted generations per Gemini call slot; above 1, a few wait at the upstream limit so a freed slot is used at once
+ADMISSION_QUEUE_FACTOR = float(os.getenv("ADMISSION_QUEUE_FACTOR", "1.25"))
+# Requests allowed to generate at once in this worker; the rest wait in a FIFO queue
+ADMISSION_MAX_ACTIVE = int(os.getenv("ADMISSION_MAX_ACTIVE", str(math.ceil(MAX_CONCURRENCY * ADMISSION_QUEUE_FACTOR))))
+# Beyond this many waiting, new requests are shed at once with 503 + Retry-After
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "128"))
+# A request still queued after this long is shed as well
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+# Seconds the client is willing to wait, e.g. "X-Request-Timeout: 30"; capped at REQUEST_TIMEOUT_MAX
+DEADLINE_HEADER = os.getenv("DEADLINE_HEADER", "X-Request-Timeout")
+# Default per endpoint; override with e.g. REQUEST_TIMEOUT_CHAT=30
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "120"))
+REQUEST_TIMEOUT_MAX = float(os.getenv("REQUEST_TIMEOUT_MAX", "300"))
+
+# Monotonic time by which the current request must be answered; tasks spawned for it inherit it
+deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline", default=None)
+
+
+class Overloaded(Exception):
+    """Request shed before it reached Gemini"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"server overloaded ({reason}); retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, timeout: float):
+        super().__init__(f"request deadline of {timeout:g}s exceeded")
+        self.timeout = timeout
+
+
+class ClientDisconnected(Exception):
+    """The client went away; its work was cancelled"""
+
+
+def default_timeout(endpoint: str) -> float:
+    """Deadline for an endpoint, from REQUEST_TIMEOUT_<ENDPOINT> or REQUEST_TIMEOUT"""
+    env_name = "REQUEST_TIMEOUT_" + re.sub(r"[^A-Za-z0-9]", "_", endpoint).upper()
+    return float(os.getenv(env_name, str(REQUEST_TIMEOUT)))
+
+
+def request_timeout(headers: Mapping[str, str], endpoint: str) -> float:
+    """Seconds this request may take: the deadline header if valid, else the endpoint default"""
+    try:
+        asked = float(headers.get(DEADLINE_HEADER, ""))
+    except ValueError:
+        asked = 0.0
+    timeout = asked if asked > 0 and math.isfinite(asked) else default_timeout(endpoint)
+    return min(timeout, REQUEST_TIMEOUT_MAX)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current request's deadline, or None without one"""
+    ends = deadline.get()
+    return None if ends is None else ends - time.monotonic()
+
+
+class Admission:
+    """Bounded concurrency with a bounded FIFO queue in front of it.
+
+    Queued requests are shed, rather than left to pile up, when the queue is full, when they
+    have waited ADMISSION_QUEUE_TIMEOUT, or when their deadline would pass first. Retry-After
+    is the expected wait for the current queue, from a moving average of slot hold times.
+    """
+
+    def __init__(self, max_active: int = ADMISSION_MAX_ACTIVE, max_queue: int = ADMISSION_MAX_QUEUE, queue_timeout: float = ADMISSION_QUEUE_TIMEOUT):
+        self.max_active = max(1, max_active)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        # Smoothed seconds a slot is held
+        self._service = 5.0
+        self.stats = {"admitted": 0, "queued": 0, "shed": 0, "deadline": 0, "disconnected": 0}
+
+    def retry_after(self) -> int:
+        wait = self._service * (len(self._waiters) + 1) / self.max_active
+        return int(min(60, max(1, math.ceil(wait))))
+
+    def _shed(self, reason: str):
+        self.stats["shed"] += 1
+        SHED.labels(current_endpoint.get(), reason).inc()
+        raise Overloaded(reason, self.retry_after())
+
+    async def acquire(self, within: Optional[float] = None):
+        """Take a slot, queueing for up to `within` seconds (default: until the request's deadline)"""
+        if self._active < self.max_active and not self._waiters:
+            self._active += 1
+            self.stats["admitted"] += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self._shed("queue_full")
+        left = remaining() if within is None else within
+        timeout = self.queue_timeout if left is None else min(self.queue_timeout, left)
+        if timeout <= 0:
+            self._shed("deadline")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.stats["queued"] += 1
+        try:
+            with stage("queue"):
+                await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            self._discard(waiter)
+            self._shed("queue_timeout" if left is None or left > self.queue_timeout else "deadline")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Handed a slot just as the caller went away; pass it on
+                self.release(0.0)
+            else:
+                self._discard(waiter)
+            raise
+        self.stats["admitted"] += 1
+
+    def _discard(self, waiter: asyncio.Future):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self, held: float):
+        if held:
+            self._service = 0.9 * self._service + 0.1 * held
+        # The slot moves straight to the next waiter, so a newcomer can't jump the queue
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active -= 1
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    async def enter(self, within: Optional[float] = None) -> Callable[[], None]:
+        """Acquire a slot for a stream; returns an idempotent release"""
+        await self.acquire(within)
+        started = time.monotonic()
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.release(time.monotonic() - started)
+
+        return release
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "active": self._active,
+            "queued_now": len(self._waiters),
+            "max_active": self.max_active,
+            "max_queue": self.max_queue,
+            "retry_after": self.retry_after(),
+        }
+
+
+admission: Optional[Admission] = Admission() if ADMISSION_ENABLED else None
+
+
+async def admitted(work: Callable[[], Awaitable[Any]]) -> Any:
+    """Run work() in an admission slot; a no-op wrapper with admission off"""
+    if admission is None:
+        return await work()
+    async with admission.slot():
+        return await work()
+
+
+async def _disconnected(receive: Callable[[], Awaitable[Dict[str, Any]]]):
+    # The body has been read, so the next message is the disconnect (or the end of the response)
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def guard(receive: Callable[[], Awaitable[Dict[str, Any]]], timeout: float, work: Awaitable[Any]) -> Any:
+    """Await work under a deadline, cancelling it when the deadline passes or the client disconnects.
+
+    Cancellation reaches the Gemini call (or leaves a shared single-flight call to the
+    requests still waiting on it), so abandoned requests stop spending quota.
+    """
+    token = deadline.set(time.monotonic() + timeout)
+    try:
+        task = asyncio.ensure_future(work)
+    finally:
+        deadline.reset(token)
+    watcher = asyncio.ensure_future(_disconnected(receive))
+    try:
+        done, _ = await asyncio.wait({task, watcher}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if task in done:
+            return task.result()
+        reason = "disconnect" if watcher in done else "deadline"
+        ABANDONED.labels(current_endpoint.get(), reason).inc()
+        if admission is not None:
+            admission.stats["disconnected" if watcher in done else "deadline"] += 1
+        if watcher in done:
+            raise ClientDisconnected()
+        raise DeadlineExceeded(timeout)
+    finally:
+        watcher.cancel()
+        task.cancel()
+
+
+async def bounded_stream(
+    events: AsyncIterator[Any],
+    timeout: float,
+    on_deadline: Callable[[], Any],
+    release: Optional[Callable[[], None]] = None,
+) -> AsyncIterator[Any]:
+    """Relay a stream until its deadline, then yield on_deadline() and stop it.
+
+    Client disconnects already close the stream (and its upstream call) through the server.
+    """
+    ends = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(events.__anext__(), max(0.0, ends - time.monotonic()))
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                ABANDONED.labels(current_endpoint.get(), "deadline").inc()
+                if admission is not None:
+                    admission.stats["deadline"] += 1
+                yield on_deadline()
+                return
+            yield item
+    finally:
+        if release is not None:
+            release()
+        aclose = getattr(events, "aclose", None)
+        if aclose is not None:
+            await aclose()
@@ -0,0 +1,127 @@
+import re
+from typing import Any, Dict, List, Tuple
+
+# Declarative prompt rules: (field, value, keywords). Keywords match at the start of a word,
+# so "install" also covers "installing"; WHOLE_WORDS must match a complete word, so "cd"
+# no longer fires inside "abcd". target_hosts and provider take the earliest matching row
+# (defaults "all" and "aws"); tasks and resources collect every match in table order.
+RULES: List[Tuple[str, Any, List[str]]] = [
+    ("topic", True, [
+        "ci", "cd", "cicd", "devops", "devsecops", "security", "sdlc", "release", "terraform", "ansible",
+        "jenkins", "spinnaker", "argo", "argocd", "workflows", "rollouts", "shell", "bash", "kubernetes",
+        "helm", "process", "processes",
+    ]),
+    ("target_hosts", "webservers", ["webserver", "web"]),
+    ("target_hosts", "databases", ["database", "db"]),
+    ("target_hosts", "loadbalancers", ["load balancer", "lb"]),
+    ("tasks", "package_installation", ["install", "package"]),
+    ("tasks", "configuration", ["configure", "config"]),
+    ("tasks", "service_management", ["service", "start"]),
+    ("tasks", "file_operations", ["file", "copy"]),
+    ("provider", "aws", ["aws", "amazon"]),
+    ("provider", "azure", ["azure"]),
+    ("provider", "google", ["gcp", "google"]),
+    ("resources", "compute_instance", ["ec2", "instance", "vm"]),
+    ("resources", "network", ["vpc", "network"]),
+    ("resources", "storage", ["s3", "storage", "bucket"]),
+    ("resources", "database", ["rds", "database"]),
+    ("resources", "load_balancer", ["load balancer", "alb"]),
+]
+
+WHOLE_WORDS = {"ci", "cd", "db", "lb", "vm", "s3", "ec2", "rds", "alb", "gcp", "aws", "sdlc"}
+
+
+def _trie_pattern(words: List[str]) -> str:
+    """Regex alternation factored on shared prefixes so each position costs one trie walk.
+
+    There is deliberately no leading \\b: sre can then skip ahead on the first character,
+    which makes the scan markedly faster; word starts are checked per match instead.
+    """
+    trie: Dict[str, Any] = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = word in WHOLE_WORDS
+
+    def render(node: Dict[str, Any]) -> str:
+        branches = []
+        end = None
+        for ch in sorted(node):
+            if ch == "":
+                end = r"(?!\w)" if node[ch] else ""
+                continue
+            step = r"\s+" if ch == " " else re.escape(ch)
+            branches.append(step + render(node[ch]))
+        if end is not None:
+            # Longer keywords first; the shorter one ends here
+            branches.append(end)
+        if len(branches) == 1:
+            return branches[0]
+        return "(?:" + "|".join(branches) + ")"
+
+    return render(trie)
+
+
+def _compile():
+    ranks: Dict[str, List[int]] = {}
+    for rank, (field, value, keywords) in enumerate(RULES):
+        for keyword in keywords:
+            ranks.setdefault(keyword, []).append(rank)
+    # Prompts are lowercased once up front; IGNORECASE makes the scan several times slower
+    return re.compile(_trie_pattern(list(ranks))), ranks
+
+
+_MATCHER, _RANKS = _compile()
+_SPACES = re.compile(r"\s+")
+
+
+def analyze_prompt(text: str) -> Dict[str, Any]:
+    """Guardrail decision plus Ansible and Terraform requirements from one scan of the prompt"""
+    ranks = set()
+    lowered = text.lower()
+    for m in _MATCHER.finditer(lowered):
+        start = m.start()
+        if start and (lowered[start - 1].isalnum() or lowered[start - 1] == "_"):
+            continue
+        keyword = m.group(0)
+        if keyword not in _RANKS:
+            keyword = _SPACES.sub(" ", keyword)
+        ranks.update(_RANKS[keyword])
+
+    # Rows are in table order, so the first hit of a single-valued field is the winner
+    hits = [RULES[rank] for rank in sorted(ranks)]
+    chosen: Dict[str, Any] = {}
+    for field, value, _ in hits:
+        chosen.setdefault(field, value)
+
+    return {
+        "allowed": "topic" in chosen,
+        "ansible": {
+            "target_hosts": chosen.get("target_hosts", "all"),
+            "tasks": [value for field, value, _ in hits if field == "tasks"],
+            "variables": {},
+            "handlers": [],
+            "roles": [],
+        },
+        "terraform": {
+            "provider": chosen.get("provider", "aws"),
+            "resources": [value for field, value, _ in hits if field == "resources"],
+            "variables": [],
+            "outputs": [],
+        },
+    }
+
+
+def is_allowed(text: str) -> bool:
+    return analyze_prompt(text)["allowed"]
+
+
+def extract_ansible_requirements(prompt: str) -> Dict[str, Any]:
+    """Extract Ansible requirements from user prompt"""
+    return analyze_prompt(prompt)["ansible"]
+
+
+def extract_terraform_requirements(prompt: str) -> Dict[str, Any]:
+    """Extract Terraform requirements from user prompt"""
+    return analyze_prompt(prompt)["terraform"]
@@ -0,0 +1,140 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "responses.db")
+
+CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") not in ("0", "false", "no")
+# Empty path keeps the cache in-process only
+CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", DEFAULT_PATH)
+CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+CACHE_MEMORY_ENTRIES = int(os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES", "1024"))
+
+_WS = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    return _WS.sub(" ", prompt).strip().lower()
+
+
+def make_key(endpoint: str, prompt: str, model: str, system_prompt: str, generation_config: Dict[str, Any]) -> str:
+    """Stable cache key for one generation request"""
+    material = json.dumps(
+        [endpoint, normalize_prompt(prompt), model, system_prompt, generation_config],
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """In-process LRU in front of a SQLite (WAL) store shared by all workers"""
+
+    def __init__(
+        self,
+        path: Optional[str] = CACHE_PATH,
+        ttl: float = CACHE_TTL,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        memory_entries: int = CACHE_MEMORY_ENTRIES,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("PRAGMA busy_timeout=5000")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+
+    def _remember(self, key: str, expires: float, value: Dict[str, Any]):
+        self._memory[key] = (expires, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _lookup_memory(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        item = self._memory.get(key)
+        if item is None:
+            return None
+        if item[0] <= now:
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return item[1]
+
+    def _disk_get(self, key: str, now: float) -> Optional[tuple]:
+        with self._lock:
+            row = self._db.execute("SELECT value, expires FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(row[0]), row[1]
+
+    def _disk_set(self, key: str, value: Dict[str, Any], expires: float, now: float) -> int:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires, now),
+            )
+            # Trim expired rows first, then the least recently used beyond the size cap
+            removed = self._db.execute("DELETE FROM responses WHERE expires <= ?", (now,)).rowcount
+            count = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if count > self.max_entries:
+                removed += self._db.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY accessed ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                ).rowcount
+        return max(removed, 0)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        value = self._lookup_memory(key, now)
+        if value is not None:
+            self.stats["memory_hits"] += 1
+            return value
+        if self._db is not None:
+            row = await asyncio.to_thread(self._disk_get, key, now)
+            if row is not None:
+                self._remember(key, row[1], row[0])
+                self.stats["disk_hits"] += 1
+                return row[0]
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: Dict[str, Any]):
+        now = time.time()
+        expires = now + self.ttl
+        self._remember(key, expires, value)
+        self.stats["stores"] += 1
+        if self._db is not None:
+            self.stats["evictions"] += await asyncio.to_thread(self._disk_set, key, value, expires, now)
+
+    def snapshot(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = dict(self.stats)
+        out["memory_entries"] = len(self._memory)
+        if self._db is not None:
+            with self._lock:
+                out["disk_entries"] = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return out
@@ -0,0 +1,204 @@
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from validation import extract_blocks
+
+TERRAFORM_DECOMPOSE_ENABLED = os.getenv("TERRAFORM_DECOMPOSE_ENABLED", "1") not in ("0", "false", "no")
+# Requests whose resources span at least this many parts are generated part by part, concurrently
+TERRAFORM_DECOMPOSE_MIN_PARTS = int(os.getenv("TERRAFORM_DECOMPOSE_MIN_PARTS", "3"))
+
+
+class Part:
+    """One slice of a decomposed configuration and its side of the shared contract"""
+
+    def __init__(self, name: str, title: str, resources: List[str], provides: Dict[str, Tuple[str, str]], needs: List[str]):
+        self.name = name
+        self.title = title
+        self.resources = resources
+        # local name -> (resource it comes from, description); exposed only when that resource is part of the request
+        self.provides = provides
+        self.needs = needs
+
+
+# Network comes first: everything but storage lives in its subnets
+PARTS = [
+    Part(
+        "network",
+        "network",
+        ["network"],
+        {
+            "network_id": ("network", "ID of the VPC / virtual network"),
+            "public_subnet_ids": ("network", "list of public subnet IDs, one per availability zone"),
+            "private_subnet_ids": ("network", "list of private subnet IDs, one per availability zone"),
+        },
+        [],
+    ),
+    Part(
+        "compute",
+        "compute",
+        ["compute_instance"],
+        {
+            "instance_ids": ("compute_instance", "list of instance IDs"),
+            "app_security_group_id": ("compute_instance", "ID of the security group / firewall rule set attached to the instances"),
+        },
+        ["network_id", "public_subnet_ids", "private_subnet_ids"],
+    ),
+    Part(
+        "data",
+        "data (storage and database)",
+        ["storage", "database"],
+        {
+            "bucket_name": ("storage", "name of the object storage bucket"),
+            "db_endpoint": ("database", "connection endpoint of the database"),
+        },
+        ["network_id", "private_subnet_ids", "app_security_group_id"],
+    ),
+    Part(
+        "lb",
+        "load balancer",
+        ["load_balancer"],
+        {"lb_dns_name": ("load_balancer", "DNS name of the load balancer")},
+        ["network_id", "public_subnet_ids", "instance_ids", "app_security_group_id"],
+    ),
+]
+NEEDS_NETWORK = {"compute_instance", "database", "load_balancer"}
+
+# Written locally rather than by any part, so no two parts can disagree on them
+SHARED_VARIABLES = {
+    "aws": {"region": "us-east-1", "name_prefix": "app"},
+    "azure": {"location": "eastus", "name_prefix": "app"},
+    "google": {"project": "my-project", "region": "us-central1", "name_prefix": "app"},
+}
+PROVIDER_HEADERS = {
+    "aws": (
+        'terraform {\n  required_providers {\n    aws = { source = "hashicorp/aws", version = "~> 5.0" }\n  }\n}\n\n'
+        'provider "aws" {\n  region = var.region\n}\n'
+    ),
+    "azure": (
+        'terraform {\n  required_providers {\n    azurerm = { source = "hashicorp/azurerm", version = "~> 3.0" }\n  }\n}\n\n'
+        'provider "azurerm" {\n  features {}\n}\n\n'
+        'resource "azurerm_resource_group" "main" {\n  name     = "${var.name_prefix}-rg"\n  location = var.location\n}\n'
+    ),
+    "google": (
+        'terraform {\n  required_providers {\n    google = { source = "hashicorp/google", version = "~> 5.0" }\n  }\n}\n\n'
+        'provider "google" {\n  project = var.project\n  region  = var.region\n}\n'
+    ),
+}
+SHARED_RESOURCES = {"azure": "azurerm_resource_group.main (name and location of the resource group every resource goes in)"}
+
+
+def plan(requirements: Dict[str, Any], requested: Optional[bool] = None) -> List[Part]:
+    """Parts to generate separately, or [] for a single prompt.
+
+    requested=None decides by TERRAFORM_DECOMPOSE_MIN_PARTS, True splits anything that spans
+    two parts or more, False never splits.
+    """
+    if requested is False or (requested is None and not TERRAFORM_DECOMPOSE_ENABLED):
+        return []
+    if requirements.get("provider") not in PROVIDER_HEADERS:
+        return []
+    wanted = set(requirements.get("resources") or [])
+    if wanted & NEEDS_NETWORK:
+        wanted.add("network")
+    parts = [part for part in PARTS if wanted & set(part.resources)]
+    needed = 2 if requested else TERRAFORM_DECOMPOSE_MIN_PARTS
+    return parts if len(parts) >= max(2, needed) else []
+
+
+def contract(parts: List[Part], requirements: Dict[str, Any]) -> Dict[str, Dict[str, str]]:
+    """local name -> {"part", "description"} for every value the parts exchange.
+
+    Each value is defined by one part as a local, read by the others as local.<name> and
+    exported as a root output, so a part that leaves its share out fails the reference check.
+    """
+    wanted = set(requirements.get("resources") or []) | {"network"}
+    values = {}
+    for part in parts:
+        for name, (resource, description) in part.provides.items():
+            if resource in wanted:
+                values[name] = {"part": part.name, "description": description}
+    return values
+
+
+def part_requirements(part: Part, requirements: Dict[str, Any]) -> Dict[str, Any]:
+    """The requirements a part answers for, as routing and retrieval see them"""
+    resources = [r for r in requirements.get("resources") or [] if r in part.resources] or part.resources[:1]
+    return {**requirements, "resources": resources}
+
+
+def build_part_prompt(prompt: str, part: Part, parts: List[Part], requirements: Dict[str, Any], refs_text: str = "") -> str:
+    """Prompt for one part: the whole request for context, and exactly what this part owns and exchanges"""
+    provider = requirements["provider"]
+    values = contract(parts, requirements)
+    mine = {name: v for name, v in values.items() if v["part"] == part.name}
+    theirs = {name: v for name, v in values.items() if v["part"] != part.name and name in part.needs}
+    others = [p.title for p in parts if p is not part]
+    variables = ", ".join(f"var.{name}" for name in SHARED_VARIABLES[provider])
+    lines = [
+        f"Write only the {part.title} part of a larger {provider} Terraform configuration for this request:",
+        prompt,
+        "",
+        f"Resources in this part: {', '.join(part_requirements(part, requirements)['resources'])}.",
+        f"Other parts, written separately and merged into the same file, cover: {', '.join(others)}. Do not write their resources.",
+        "",
+        "The shared contract:",
+        f"- Already written, do not repeat: the terraform and provider blocks, and the variables {variables}.",
+    ]
+    if provider in SHARED_RESOURCES:
+        lines.append(f"- Also already written: {SHARED_RESOURCES[provider]}.")
+    if theirs:
+        lines.append("- Values from other parts, to be referenced exactly as written:")
+        lines += [f"  - local.{name}: {v['description']}" for name, v in theirs.items()]
+    if mine:
+        lines.append("- Define exactly these values in one locals block, for the other parts to use:")
+        lines += [f"  - {name}: {v['description']}" for name, v in mine.items()]
+    lines += [
+        "",
+        f'Start every resource and data source name with "{part.name}_" so nothing clashes with the other parts.',
+        "Use var.name_prefix in resource names and tags. Add a short comment above each resource.",
+        "Return one ```hcl block and nothing else: no terraform, provider, variable or output blocks, no other locals.",
+    ]
+    return refs_text + "\n".join(lines) + "\n"
+
+
+def header(requirements: Dict[str, Any]) -> str:
+    """Provider setup and shared variables that open the merged configuration"""
+    provider = requirements["provider"]
+    variables = "".join(
+        f'\nvariable "{name}" {{\n  type    = string\n  default = "{default}"\n}}\n'
+        for name, default in SHARED_VARIABLES[provider].items()
+    )
+    return PROVIDER_HEADERS[provider] + variables
+
+
+def part_hcl(part: Part, generated: str) -> str:
+    """The HCL of one part's answer, fenced or not, under a comment naming the part"""
+    bodies = [body for language, body, _ in extract_blocks(generated, "hcl") if language == "hcl"]
+    if not bodies and "```" not in generated:
+        bodies = [generated]
+    text = "\n".join(body.strip() for body in bodies).strip()
+    if not text:
+        return f"\n# --- {part.name}: nothing was generated ---\n"
+    return f"\n# --- {part.name} ---\n{text}\n"
+
+
+def footer(parts: List[Part], requirements: Dict[str, Any]) -> str:
+    """The contract values as root outputs"""
+    outputs = "".join(
+        f'\n# {v["description"]}\noutput "{name}" {{\n  value = local.{name}\n}}\n'
+        for name, v in contract(parts, requirements).items()
+    )
+    return "\n# --- outputs ---" + outputs if outputs else ""
+
+
+def merge(parts: List[Part], requirements: Dict[str, Any], sections: List[str]) -> str:
+    """One fenced configuration: header, each part's section, then the contract outputs"""
+    return "```hcl\n" + header(requirements) + "".join(sections) + footer(parts, requirements) + "```"
+
+
+def overall_route(reports: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """One route for a decomposed answer: the part served on the highest tier, with every part's escalations"""
+    routes = [report["route"] for report in reports]
+    top = max(routes, key=lambda r: -1 if r["tier"] is None else r["tier"])
+    escalations = [{**e, "part": report["part"]} for report in reports for e in report["route"]["escalations"]]
+    return {**top, "escalations": escalations}
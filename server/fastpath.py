@@ -0,0 +1,165 @@
+import glob
+import os
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import yaml
+
+from semantic_cache import features
+from validation import extract_blocks, summarize, validate_blocks
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+TEMPLATES_ENABLED = os.getenv("TEMPLATES_ENABLED", "1") not in ("0", "false", "no")
+TEMPLATES_PATH = os.getenv("TEMPLATES_PATH", DEFAULT_PATH)
+# Share of the prompt's content words a template must account for before it answers instead of Gemini.
+# Below 1.0, a prompt asking for something the template doesn't write (TLS, spot instances) could get it anyway
+TEMPLATE_MIN_CONFIDENCE = float(os.getenv("TEMPLATE_MIN_CONFIDENCE", "1.0"))
+
+KINDS = {"ansible": "yaml", "terraform": "hcl"}
+
+
+def vocabulary(words: List[str]) -> Set[str]:
+    """Prompt features the words (and their plurals) can turn into"""
+    return set(features(" ".join(words + [word + "s" for word in words])))
+
+
+# Words that say what kind of artifact is wanted, not what goes in it
+GENERIC_VOCABULARY = vocabulary(
+    "ansible playbook terraform hcl yaml config configuration code script setup set up simple basic example "
+    "standard default quick ready production server host machine node web webserver database db loadbalancer lb".split()
+)
+# [[ name ]] rather than {{ name }}: Ansible templates its own {{ }} expressions at run time
+_PLACEHOLDER = re.compile(r"\[\[\s*([A-Za-z_][A-Za-z0-9_]*)\s*\]\]")
+
+
+class TemplateError(ValueError):
+    pass
+
+
+def render(body: str, values: Dict[str, Any]) -> str:
+    return _PLACEHOLDER.sub(lambda m: str(values[m.group(1)]), body)
+
+
+class Template:
+    """One boilerplate artifact and the requirements it answers.
+
+    `match` decides which prompts it may answer: `requires` lists values the extracted
+    requirements must contain (or equal, for scalars like provider), `allows` bounds list
+    fields to a set, at least one of `keywords` must be in the prompt and none of `excludes`
+    (asks the template contradicts, such as public access for a private bucket) may be.
+    `vars` are the placeholder defaults; a var named like a requirement field takes the
+    prompt's value.
+    """
+
+    def __init__(self, spec: Dict[str, Any], source: str):
+        self.source = source
+        self.name = str(spec.get("name") or os.path.splitext(os.path.basename(source))[0])
+        self.kind = spec.get("kind")
+        if self.kind not in KINDS:
+            raise TemplateError(f"kind must be one of {', '.join(KINDS)}")
+        self.description = str(spec.get("description", ""))
+        match = spec.get("match") or {}
+        self.requires: Dict[str, Any] = match.get("requires") or {}
+        self.allows: Dict[str, List[str]] = match.get("allows") or {}
+        self.keywords = vocabulary(match.get("keywords") or [])
+        self.excludes = vocabulary(match.get("excludes") or [])
+        self.vocabulary = (self.keywords | vocabulary(spec.get("vocabulary") or []) | GENERIC_VOCABULARY) - self.excludes
+        self.vars: Dict[str, Any] = spec.get("vars") or {}
+        self.body = spec.get("body")
+        if not isinstance(self.body, str) or not self.body.strip():
+            raise TemplateError("body is empty")
+        undefined = sorted(set(_PLACEHOLDER.findall(self.body)) - set(self.vars))
+        if undefined:
+            raise TemplateError(f"placeholders without a default in vars: {', '.join(undefined)}")
+        self._rendered: Dict[Tuple, Tuple[str, Dict[str, Any]]] = {}
+        # The defaults must render to an artifact that parses, or the template never loads
+        _, report = self.render({})
+        if report["valid"] is False or not report["blocks"]:
+            raise TemplateError(report["summary"])
+
+    def fits(self, requirements: Dict[str, Any], words: Set[str]) -> bool:
+        for field, wanted in self.requires.items():
+            have = requirements.get(field)
+            if isinstance(have, list):
+                if not set(wanted if isinstance(wanted, list) else [wanted]) <= set(have):
+                    return False
+            elif have not in (wanted if isinstance(wanted, list) else [wanted]):
+                return False
+        for field, allowed in self.allows.items():
+            if not set(requirements.get(field) or []) <= set(allowed):
+                return False
+        if self.excludes & words:
+            return False
+        return not self.keywords or bool(self.keywords & words)
+
+    def confidence(self, words: Set[str]) -> float:
+        """Share of the prompt's content words this template accounts for"""
+        return len(words & self.vocabulary) / len(words) if words else 0.0
+
+    def render(self, requirements: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        """(fenced artifact, validation report); rendered and validated once per distinct value set"""
+        values = {}
+        for name, default in self.vars.items():
+            value = requirements.get(name, default)
+            values[name] = value if isinstance(value, (str, int, float, bool)) else default
+        key = tuple(sorted(values.items()))
+        done = self._rendered.get(key)
+        if done is None:
+            language = KINDS[self.kind]
+            text = f"```{language}\n{render(self.body, values).rstrip()}\n```"
+            done = self._rendered[key] = (text, summarize(validate_blocks(extract_blocks(text, language)), language))
+        return done
+
+
+class TemplateLibrary:
+    """Templates loaded (and validated) from TEMPLATES_PATH; broken files are skipped and reported"""
+
+    def __init__(self, path: str = TEMPLATES_PATH, min_confidence: float = TEMPLATE_MIN_CONFIDENCE):
+        self.path = path
+        self.min_confidence = min_confidence
+        self.templates: List[Template] = []
+        self.errors: Dict[str, str] = {}
+        self.stats: Dict[str, int] = {"matched": 0, "missed": 0}
+        self.hits: Dict[str, int] = {}
+        for source in sorted(glob.glob(os.path.join(path, "*.yaml")) + glob.glob(os.path.join(path, "*.yml"))):
+            try:
+                with open(source) as f:
+                    spec = yaml.safe_load(f)
+                if not isinstance(spec, dict):
+                    raise TemplateError("not a mapping")
+                self.templates.append(Template(spec, source))
+            except (OSError, yaml.YAMLError, TemplateError) as e:
+                self.errors[os.path.basename(source)] = str(e)
+
+    def match(self, kind: str, prompt: str, requirements: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """The best template answer for a prompt, or None when no template covers it confidently.
+
+        Returns {"name", "confidence", "output", "report"}, report being the validation summary.
+        """
+        words = set(features(prompt))
+        best, best_score = None, 0.0
+        for template in self.templates:
+            if template.kind != kind or not template.fits(requirements, words):
+                continue
+            score = template.confidence(words)
+            # Ties go to the more specific template, the one naming more keywords
+            if score > best_score or (best is not None and score == best_score and len(template.keywords) > len(best.keywords)):
+                best, best_score = template, score
+        if best is None or best_score < self.min_confidence:
+            self.stats["missed"] += 1
+            return None
+        self.stats["matched"] += 1
+        self.hits[best.name] = self.hits.get(best.name, 0) + 1
+        output, report = best.render(requirements)
+        return {"name": best.name, "confidence": round(best_score, 2), "output": output, "report": report}
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "enabled": True,
+            "path": self.path,
+            "min_confidence": self.min_confidence,
+            "templates": [{"name": t.name, "kind": t.kind, "hits": self.hits.get(t.name, 0)} for t in self.templates],
+            "rejected": self.errors,
+            **self.stats,
+        }
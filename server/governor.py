@@ -0,0 +1,224 @@
+import asyncio
+import os
+import random
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+# Quota per model; 0 disables that bucket. Override per model with e.g. GEMINI_RPM_GEMINI_2_5_PRO=150
+DEFAULT_RPM = float(os.getenv("GEMINI_RPM", "0"))
+DEFAULT_TPM = float(os.getenv("GEMINI_TPM", "0"))
+MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "4"))
+BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "30"))
+# Seconds of quota a bucket may spend at once; a full minute's burst overruns sliding-window quotas
+QUOTA_BURST = float(os.getenv("GEMINI_QUOTA_BURST", "5"))
+# Floor for the adaptive concurrency limit
+MIN_CONCURRENCY = int(os.getenv("GEMINI_MIN_CONCURRENCY", "1"))
+
+THROTTLE_STATUS = {429}
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class QuotaExhausted(Exception):
+    """Upstream kept throttling after every retry"""
+
+    def __init__(self, model_name: str, retry_after: float, cause: BaseException):
+        super().__init__(f"{model_name} quota exhausted: {cause}")
+        self.model_name = model_name
+        self.retry_after = retry_after
+
+
+def model_setting(prefix: str, model_name: str, default: float) -> float:
+    """Per-model override such as GEMINI_RPM_GEMINI_2_5_FLASH, else the default"""
+    env_name = f"{prefix}_" + re.sub(r"[^A-Za-z0-9]", "_", model_name).upper()
+    return float(os.getenv(env_name, str(default)))
+
+
+def status_of(exc: BaseException) -> Optional[int]:
+    """HTTP status of an upstream error: google.api_core errors carry it as .code"""
+    for attr in ("code", "status_code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(exc, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """Server-requested delay from a Retry-After header or a gRPC RetryInfo detail"""
+    value = getattr(exc, "retry_after", None)
+    if isinstance(value, (int, float)):
+        return float(value)
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        header = headers.get("Retry-After") or headers.get("retry-after")
+        if header is not None:
+            return float(header)
+    except (TypeError, ValueError):
+        pass
+    for detail in getattr(exc, "details", None) or ():
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None:
+            return getattr(delay, "seconds", 0) + getattr(delay, "nanos", 0) / 1e9
+    return None
+
+
+def backoff(attempt: int, server_delay: Optional[float] = None) -> float:
+    """Full-jitter exponential delay, never shorter than what the server asked for"""
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+    if server_delay is not None:
+        # A little jitter on top keeps throttled callers from returning in lockstep
+        delay = server_delay + delay * 0.1
+    return delay
+
+
+class TokenBucket:
+    """Refills at per_minute / 60 per second, holding at most burst seconds' worth.
+
+    Waiters are served in arrival order. charge() may drive the balance negative, so
+    usage only known after a call still slows down the calls that follow it.
+    """
+
+    def __init__(self, per_minute: float, burst: float = QUOTA_BURST):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0):
+        if self.rate <= 0:
+            return
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def charge(self, amount: float):
+        if self.rate <= 0:
+            return
+        self._refill()
+        self.tokens -= amount
+
+
+class AdaptiveLimit:
+    """Concurrency limit that grows by about one per window of successes and halves on throttling"""
+
+    def __init__(self, maximum: int, minimum: int = MIN_CONCURRENCY):
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.limit = float(self.maximum)
+        self.in_use = 0
+        self._changed = asyncio.Condition()
+        self._last_decrease = 0.0
+        # Smoothed call latency: 429s within one round trip of a decrease are the same signal
+        self.latency = 1.0
+
+    async def __aenter__(self):
+        async with self._changed:
+            while self.in_use >= int(self.limit):
+                await self._changed.wait()
+            self.in_use += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        async with self._changed:
+            self.in_use -= 1
+            self._changed.notify(max(1, int(self.limit) - self.in_use))
+
+    def on_success(self, elapsed: float):
+        self.latency = 0.8 * self.latency + 0.2 * elapsed
+        self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def on_throttle(self):
+        now = time.monotonic()
+        if now - self._last_decrease >= self.latency:
+            self.limit = max(self.minimum, self.limit / 2)
+            self._last_decrease = now
+
+
+class Governor:
+    """Per-model RPM/TPM buckets, adaptive concurrency and retry with backoff"""
+
+    def __init__(self, model_name: str, max_concurrency: int):
+        self.model_name = model_name
+        self.requests = TokenBucket(model_setting("GEMINI_RPM", model_name, DEFAULT_RPM))
+        self.tokens = TokenBucket(model_setting("GEMINI_TPM", model_name, DEFAULT_TPM))
+        self.limit = AdaptiveLimit(max_concurrency)
+        self.max_retries = int(model_setting("GEMINI_MAX_RETRIES", model_name, MAX_RETRIES))
+        self.paused_until = 0.0
+        self.stats = {"calls": 0, "retries": 0, "throttled": 0, "server_errors": 0, "exhausted": 0}
+
+    async def admit(self, estimated_tokens: int):
+        """Wait for quota: any server-requested pause, then the RPM and TPM buckets"""
+        while self.paused_until > time.monotonic():
+            await asyncio.sleep(self.paused_until - time.monotonic())
+        await self.requests.acquire(1)
+        await self.tokens.acquire(estimated_tokens)
+
+    def settle(self, estimated_tokens: int, actual_tokens: int):
+        """Charge the TPM bucket the difference between the estimate and reported usage"""
+        if actual_tokens:
+            self.tokens.charge(actual_tokens - estimated_tokens)
+
+    def failed(self, exc: BaseException, attempt: int) -> Optional[float]:
+        """Delay before retrying exc, or None when it shouldn't be retried"""
+        status = status_of(exc)
+        if status not in RETRY_STATUS:
+            return None
+        server_delay = retry_after(exc)
+        if status in THROTTLE_STATUS:
+            self.stats["throttled"] += 1
+            self.limit.on_throttle()
+            # Everyone waits out the pause, not just this caller, so a 429 doesn't become a storm
+            pause = server_delay if server_delay is not None else random.uniform(0.5, 1.0) * BACKOFF_BASE
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+        else:
+            self.stats["server_errors"] += 1
+        if attempt >= self.max_retries:
+            self.stats["exhausted"] += 1
+            if status in THROTTLE_STATUS:
+                raise QuotaExhausted(self.model_name, server_delay or backoff(attempt), exc) from exc
+            return None
+        self.stats["retries"] += 1
+        return backoff(attempt, server_delay)
+
+    async def call(self, fn: Callable[[], Awaitable[Any]], estimated_tokens: int = 0) -> Any:
+        """Run fn under quota and concurrency control, retrying throttling and 5xx errors"""
+        attempt = 0
+        while True:
+            await self.admit(estimated_tokens)
+            self.stats["calls"] += 1
+            try:
+                async with self.limit:
+                    started = time.monotonic()
+                    result = await fn()
+            except Exception as e:
+                delay = self.failed(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            self.limit.on_success(time.monotonic() - started)
+            return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "concurrency_limit": round(self.limit.limit, 2),
+            "in_flight": self.limit.in_use,
+            "rpm_available": None if self.requests.rate <= 0 else round(self.requests.tokens, 1),
+            "tpm_available": None if self.tokens.rate <= 0 else round(self.tokens.tokens, 1),
+        }
@@ -0,0 +1,174 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional
+
+from metrics import HEDGES
+
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "0") not in ("0", "false", "no")
+# Fire the second call once the first has run longer than this quantile of recent latencies
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.9"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "1.0"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "200"))
+# Hedges may add at most this fraction of calls, plus a small burst allowance
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.05"))
+HEDGE_BURST = float(os.getenv("HEDGE_BURST", "3"))
+
+
+class Hedger:
+    """Tail-latency hedging for one model.
+
+    Each call first runs alone. If it hasn't finished (or, for streams, produced its first
+    chunk) within the recent latency quantile for its key, an identical second call starts and
+    whichever succeeds first wins; the other is cancelled. Every call earns HEDGE_BUDGET of a
+    hedge and each hedge spends one, so hedges stay near that fraction of traffic.
+    """
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self._latencies: Dict[Any, Deque[float]] = {}
+        self._budget = 0.0
+        self.stats = {"calls": 0, "fired": 0, "won": 0, "denied": 0}
+
+    def threshold(self, key: Any) -> Optional[float]:
+        samples = self._latencies.get(key)
+        if samples is None or len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, math.ceil(HEDGE_QUANTILE * len(ordered)) - 1)
+        return max(HEDGE_MIN_DELAY, ordered[index])
+
+    def observe(self, key: Any, seconds: float):
+        samples = self._latencies.get(key)
+        if samples is None:
+            samples = self._latencies[key] = deque(maxlen=HEDGE_WINDOW)
+        samples.append(seconds)
+
+    def _earn(self):
+        self.stats["calls"] += 1
+        self._budget = min(HEDGE_BURST, self._budget + HEDGE_BUDGET)
+
+    def _spend(self) -> bool:
+        if self._budget < 1:
+            self.stats["denied"] += 1
+            HEDGES.labels(self.model_name, "denied").inc()
+            return False
+        self._budget -= 1
+        self.stats["fired"] += 1
+        HEDGES.labels(self.model_name, "fired").inc()
+        return True
+
+    def _won(self):
+        self.stats["won"] += 1
+        HEDGES.labels(self.model_name, "won").inc()
+
+    async def call(self, key: Any, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run fn, hedging it with a second identical call if it runs past the threshold"""
+        self._earn()
+        delay = self.threshold(key)
+        started = time.monotonic()
+        primary = asyncio.ensure_future(fn())
+        tasks = [primary]
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and self._spend():
+                    tasks.append(asyncio.ensure_future(fn()))
+            hedge_started = time.monotonic()
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((t for t in done if t.exception() is None), None)
+                if winner is not None or not pending:
+                    break
+                # One call failed while the other is still going; let the other finish
+            if winner is None:
+                winner = done.pop()
+            result = winner.result()
+            if winner is primary:
+                self.observe(key, time.monotonic() - started)
+            else:
+                self._won()
+                self.observe(key, time.monotonic() - hedge_started)
+            return result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def stream(self, key: Any, factory: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """Yield from factory(), hedging on time to first chunk"""
+        self._earn()
+        delay = self.threshold(key)
+        started = time.monotonic()
+        streams = [factory()]
+        firsts = [asyncio.ensure_future(streams[0].__anext__())]
+        winner: Optional[int] = None
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(firsts, timeout=delay)
+                if not done and self._spend():
+                    streams.append(factory())
+                    firsts.append(asyncio.ensure_future(streams[1].__anext__()))
+            hedge_started = time.monotonic()
+            pending = set(firsts)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                ok = [t for t in done if t.exception() is None]
+                if ok or not pending:
+                    break
+            first_task = ok[0] if ok else done.pop()
+            winner = firsts.index(first_task)
+            first = first_task.result()
+            if winner == 0:
+                self.observe(key, time.monotonic() - started)
+            else:
+                self._won()
+                self.observe(key, time.monotonic() - hedge_started)
+        except StopAsyncIteration:
+            return
+        finally:
+            for i, task in enumerate(firsts):
+                if i != winner:
+                    task.cancel()
+                    await _close(task, streams[i])
+
+        stream = streams[winner]
+        try:
+            yield first
+            async for chunk in stream:
+                yield chunk
+        finally:
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+
+async def _close(task: asyncio.Future, stream: AsyncIterator[Any]):
+    """Stop a losing stream: wait out its cancelled first read, then close the generator"""
+    try:
+        await task
+    except BaseException:
+        pass
+    aclose = getattr(stream, "aclose", None)
+    if aclose is not None:
+        try:
+            await aclose()
+        except RuntimeError:
+            pass
+
+
+_hedgers: Dict[str, Hedger] = {}
+
+
+def hedger(model_name: str) -> Hedger:
+    h = _hedgers.get(model_name)
+    if h is None:
+        h = _hedgers[model_name] = Hedger(model_name)
+    return h
+
+
+def hedge_stats() -> Dict[str, Any]:
+    return {name: {**h.stats, "budget": round(h._budget, 2)} for name, h in _hedgers.items()}
@@ -0,0 +1,107 @@
+import json
+from typing import Any, List, Optional
+
+
+class StageScanner:
+    """Incremental scanner for a streamed JSON answer.
+
+    feed() takes text as it arrives and returns each element of the first "stages" array as
+    soon as that element's closing brace is seen, without re-parsing what came before. Text
+    before the first line starting with { or [ (prose, a ```json fence) and after the value
+    closes is ignored, so complete tells whether the answer was cut off mid-value.
+    """
+
+    def __init__(self, key: str = "stages"):
+        self.key = key
+        self.text = ""
+        self.start: Optional[int] = None
+        self.end: Optional[int] = None
+        self._pos = 0
+        # One frame per open container: [bracket, expecting a key, last key seen]
+        self._stack: List[list] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._array_depth: Optional[int] = None
+        self._array_done = False
+        self._element_start: Optional[int] = None
+
+    @property
+    def started(self) -> bool:
+        return self.start is not None
+
+    @property
+    def complete(self) -> bool:
+        return self.end is not None
+
+    def value(self) -> Optional[Any]:
+        """The parsed answer once complete, else None"""
+        if self.end is None:
+            return None
+        try:
+            return json.loads(self.text[self.start : self.end])
+        except ValueError:
+            return None
+
+    def _push(self, bracket: str):
+        self._stack.append([bracket, bracket == "{", None])
+
+    def feed(self, chunk: str) -> List[Any]:
+        self.text += chunk
+        text = self.text
+        found: List[Any] = []
+        i = self._pos
+        while i < len(text) and self.end is None:
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    frame = self._stack[-1]
+                    if frame[0] == "{" and frame[1]:
+                        frame[1] = False
+                        try:
+                            frame[2] = json.loads(text[self._string_start : i + 1])
+                        except ValueError:
+                            frame[2] = None
+            elif not self._stack:
+                # The value starts a line; a bracket mid-sentence is prose
+                if ch in "{[" and not text[text.rfind("\n", 0, i) + 1 : i].strip():
+                    self.start = i
+                    self._push(ch)
+            elif ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch == "[":
+                parent = self._stack[-1]
+                self._push(ch)
+                if self._array_depth is None and not self._array_done and parent[0] == "{" and parent[2] == self.key:
+                    self._array_depth = len(self._stack)
+            elif ch == "{":
+                if self._array_depth is not None and len(self._stack) == self._array_depth:
+                    self._element_start = i
+                self._push(ch)
+            elif ch in "}]":
+                self._stack.pop()
+                depth = len(self._stack)
+                if ch == "}" and self._element_start is not None and depth == self._array_depth:
+                    try:
+                        found.append(json.loads(text[self._element_start : i + 1]))
+                    except ValueError:
+                        pass
+                    self._element_start = None
+                elif ch == "]" and self._array_depth is not None and depth == self._array_depth - 1:
+                    self._array_depth = None
+                    self._array_done = True
+                if not self._stack:
+                    self.end = i + 1
+            elif ch == ",":
+                frame = self._stack[-1]
+                if frame[0] == "{":
+                    frame[1] = True
+            i += 1
+        self._pos = i
+        return found
@@ -1,15 +1,52 @@
+import asyncio
 import os
-from typing import Optional, List, Dict, Any
-from fastapi import FastAPI
-from pydantic import BaseModel
-import google.generativeai as genai
-import yaml
+import re
+import time
+import weakref
+from typing import Optional, List, Dict, Any, AsyncIterator, Awaitable, Callable, MutableMapping, Tuple
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field, ValidationError
 import json
 
-ALLOWED = {
-    "ci","cd","cicd","devops","devsecops","security","sdlc","release","terraform","ansible","jenkins","spinnaker",
-    "argo","argocd","workflows","rollouts","shell","bash","kubernetes","helm","process","processes"
-}
+from admission import (
+    ClientDisconnected,
+    DeadlineExceeded,
+    Overloaded,
+    admission,
+    admitted,
+    bounded_stream,
+    guard,
+    request_timeout,
+)
+from analyzer import analyze_prompt
+from fastpath import TEMPLATES_ENABLED, TemplateLibrary
+from cache import CACHE_ENABLED, ResponseCache, make_key
+from decompose import Part, build_part_prompt, footer, header, merge, overall_route, part_hcl, part_requirements, plan
+from semantic_cache import SEMANTIC_CACHE_ENABLED, SemanticCache, scope_key, threshold_for
+from singleflight import SINGLE_FLIGHT_ENABLED, SingleFlight, StreamFlight
+from tokens import estimate_tokens, start_input_count, token_usage
+from governor import QuotaExhausted
+from jsonstream import StageScanner
+from metrics import CONTENT_TYPE_LATEST, MetricsMiddleware, record_refusal, record_template, render, stage, worker_exited
+from profiler import ProfilerBusy, admin_allowed, collapsed, sample
+from retrieval import cite, format_references, references
+from retrieval import snapshot as retrieval_snapshot
+from router import DEFAULT_MODEL, ROUTER_ENABLED, ROUTER_TIERS, Route, cheapest_model, route
+from sessions import (
+    SESSION_HISTORY_TOKENS,
+    SESSION_ID_PATTERN,
+    SESSION_SUMMARIZE,
+    SESSION_SUMMARY_TOKENS,
+    SESSIONS_ENABLED,
+    Session,
+    SessionStore,
+    valid_session_id,
+)
+from upstream import SAFETY_SETTINGS, configure, generate, governor_stats, prewarm, stream_generate
+import validation
+from validation import validate
 
 SYSTEM_POLICY = (
     "You are a Responsible DevOps assistant. Only answer questions about CI/CD, DevOps, Terraform, Ansible, "
@@ -46,201 +83,137 @@ TERRAFORM_SYSTEM_PROMPT = (
     "Focus on technical implementation details and best practices for infrastructure as code."
 )
 
+REFUSAL = "Sorry, I can only assist with DevOps/CI/CD topics."
+CHAT_REFUSAL = "Sorry, I can only assist with DevOps/CI/CD topics (Terraform, Ansible, Jenkins, Spinnaker, Argo, DecSecOps, Shell)."
+
 class ChatIn(BaseModel):
     message: str
-    model: Optional[str] = "gemini-2.5-flash"
+    # Leave unset to let the router pick a model tier; naming a model pins it
+    model: Optional[str] = None
     temperature: Optional[float] = 0.4
     top_p: Optional[float] = 0.9
     max_output_tokens: Optional[int] = 2048
+    # Continue a server-side conversation from POST /chat/sessions: send only the new message
+    session_id: Optional[str] = Field(None, pattern=SESSION_ID_PATTERN)
 
 class AnsibleGenerateIn(BaseModel):
     prompt: str
-    model: Optional[str] = "gemini-2.5-flash"
+    model: Optional[str] = None
     temperature: Optional[float] = 0.2
     max_output_tokens: Optional[int] = 4096
+    # False always asks Gemini, even for prompts a local template covers
+    use_templates: Optional[bool] = True
 
 class TerraformGenerateIn(BaseModel):
     prompt: str
-    model: Optional[str] = "gemini-2.5-flash"
+    model: Optional[str] = None
     temperature: Optional[float] = 0.2
     max_output_tokens: Optional[int] = 4096
+    # False always asks Gemini, even for prompts a local template covers
+    use_templates: Optional[bool] = True
+    # Generate network/compute/data/load balancer parts concurrently and merge them; unset decides by size
+    decompose: Optional[bool] = None
 
 app = FastAPI()
+app.add_middleware(MetricsMiddleware)
 
+response_cache = ResponseCache() if CACHE_ENABLED else None
+semantic_cache = SemanticCache() if CACHE_ENABLED and SEMANTIC_CACHE_ENABLED else None
+generation_flights = SingleFlight() if SINGLE_FLIGHT_ENABLED else None
+stream_flights = StreamFlight() if SINGLE_FLIGHT_ENABLED else None
+chat_sessions = SessionStore() if SESSIONS_ENABLED else None
+templates = TemplateLibrary() if TEMPLATES_ENABLED else None
+CACHE_BYPASS_HEADER = "X-Cache-Bypass"
 
-def is_allowed(text: str) -> bool:
-    t = text.lower()
-    return any(k in t for k in ALLOWED)
-
-
-def extract_ansible_requirements(prompt: str) -> Dict[str, Any]:
-    """Extract Ansible requirements from user prompt"""
-    requirements = {
-        "target_hosts": "all",
-        "tasks": [],
-        "variables": {},
-        "handlers": [],
-        "roles": []
-    }
-    
-    prompt_lower = prompt.lower()
-    
-    # Detect target hosts
-    if "webserver" in prompt_lower or "web" in prompt_lower:
-        requirements["target_hosts"] = "webservers"
-    elif "database" in prompt_lower or "db" in prompt_lower:
-        requirements["target_hosts"] = "databases"
-    elif "load balancer" in prompt_lower or "lb" in prompt_lower:
-        requirements["target_hosts"] = "loadbalancers"
-    
-    # Detect common tasks
-    if "install" in prompt_lower or "package" in prompt_lower:
-        requirements["tasks"].append("package_installation")
-    if "configure" in prompt_lower or "config" in prompt_lower:
-        requirements["tasks"].append("configuration")
-    if "service" in prompt_lower or "start" in prompt_lower:
-        requirements["tasks"].append("service_management")
-    if "file" in prompt_lower or "copy" in prompt_lower:
-        requirements["tasks"].append("file_operations")
-    
-    return requirements
-
-
-def extract_terraform_requirements(prompt: str) -> Dict[str, Any]:
-    """Extract Terraform requirements from user prompt"""
-    requirements = {
-        "provider": "aws",
-        "resources": [],
-        "variables": [],
-        "outputs": []
-    }
-    
-    prompt_lower = prompt.lower()
-    
-    # Detect cloud provider
-    if "aws" in prompt_lower or "amazon" in prompt_lower:
-        requirements["provider"] = "aws"
-    elif "azure" in prompt_lower:
-        requirements["provider"] = "azure"
-    elif "gcp" in prompt_lower or "google" in prompt_lower:
-        requirements["provider"] = "google"
-    
-    # Detect resource types
-    if "ec2" in prompt_lower or "instance" in prompt_lower or "vm" in prompt_lower:
-        requirements["resources"].append("compute_instance")
-    if "vpc" in prompt_lower or "network" in prompt_lower:
-        requirements["resources"].append("network")
-    if "s3" in prompt_lower or "storage" in prompt_lower or "bucket" in prompt_lower:
-        requirements["resources"].append("storage")
-    if "rds" in prompt_lower or "database" in prompt_lower:
-        requirements["resources"].append("database")
-    if "load balancer" in prompt_lower or "alb" in prompt_lower:
-        requirements["resources"].append("load_balancer")
-    
-    return requirements
-
-
-@app.on_event("startup")
-def _setup_model():
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise RuntimeError("GEMINI_API_KEY not set in environment")
-    genai.configure(api_key=api_key)
-
-
-@app.post("/chat")
-def chat(inp: ChatIn):
-    if not is_allowed(inp.message):
-        return {
-            "output": "Sorry, I can only assist with DevOps/CI/CD topics (Terraform, Ansible, Jenkins, Spinnaker, Argo, DecSecOps, Shell).",
-            "tokens": {"input": 0, "output": 0, "total": 0},
-        }
-
-    model = genai.GenerativeModel(inp.model, system_instruction=SYSTEM_POLICY)
 
-    # Token counting is best-effort; not all SDK versions expose it consistently.
-    input_tokens = 0
-    try:
-        ct = model.count_tokens(inp.message)
-        input_tokens = getattr(ct, "total_tokens", 0) or (ct.get("total_tokens") if isinstance(ct, dict) else 0)
-    except Exception:
-        pass
+def response_text(resp, explain_finish: bool = True) -> str:
+    """Pull the generated text out of a Gemini response"""
+    with stage("parse"):
+        return _response_text(resp, explain_finish)
 
-    resp = model.generate_content(
-        inp.message,
-        generation_config={
-            "temperature": inp.temperature,
-            "top_p": inp.top_p,
-            "max_output_tokens": inp.max_output_tokens,
-        },
-        safety_settings=[
-            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        ],
-    )
 
-    # Handle Gemini API response properly
+def _response_text(resp, explain_finish: bool) -> str:
     try:
         if hasattr(resp, "text") and resp.text:
-            output_text = resp.text
+            return resp.text
         elif hasattr(resp, "parts") and resp.parts:
-            output_text = "".join([part.text for part in resp.parts if hasattr(part, "text") and part.text])
+            return "".join([part.text for part in resp.parts if hasattr(part, "text") and part.text])
         elif hasattr(resp, "candidates") and resp.candidates:
             # Handle response with candidates
             candidate = resp.candidates[0]
             if hasattr(candidate, "content") and candidate.content:
                 if hasattr(candidate.content, "parts"):
-                    output_text = "".join([part.text for part in candidate.content.parts if hasattr(part, "text") and part.text])
-                else:
-                    output_text = str(candidate.content)
-            else:
-                output_text = str(candidate)
+                    return "".join([part.text for part in candidate.content.parts if hasattr(part, "text") and part.text])
+                return str(candidate.content)
+            return str(candidate)
         elif hasattr(resp, "finish_reason"):
+            if not explain_finish:
+                return ""
             # Handle response with finish reason
             if resp.finish_reason == 1:  # SAFETY
-                output_text = "The request was blocked due to safety concerns. Please try rephrasing your request."
+                return "The request was blocked due to safety concerns. Please try rephrasing your request."
             elif resp.finish_reason == 2:  # RECITATION
-                output_text = "The response was blocked due to recitation concerns. Please try a different approach."
+                return "The response was blocked due to recitation concerns. Please try a different approach."
             elif resp.finish_reason == 3:  # OTHER
-                output_text = "The request could not be completed. Please try again."
-            else:
-                output_text = f"Response completed with finish reason: {resp.finish_reason}"
-        else:
-            output_text = str(resp)
+                return "The request could not be completed. Please try again."
+            return f"Response completed with finish reason: {resp.finish_reason}"
+        return str(resp)
     except Exception as e:
-        output_text = f"Error processing response: {str(e)}"
+        return f"Error processing response: {str(e)}" if explain_finish else ""
 
-    output_tokens = 0
-    try:
-        ct2 = model.count_tokens(output_text)
-        output_tokens = getattr(ct2, "total_tokens", 0) or (ct2.get("total_tokens") if isinstance(ct2, dict) else 0)
-    except Exception:
-        pass
+def sse(event: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-    return {
-        "output": output_text,
-        "tokens": {"input": input_tokens, "output": output_tokens, "total": (input_tokens + output_tokens)},
-    }
 
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
 
-@app.post("/ansible-generate")
-def generate_ansible_playbook(inp: AnsibleGenerateIn):
-    """Generate Ansible playbook based on user requirements"""
-    if not is_allowed(inp.prompt):
-        return {
-            "output": "Sorry, I can only assist with DevOps/CI/CD topics.",
-            "tokens": {"input": 0, "output": 0, "total": 0},
-        }
-    
-    # Extract requirements from prompt
-    requirements = extract_ansible_requirements(inp.prompt)
-    
-    # Create enhanced prompt for Gemini
-    enhanced_prompt = f"""
+
+ANSIBLE_FALLBACK = (
+    "```yaml\n"
+    "---\n"
+    "- name: Example Playbook (fallback)\n"
+    "  hosts: all\n"
+    "  become: true\n"
+    "  tasks:\n"
+    "    - name: Ensure Nginx is installed\n"
+    "      package:\n"
+    "        name: nginx\n"
+    "        state: present\n"
+    "    - name: Ensure Nginx is running\n"
+    "      service:\n"
+    "        name: nginx\n"
+    "        state: started\n"
+    "        enabled: true\n"
+    "```"
+)
+
+TERRAFORM_FALLBACK = (
+    "```hcl\n"
+    "terraform {\n  required_providers {\n    aws = { source = \"hashicorp/aws\", version = \"~> 5.0\" }\n  }\n}\n\nprovider \"aws\" { region = \"us-east-1\" }\n\nresource \"aws_vpc\" \"main\" {\n  cidr_block = \"10.0.0.0/16\"\n  tags = { Name = \"fallback-vpc\" }\n}\n\nresource \"aws_subnet\" \"public\" {\n  vpc_id                  = aws_vpc.main.id\n  cidr_block              = \"10.0.1.0/24\"\n  map_public_ip_on_launch = true\n}\n\nresource \"aws_instance\" \"web\" {\n  ami           = \"ami-0c94855ba95c71c99\"\n  instance_type = \"t2.micro\"\n  subnet_id     = aws_subnet.public.id\n  tags = { Name = \"fallback-ec2\" }\n}\n" 
+    "```"
+)
+
+
+def grounding(query: str) -> List[Dict[str, Any]]:
+    """Documentation snippets for a generator prompt from the local index; empty without one"""
+    with stage("retrieval"):
+        return references(query)
+
+
+def ansible_query(prompt: str, requirements: Dict[str, Any]) -> str:
+    return " ".join(["ansible", prompt, *requirements["tasks"]])
+
+
+def terraform_query(prompt: str, requirements: Dict[str, Any]) -> str:
+    return " ".join(["terraform", requirements["provider"], prompt, *requirements["resources"]])
+
+
+def build_ansible_prompt(prompt: str, requirements: Dict[str, Any], refs: Optional[List[Dict[str, Any]]] = None) -> str:
+    """Create enhanced prompt for Gemini"""
+    return format_references(refs or []) + f"""
 Generate a complete Ansible playbook based on these requirements:
-{inp.prompt}
+{prompt}
 
 Requirements extracted:
 - Target hosts: {requirements['target_hosts']}
@@ -257,113 +230,13 @@ Please provide:
 Format the response as a complete, ready-to-use Ansible playbook with proper YAML syntax.
 Focus on technical implementation and DevOps best practices.
 """
-    
-    model = genai.GenerativeModel(inp.model, system_instruction=ANSIBLE_SYSTEM_PROMPT)
-    
-    # Retry up to 2 times on safety/empty responses
-    attempts = 0
-    while attempts < 2:
-        resp = model.generate_content(
-            enhanced_prompt,
-            generation_config={
-                "temperature": inp.temperature,
-                "max_output_tokens": inp.max_output_tokens,
-            },
-            safety_settings=[
-                {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            ],
-        )
 
-        # Handle Gemini API response properly
-        try:
-            if hasattr(resp, "text") and resp.text:
-                output_text = resp.text
-            elif hasattr(resp, "parts") and resp.parts:
-                output_text = "".join([part.text for part in resp.parts if hasattr(part, "text") and part.text])
-            elif hasattr(resp, "candidates") and resp.candidates:
-                # Handle response with candidates
-                candidate = resp.candidates[0]
-                if hasattr(candidate, "content") and candidate.content:
-                    if hasattr(candidate.content, "parts"):
-                        output_text = "".join([part.text for part in candidate.content.parts if hasattr(part, "text") and part.text])
-                    else:
-                        output_text = str(candidate.content)
-                else:
-                    output_text = str(candidate)
-            elif hasattr(resp, "finish_reason"):
-                output_text = ""
-            else:
-                output_text = str(resp)
-        except Exception:
-            output_text = ""
 
-        if output_text:
-            break
-        attempts += 1
-
-    if not output_text:
-        output_text = (
-            "```yaml\n"
-            "---\n"
-            "- name: Example Playbook (fallback)\n"
-            "  hosts: all\n"
-            "  become: true\n"
-            "  tasks:\n"
-            "    - name: Ensure Nginx is installed\n"
-            "      package:\n"
-            "        name: nginx\n"
-            "        state: present\n"
-            "    - name: Ensure Nginx is running\n"
-            "      service:\n"
-            "        name: nginx\n"
-            "        state: started\n"
-            "        enabled: true\n"
-            "```"
-        )
-    
-    # Try to validate YAML if present
-    yaml_validation = "✅ Valid YAML format"
-    try:
-        # Extract YAML blocks if present
-        if "```yaml" in output_text:
-            yaml_start = output_text.find("```yaml") + 7
-            yaml_end = output_text.find("```", yaml_start)
-            if yaml_end > yaml_start:
-                yaml_content = output_text[yaml_start:yaml_end].strip()
-                yaml.safe_load(yaml_content)
-        elif "---" in output_text:
-            # Try to parse as YAML
-            yaml.safe_load(output_text)
-    except yaml.YAMLError as e:
-        yaml_validation = f"⚠️ YAML validation warning: {str(e)}"
-    
-    return {
-        "output": output_text,
-        "yaml_validation": yaml_validation,
-        "requirements": requirements,
-        "tokens": {"input": 0, "output": 0, "total": 0},  # Token counting for generation endpoints TBD
-    }
-
-
-@app.post("/terraform-generate")
-def generate_terraform_config(inp: TerraformGenerateIn):
-    """Generate Terraform configuration based on user requirements"""
-    if not is_allowed(inp.prompt):
-        return {
-            "output": "Sorry, I can only assist with DevOps/CI/CD topics.",
-            "tokens": {"input": 0, "output": 0, "total": 0},
-        }
-    
-    # Extract requirements from prompt
-    requirements = extract_terraform_requirements(inp.prompt)
-    
-    # Create enhanced prompt for Gemini
-    enhanced_prompt = f"""
+def build_terraform_prompt(prompt: str, requirements: Dict[str, Any], refs: Optional[List[Dict[str, Any]]] = None) -> str:
+    """Create enhanced prompt for Gemini"""
+    return format_references(refs or []) + f"""
 Generate a complete Terraform configuration based on these requirements:
-{inp.prompt}
+{prompt}
 
 Requirements extracted:
 - Cloud provider: {requirements['provider']}
@@ -380,98 +253,912 @@ Please provide:
 Format the response as a complete, ready-to-use Terraform configuration with proper HCL syntax.
 Focus on technical implementation and infrastructure as code best practices.
 """
-    
-    model = genai.GenerativeModel(inp.model, system_instruction=TERRAFORM_SYSTEM_PROMPT)
-    
-    resp = model.generate_content(
-        enhanced_prompt,
-        generation_config={
-            "temperature": inp.temperature,
-            "max_output_tokens": inp.max_output_tokens,
-        },
-        safety_settings=[
-            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        ],
-    )
-    
-    # Handle Gemini API response properly
-    try:
-        if hasattr(resp, "text") and resp.text:
-            output_text = resp.text
-        elif hasattr(resp, "parts") and resp.parts:
-            output_text = "".join([part.text for part in resp.parts if hasattr(part, "text") and part.text])
-        elif hasattr(resp, "candidates") and resp.candidates:
-            # Handle response with candidates
-            candidate = resp.candidates[0]
-            if hasattr(candidate, "content") and candidate.content:
-                if hasattr(candidate.content, "parts"):
-                    output_text = "".join([part.text for part in candidate.content.parts if hasattr(part, "text") and part.text])
-                else:
-                    output_text = str(candidate.content)
-            else:
-                output_text = str(candidate)
-        elif hasattr(resp, "finish_reason"):
-            # Handle response with finish reason
-            if resp.finish_reason == 1:  # SAFETY
-                output_text = "The request was blocked due to safety concerns. Please try rephrasing your request."
-            elif resp.finish_reason == 2:  # RECITATION
-                output_text = "The response was blocked due to recitation concerns. Please try a different approach."
-            elif resp.finish_reason == 3:  # OTHER
-                output_text = "The request could not be completed. Please try again."
-            else:
-                output_text = f"Response completed with finish reason: {resp.finish_reason}"
+
+
+async def validation_fields(output_text: str, expected: str, summary_field: str, cross_check: bool = False) -> Dict[str, Any]:
+    """Per-block validation of every fenced block, plus the one-line summary the UI shows"""
+    with stage("validation"):
+        report = await validate(output_text, expected, cross_check)
+    return {summary_field: report.pop("summary"), "validation": report}
+
+
+def _failed(checks: Optional[Dict[str, Any]], expected: str) -> bool:
+    """No answer, an answer with no block in the expected language, or one that doesn't parse"""
+    if checks is None:
+        return True
+    report = checks["validation"]
+    return report["valid"] is False or not any(b["language"] == expected for b in report["blocks"])
+
+
+async def cascade(
+    r: Route,
+    system_instruction: str,
+    contents: Any,
+    generation_config: Dict[str, Any],
+    expected: str,
+    summary_field: str,
+    retries: int = 0,
+):
+    """Generate on the routed tier, moving up a tier while the answer is empty or fails validation.
+
+    Returns (resp, generated text, validation fields or None when nothing was generated, token
+    usage). When no stronger tier is left, an empty answer is retried up to `retries` times on
+    the same model.
+    """
+    # An exact input count (if enabled) overlaps each tier's generation and is charged to that tier
+    input_task = start_input_count(r.model, system_instruction, contents)
+    while True:
+        resp = await generate(
+            r.model,
+            system_instruction,
+            contents,
+            generation_config=generation_config,
+            safety_settings=SAFETY_SETTINGS,
+        )
+        generated = response_text(resp, explain_finish=False)
+        checks = await validation_fields(generated, expected, summary_field) if generated else None
+        if not _failed(checks, expected):
+            break
+        if r.can_escalate():
+            tokens = await token_usage(r.model, system_instruction, contents, generated, resp, input_task)
+            r.escalate("invalid" if generated else "empty", tokens)
+            input_task = start_input_count(r.model, system_instruction, contents)
+        elif not generated and retries > 0:
+            retries -= 1
         else:
-            output_text = str(resp)
+            break
+    return resp, generated, checks, await token_usage(r.model, system_instruction, contents, generated, resp, input_task)
+
+
+async def stream_events(
+    model_name: str,
+    system_instruction: str,
+    contents: Any,
+    generation_config: Dict[str, Any],
+    finalize,
+    fallback: Optional[str] = None,
+    flight_key: Optional[str] = None,
+):
+    """Relay streamed chunks as SSE, then a final `done` event built by finalize(output_text, tokens),
+    which may be a coroutine function.
+
+    With a flight_key, identical concurrent streams share one upstream call.
+    """
+    def upstream_chunks():
+        return stream_generate(
+            model_name, system_instruction, contents, generation_config, safety_settings=SAFETY_SETTINGS
+        )
+
+    if flight_key is not None and stream_flights is not None:
+        chunks, _ = stream_flights.stream(flight_key, upstream_chunks)
+    else:
+        chunks = upstream_chunks()
+
+    parts: List[str] = []
+    last = None
+    try:
+        async for chunk in chunks:
+            last = chunk
+            text = response_text(chunk, explain_finish=False)
+            if text:
+                parts.append(text)
+                yield sse("chunk", {"text": text})
     except Exception as e:
-        output_text = f"Error processing response: {str(e)}"
-    
-    # Try to validate HCL if present
-    hcl_validation = "✅ Valid HCL format"
+        yield sse("error", {"error": str(e)})
+        return
+
+    output_text = "".join(parts)
+    if not output_text and fallback:
+        output_text = fallback
+        yield sse("chunk", {"text": fallback})
+    tokens = await token_usage(model_name, system_instruction, contents, output_text, last)
+    done = finalize(output_text, tokens)
+    if asyncio.iscoroutine(done):
+        done = await done
+    yield sse("done", done)
+
+
+def cache_bypassed(request: Request) -> bool:
+    if request.headers.get(CACHE_BYPASS_HEADER, "").lower() in ("1", "true", "yes"):
+        return True
+    return "no-cache" in request.headers.get("Cache-Control", "").lower()
+
+
+async def cached_response(
+    headers: MutableMapping[str, str],
+    key: str,
+    endpoint: str,
+    prompt: str,
+    scope: str,
+    bypass: bool = False,
+) -> Optional[Dict[str, Any]]:
+    """Look up a stored generator response, exact key first then a near-duplicate prompt in the same scope"""
+    if response_cache is None:
+        return None
+    if bypass:
+        headers["X-Cache"] = "BYPASS"
+        return None
+    with stage("cache"):
+        return await _cache_lookup(headers, key, endpoint, prompt, scope)
+
+
+async def _cache_lookup(
+    headers: MutableMapping[str, str], key: str, endpoint: str, prompt: str, scope: str
+) -> Optional[Dict[str, Any]]:
+    hit = await response_cache.get(key)
+    if hit is not None:
+        headers["X-Cache"] = "HIT"
+        return dict(hit)
+    if semantic_cache is not None:
+        match = semantic_cache.lookup(scope, prompt, threshold_for(endpoint))
+        if match is not None:
+            hit = await response_cache.get(match[0])
+            if hit is not None:
+                headers["X-Cache"] = "SIMILAR"
+                headers["X-Cache-Similarity"] = f"{match[1]:.2f}"
+                return dict(hit)
+            # The response expired or was evicted; drop the stale index entry
+            semantic_cache.discard(match[0])
+    headers["X-Cache"] = "MISS"
+    return None
+
+
+async def store_response(key: str, result: Dict[str, Any], prompt: str, scope: str):
+    if response_cache is None:
+        return
+    await response_cache.set(key, result)
+    if semantic_cache is not None:
+        semantic_cache.add(scope, prompt, key)
+
+
+async def coalesced(
+    key: str,
+    produce: Callable[[], Awaitable[Dict[str, Any]]],
+    headers: Optional[MutableMapping[str, str]] = None,
+) -> Dict[str, Any]:
+    """Run produce() once for all concurrent identical requests, in one admission slot"""
+    if generation_flights is None:
+        return await admitted(produce)
+    result, shared = await generation_flights.do(key, lambda: admitted(produce))
+    if shared and headers is not None:
+        headers["X-Coalesced"] = "1"
+    return dict(result)
+
+
+def guardrail(text: str) -> Dict[str, Any]:
+    """Topic guardrail and requirement extraction, which share one scan of the prompt"""
+    with stage("guardrail"):
+        analysis = analyze_prompt(text)
+    if not analysis["allowed"]:
+        record_refusal()
+    return analysis
+
+
+async def guarded(request: Request, endpoint: str, work: Awaitable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Answer within the request's deadline, abandoning the work if the client disconnects"""
+    return await guard(request.receive, request_timeout(request.headers, endpoint), work)
+
+
+async def sse_response(
+    request: Request, endpoint: str, events: AsyncIterator[str], flight_key: Optional[str] = None
+) -> StreamingResponse:
+    """Admit a generation stream (or shed it with 503) and end it with an error event at its deadline.
+
+    A stream joining an identical one in flight (same flight_key) only replays it, so it takes no slot.
+    """
+    timeout = request_timeout(request.headers, endpoint)
+    joining = flight_key is not None and stream_flights is not None and stream_flights.joining(flight_key)
+    release = await admission.enter(within=timeout) if admission is not None and not joining else None
+    body = bounded_stream(events, timeout, lambda: sse("error", {"error": f"request deadline of {timeout:g}s exceeded"}), release)
+    if release is not None:
+        # Streams the server never starts (client gone first) still give their slot back
+        weakref.finalize(body, release)
+    return StreamingResponse(
+        body,
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+        background=BackgroundTask(release) if release is not None else None,
+    )
+
+
+def instant_stream(text: str, done: Dict[str, Any]) -> StreamingResponse:
+    """An answer known up front, as one chunk and its `done` event; never queued for admission"""
+    async def events():
+        yield sse("chunk", {"text": text})
+        yield sse("done", done)
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+def refusal_stream(message: str) -> StreamingResponse:
+    return instant_stream(message, {"tokens": {"input": 0, "output": 0, "total": 0}})
+
+
+def templated(kind: str, prompt: str, requirements: Dict[str, Any], summary_field: str, enabled: Optional[bool]) -> Optional[Dict[str, Any]]:
+    """A response rendered from a local template when one covers the prompt with high confidence.
+
+    Templates are validated when they load, so these answers skip the cache, admission and Gemini.
+    """
+    if templates is None or enabled is False:
+        return None
+    with stage("template"):
+        hit = templates.match(kind, prompt, requirements)
+    if hit is None:
+        return None
+    record_template(hit["name"])
+    report = dict(hit["report"])
+    return {
+        "output": hit["output"],
+        summary_field: report.pop("summary"),
+        "validation": report,
+        "requirements": requirements,
+        "references": [],
+        "tokens": {"input": 0, "output": 0, "total": 0},
+        "template": {"name": hit["name"], "confidence": hit["confidence"]},
+    }
+
+
+# Warm-up runs in the background after startup; /ready answers 503 until it has finished
+PREWARM_ENABLED = os.getenv("PREWARM_ENABLED", "1") not in ("0", "false", "no")
+# Open the upstream channel with one count_tokens call per model tier
+PREWARM_CONNECT = os.getenv("PREWARM_CONNECT", "1") not in ("0", "false", "no")
+
+readiness: Dict[str, Any] = {"ready": False}
+_warm_task: Optional[asyncio.Task] = None
+
+
+def warm_handles() -> List[tuple]:
+    """(model, system prompt) handles the endpoints will ask for first"""
+    models = ROUTER_TIERS if ROUTER_ENABLED and ROUTER_TIERS else [DEFAULT_MODEL]
+    prompts = [SYSTEM_POLICY, ANSIBLE_SYSTEM_PROMPT, TERRAFORM_SYSTEM_PROMPT, SPINNAKER_SYSTEM_PROMPT]
+    return [(model_name, prompt) for model_name in models for prompt in prompts]
+
+
+async def warm_up():
+    started = time.perf_counter()
     try:
-        # Basic HCL validation (check for common syntax patterns)
-        if "```hcl" in output_text or "```terraform" in output_text:
-            # Extract HCL blocks if present
-            hcl_start = output_text.find("```") + 3
-            hcl_end = output_text.find("```", hcl_start)
-            if hcl_end > hcl_start:
-                hcl_content = output_text[hcl_start:hcl_end].strip()
-                # Basic validation - check for required Terraform elements
-                if "terraform {" in hcl_content or "provider" in hcl_content or "resource" in hcl_content:
-                    pass  # Basic structure looks good
-                else:
-                    hcl_validation = "⚠️ HCL structure validation warning"
+        await validation.warm_up()
+        readiness["parsers"] = validation.parsers()
+        # Open the docs index now rather than on the first generation
+        readiness["retrieval"] = retrieval_snapshot()
+        if templates is not None:
+            readiness["templates"] = {"loaded": len(templates.templates), "rejected": templates.errors}
+        if PREWARM_ENABLED:
+            readiness["upstream"] = await prewarm(warm_handles(), connect=PREWARM_CONNECT)
     except Exception as e:
-        hcl_validation = f"⚠️ HCL validation warning: {str(e)}"
+        # A failed warm-up only costs the first requests their latency; serve anyway
+        readiness["error"] = f"{type(e).__name__}: {e}"
+    readiness["warm_seconds"] = round(time.perf_counter() - started, 3)
+    readiness["ready"] = True
+
+
+@app.on_event("startup")
+def _setup_model():
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        raise RuntimeError("GEMINI_API_KEY not set in environment")
+    configure(api_key)
+
+
+@app.on_event("startup")
+async def _start_warm_up():
+    global _warm_task
+    _warm_task = asyncio.create_task(warm_up())
+
+
+@app.on_event("shutdown")
+def _worker_exited():
+    worker_exited()
+    validation.shutdown()
+
+
+@app.exception_handler(Overloaded)
+async def _overloaded(request: Request, exc: Overloaded):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": str(exc.retry_after)})
+
+
+@app.exception_handler(DeadlineExceeded)
+async def _deadline_exceeded(request: Request, exc: DeadlineExceeded):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+
+@app.exception_handler(ClientDisconnected)
+async def _client_disconnected(request: Request, exc: ClientDisconnected):
+    # Nobody reads this; the status only shows up in logs and metrics
+    return Response(status_code=499)
+
+
+@app.exception_handler(QuotaExhausted)
+async def _quota_exhausted(request: Request, exc: QuotaExhausted):
+    # Pass Gemini's throttling on to the client instead of a bare 500
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))},
+    )
+
+
+SESSION_SUMMARY_PROMPT = (
+    "Summarize the DevOps conversation below so it can stand in for it later. Keep requirements, decisions, "
+    "names, versions, code identifiers and open questions; drop pleasantries. Reply with the summary only."
+)
+
+
+async def answer_chat(r: Route, contents: Any, generation_config: Dict[str, Any]) -> Tuple[Dict[str, Any], str]:
+    """One chat answer on the routed tier; returns (response body, generated text or "")"""
+    # Token counts come from usage metadata; exact input counting (if enabled) overlaps each tier's generation
+    input_task = start_input_count(r.model, SYSTEM_POLICY, contents)
+
+    while True:
+        resp = await generate(
+            r.model,
+            SYSTEM_POLICY,
+            contents,
+            generation_config=generation_config,
+            safety_settings=SAFETY_SETTINGS,
+        )
+        generated = response_text(resp, explain_finish=False)
+        # Chat has nothing to validate, so only an empty answer moves up a tier
+        if generated or not r.can_escalate():
+            break
+        r.escalate("empty", await token_usage(r.model, SYSTEM_POLICY, contents, generated, resp, input_task))
+        input_task = start_input_count(r.model, SYSTEM_POLICY, contents)
+
+    # Handle Gemini API response properly
+    output_text = generated or response_text(resp)
+
+    result = {
+        "output": output_text,
+        "tokens": await token_usage(r.model, SYSTEM_POLICY, contents, output_text, resp, input_task),
+        "route": r.served(),
+    }
+    return result, generated
+
+
+async def compact_session(session: Session, message: str) -> int:
+    """Fit the session's history to its token budget before the next turn; returns turns removed.
+
+    Removed turns are folded into the running summary when summarizing is on, else dropped.
+    """
+    dropped = session.compact(max(0, SESSION_HISTORY_TOKENS - estimate_tokens(message)))
+    if dropped and SESSION_SUMMARIZE:
+        transcript = "\n\n".join(f"{role}: {text}" for role, text in dropped)
+        if session.summary:
+            transcript = f"Earlier summary:\n{session.summary}\n\n{transcript}"
+        try:
+            with stage("summarize"):
+                resp = await generate(
+                    cheapest_model(),
+                    SESSION_SUMMARY_PROMPT,
+                    transcript,
+                    generation_config={"temperature": 0.2, "max_output_tokens": SESSION_SUMMARY_TOKENS},
+                    safety_settings=SAFETY_SETTINGS,
+                )
+            summary = response_text(resp, explain_finish=False)
+        except Exception:
+            # The turns are gone either way; the old summary still stands
+            summary = ""
+        if summary:
+            session.set_summary(summary)
+            # A longer summary can push history back over budget
+            dropped += session.compact(max(0, SESSION_HISTORY_TOKENS - estimate_tokens(message)))
+    return len(dropped)
+
+
+def session_info(session: Session, compacted: int) -> Dict[str, Any]:
+    return {
+        "id": session.id,
+        "turns": len(session.turns) // 2,
+        "history_tokens": session.history_tokens,
+        "compacted": compacted,
+        "summarized": bool(session.summary),
+    }
+
+
+async def run_chat(inp: ChatIn, headers: Optional[MutableMapping[str, str]] = None) -> Dict[str, Any]:
+    if not guardrail(inp.message)["allowed"]:
+        return {
+            "output": CHAT_REFUSAL,
+            "tokens": {"input": 0, "output": 0, "total": 0},
+        }
+
+    generation_config = {
+        "temperature": inp.temperature,
+        "top_p": inp.top_p,
+        "max_output_tokens": inp.max_output_tokens,
+    }
+    r = route("chat", inp.message, inp.model)
+
+    if inp.session_id and chat_sessions is not None:
+        # History differs per session, so session turns are neither coalesced nor cached
+        session = await open_session(inp.session_id)
+
+        async def turn() -> Dict[str, Any]:
+            async with session.lock:
+                with stage("session"):
+                    compacted = await compact_session(session, inp.message)
+                result, generated = await answer_chat(r, session.contents(inp.message), generation_config)
+                if generated:
+                    session.add("user", inp.message)
+                    session.add("model", generated)
+                result["session"] = session_info(session, compacted)
+                await chat_sessions.save(session)
+            return result
+
+        return await admitted(turn)
+
+    async def produce() -> Dict[str, Any]:
+        result, _ = await answer_chat(r, inp.message, generation_config)
+        return result
+
+    flight_key = make_key("chat", inp.message, inp.model, SYSTEM_POLICY, generation_config)
+    return await coalesced(flight_key, produce, headers)
+
+
+@app.post("/chat")
+async def chat(inp: ChatIn, request: Request, response: Response):
+    return await guarded(request, "chat", run_chat(inp, response.headers))
+
+
+async def open_session(session_id: str) -> Session:
+    session = await chat_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="unknown or expired session; start one with POST /chat/sessions")
+    return session
+
+
+async def session_stream(session: Session, message: str, r: Route, generation_config: Dict[str, Any]):
+    """Stream one session turn; the turn is kept only if the stream completes"""
+    async with session.lock:
+        with stage("session"):
+            compacted = await compact_session(session, message)
+
+        def finalize(output_text: str, tokens: Dict[str, int]) -> Dict[str, Any]:
+            if output_text:
+                session.add("user", message)
+                session.add("model", output_text)
+            return {"tokens": tokens, "route": r.served(), "session": session_info(session, compacted)}
+
+        async for event in stream_events(r.model, SYSTEM_POLICY, session.contents(message), generation_config, finalize):
+            yield event
+        await chat_sessions.save(session)
+
+
+@app.post("/chat/sessions")
+async def create_chat_session():
+    """Start a session; its id is minted here, so only whoever holds it can continue the conversation"""
+    if chat_sessions is None:
+        raise HTTPException(status_code=404, detail="chat sessions are disabled")
+    return {"session_id": (await chat_sessions.create()).id}
+
+
+@app.delete("/chat/sessions/{session_id}")
+async def delete_chat_session(session_id: str):
+    if chat_sessions is None or not valid_session_id(session_id):
+        return {"deleted": False}
+    return {"deleted": await chat_sessions.delete(session_id)}
+
+
+@app.get("/chat/sessions/stats")
+def chat_session_stats():
+    if chat_sessions is None:
+        return {"enabled": False}
+    return {"enabled": True, **chat_sessions.snapshot()}
+
+
+@app.post("/chat/stream")
+async def chat_stream(inp: ChatIn, request: Request):
+    """Stream a chat answer as Server-Sent Events"""
+    if not guardrail(inp.message)["allowed"]:
+        return refusal_stream(CHAT_REFUSAL)
+
+    generation_config = {"temperature": inp.temperature, "top_p": inp.top_p, "max_output_tokens": inp.max_output_tokens}
+    r = route("chat", inp.message, inp.model)
+    if inp.session_id and chat_sessions is not None:
+        session = await open_session(inp.session_id)
+        return await sse_response(request, "chat", session_stream(session, inp.message, r, generation_config))
+    flight_key = make_key("chat", inp.message, inp.model, SYSTEM_POLICY, generation_config)
+    events = stream_events(
+        r.model,
+        SYSTEM_POLICY,
+        inp.message,
+        generation_config,
+        finalize=lambda output_text, tokens: {"tokens": tokens, "route": r.served()},
+        flight_key=flight_key,
+    )
+    return await sse_response(request, "chat", events, flight_key)
+
+
+async def run_ansible(inp: AnsibleGenerateIn, headers: MutableMapping[str, str], bypass_cache: bool = False) -> Dict[str, Any]:
+    analysis = guardrail(inp.prompt)
+    if not analysis["allowed"]:
+        return {
+            "output": REFUSAL,
+            "tokens": {"input": 0, "output": 0, "total": 0},
+        }
+    
+    generation_config = {
+        "temperature": inp.temperature,
+        "max_output_tokens": inp.max_output_tokens,
+    }
+    # Requirements come from the same scan as the guardrail
+    requirements = analysis["ansible"]
+    local = templated("ansible", inp.prompt, requirements, "yaml_validation", inp.use_templates)
+    if local is not None:
+        return local
+    r = route("ansible", inp.prompt, inp.model, requirements)
+
+    cache_key = make_key("ansible", inp.prompt, inp.model, ANSIBLE_SYSTEM_PROMPT, generation_config)
+    cache_scope = scope_key("ansible", inp.model, generation_config, requirements)
+    cached = await cached_response(headers, cache_key, "ansible", inp.prompt, cache_scope, bypass_cache)
+    if cached is not None:
+        return cached
+
+    async def produce() -> Dict[str, Any]:
+        refs = grounding(ansible_query(inp.prompt, requirements))
+        with stage("prompt"):
+            enhanced_prompt = build_ansible_prompt(inp.prompt, requirements, refs)
     
-    if not output_text:
-        output_text = (
-            "```hcl\n"
-            "terraform {\n  required_providers {\n    aws = { source = \"hashicorp/aws\", version = \"~> 5.0\" }\n  }\n}\n\nprovider \"aws\" { region = \"us-east-1\" }\n\nresource \"aws_vpc\" \"main\" {\n  cidr_block = \"10.0.0.0/16\"\n  tags = { Name = \"fallback-vpc\" }\n}\n\nresource \"aws_subnet\" \"public\" {\n  vpc_id                  = aws_vpc.main.id\n  cidr_block              = \"10.0.1.0/24\"\n  map_public_ip_on_launch = true\n}\n\nresource \"aws_instance\" \"web\" {\n  ami           = \"ami-0c94855ba95c71c99\"\n  instance_type = \"t2.micro\"\n  subnet_id     = aws_subnet.public.id\n  tags = { Name = \"fallback-ec2\" }\n}\n" 
-            "```"
+        # Empty or invalid answers move up a tier; on the top tier, retry once more on safety/empty responses
+        resp, output_text, checks, tokens = await cascade(
+            r, ANSIBLE_SYSTEM_PROMPT, enhanced_prompt, generation_config, "yaml", "yaml_validation", retries=1
         )
+
+        generated = bool(output_text)
+        if not output_text:
+            output_text = ANSIBLE_FALLBACK
+            checks = await validation_fields(output_text, "yaml", "yaml_validation")
     
-    return {
+        result = {
+            "output": output_text,
+            **checks,
+            "requirements": requirements,
+            "references": cite(refs),
+            "tokens": tokens,
+            "route": r.served(),
+        }
+        # Fallback playbooks are never cached so the next request retries Gemini
+        if generated:
+            await store_response(cache_key, result, inp.prompt, cache_scope)
+        return result
+
+    return await coalesced(cache_key, produce, headers)
+
+
+@app.post("/ansible-generate")
+async def generate_ansible_playbook(inp: AnsibleGenerateIn, request: Request, response: Response):
+    """Generate Ansible playbook based on user requirements"""
+    return await guarded(request, "ansible", run_ansible(inp, response.headers, cache_bypassed(request)))
+
+
+@app.post("/ansible-generate/stream")
+async def generate_ansible_playbook_stream(inp: AnsibleGenerateIn, request: Request):
+    """Stream an Ansible playbook as Server-Sent Events"""
+    analysis = guardrail(inp.prompt)
+    if not analysis["allowed"]:
+        return refusal_stream(REFUSAL)
+
+    requirements = analysis["ansible"]
+    local = templated("ansible", inp.prompt, requirements, "yaml_validation", inp.use_templates)
+    if local is not None:
+        return instant_stream(local.pop("output"), local)
+    generation_config = {"temperature": inp.temperature, "max_output_tokens": inp.max_output_tokens}
+    r = route("ansible", inp.prompt, inp.model, requirements)
+    refs = grounding(ansible_query(inp.prompt, requirements))
+
+    async def finalize(output_text: str, tokens: Dict[str, int]) -> Dict[str, Any]:
+        return {
+            **await validation_fields(output_text, "yaml", "yaml_validation"),
+            "requirements": requirements,
+            "references": cite(refs),
+            "tokens": tokens,
+            "route": r.served(),
+        }
+
+    flight_key = make_key("ansible", inp.prompt, inp.model, ANSIBLE_SYSTEM_PROMPT, generation_config)
+    events = stream_events(
+        r.model,
+        ANSIBLE_SYSTEM_PROMPT,
+        build_ansible_prompt(inp.prompt, requirements, refs),
+        generation_config,
+        finalize=finalize,
+        fallback=ANSIBLE_FALLBACK,
+        flight_key=flight_key,
+    )
+    return await sse_response(request, "ansible", events, flight_key)
+
+
+async def run_terraform(inp: TerraformGenerateIn, headers: MutableMapping[str, str], bypass_cache: bool = False) -> Dict[str, Any]:
+    analysis = guardrail(inp.prompt)
+    if not analysis["allowed"]:
+        return {
+            "output": REFUSAL,
+            "tokens": {"input": 0, "output": 0, "total": 0},
+        }
+    
+    generation_config = {
+        "temperature": inp.temperature,
+        "max_output_tokens": inp.max_output_tokens,
+    }
+    # Requirements come from the same scan as the guardrail
+    requirements = analysis["terraform"]
+    local = templated("terraform", inp.prompt, requirements, "hcl_validation", inp.use_templates)
+    if local is not None:
+        return local
+    parts = plan(requirements, inp.decompose)
+    # A decomposed answer is a different artifact from a single-prompt one; they don't share cache entries
+    key_config = {**generation_config, "decompose": [part.name for part in parts]} if parts else generation_config
+
+    cache_key = make_key("terraform", inp.prompt, inp.model, TERRAFORM_SYSTEM_PROMPT, key_config)
+    cache_scope = scope_key("terraform", inp.model, key_config, requirements)
+    cached = await cached_response(headers, cache_key, "terraform", inp.prompt, cache_scope, bypass_cache)
+    if cached is not None:
+        return cached
+
+    if parts:
+        async def produce_parts() -> Dict[str, Any]:
+            result: Dict[str, Any] = {}
+            async for event, data in terraform_parts(inp.prompt, inp.model, requirements, parts, generation_config):
+                if event == "result":
+                    result = data
+            if all(part["generated"] for part in result["decomposition"]["parts"]):
+                await store_response(cache_key, result, inp.prompt, cache_scope)
+            return result
+
+        return await coalesced(cache_key, produce_parts, headers)
+
+    # Decomposed answers route each part on its own
+    r = route("terraform", inp.prompt, inp.model, requirements)
+
+    async def produce() -> Dict[str, Any]:
+        refs = grounding(terraform_query(inp.prompt, requirements))
+        with stage("prompt"):
+            enhanced_prompt = build_terraform_prompt(inp.prompt, requirements, refs)
+    
+        resp, generated, checks, tokens = await cascade(
+            r, TERRAFORM_SYSTEM_PROMPT, enhanced_prompt, generation_config, "hcl", "hcl_validation"
+        )
+    
+        # Handle Gemini API response properly; finish-reason notices are returned but not cached
+        output_text = generated or response_text(resp)
+        if checks is None:
+            checks = await validation_fields(output_text, "hcl", "hcl_validation")
+    
+        if not output_text:
+            output_text = TERRAFORM_FALLBACK
+    
+        result = {
+            "output": output_text,
+            **checks,
+            "requirements": requirements,
+            "references": cite(refs),
+            "tokens": tokens,
+            "route": r.served(),
+        }
+        if generated:
+            await store_response(cache_key, result, inp.prompt, cache_scope)
+        return result
+
+    return await coalesced(cache_key, produce, headers)
+
+
+async def terraform_parts(
+    prompt: str,
+    model: Optional[str],
+    requirements: Dict[str, Any],
+    parts: List[Part],
+    generation_config: Dict[str, Any],
+):
+    """Generate the parts of a decomposed configuration concurrently, yielding (event, data).
+
+    Events are chunk ({"text", "part"}): the shared header at once, each part's section as soon
+    as it is done, then the contract outputs; and finally result with the response body, whose
+    output holds the sections in plan order. Each part is routed, grounded and escalated on its
+    own, so the whole takes about as long as the slowest part.
+    """
+    async def generate_part(part):
+        started = time.perf_counter()
+        part_reqs = part_requirements(part, requirements)
+        r = route("terraform", prompt, model, part_reqs)
+        refs = grounding(terraform_query(prompt, part_reqs))
+        with stage("prompt"):
+            part_prompt = build_part_prompt(prompt, part, parts, requirements, format_references(refs))
+        resp, generated, _, tokens = await cascade(
+            r, TERRAFORM_SYSTEM_PROMPT, part_prompt, generation_config, "hcl", "hcl_validation"
+        )
+        report = {
+            "part": part.name,
+            "resources": part_reqs["resources"],
+            "generated": bool(generated),
+            "tokens": tokens,
+            "seconds": round(time.perf_counter() - started, 3),
+            "route": r.served(),
+        }
+        return part, part_hcl(part, generated), refs, report
+
+    tasks = [asyncio.ensure_future(generate_part(part)) for part in parts]
+    sections: Dict[str, str] = {}
+    reports: Dict[str, Dict[str, Any]] = {}
+    refs: Dict[str, Dict[str, Any]] = {}
+    try:
+        yield "chunk", {"text": "```hcl\n" + header(requirements), "part": "header"}
+        for next_done in asyncio.as_completed(tasks):
+            part, section, part_refs, report = await next_done
+            sections[part.name] = section
+            reports[part.name] = report
+            refs.update((ref["url"], ref) for ref in part_refs)
+            yield "chunk", {"text": section, "part": part.name}
+        yield "chunk", {"text": footer(parts, requirements) + "```", "part": "outputs"}
+    finally:
+        # Abandoned (error, deadline or disconnect): stop the parts still generating
+        for task in tasks:
+            task.cancel()
+
+    output_text = merge(parts, requirements, [sections[part.name] for part in parts])
+    tokens = {"input": 0, "output": 0, "total": 0}
+    for report in reports.values():
+        tokens = {k: tokens[k] + report["tokens"][k] for k in tokens}
+    yield "result", {
         "output": output_text,
-        "hcl_validation": hcl_validation,
+        # The parts only see the contract, so check that what they reference was actually declared
+        **await validation_fields(output_text, "hcl", "hcl_validation", cross_check=True),
         "requirements": requirements,
-        "tokens": {"input": 0, "output": 0, "total": 0},  # Token counting for generation endpoints TBD
+        "references": cite(list(refs.values())),
+        "tokens": tokens,
+        "route": overall_route([reports[part.name] for part in parts]),
+        "decomposition": {"parts": [reports[part.name] for part in parts]},
     }
 
 
+@app.post("/terraform-generate")
+async def generate_terraform_config(inp: TerraformGenerateIn, request: Request, response: Response):
+    """Generate Terraform configuration based on user requirements"""
+    return await guarded(request, "terraform", run_terraform(inp, response.headers, cache_bypassed(request)))
+
+
+@app.post("/terraform-generate/stream")
+async def generate_terraform_config_stream(inp: TerraformGenerateIn, request: Request):
+    """Stream a Terraform configuration as Server-Sent Events"""
+    analysis = guardrail(inp.prompt)
+    if not analysis["allowed"]:
+        return refusal_stream(REFUSAL)
+
+    requirements = analysis["terraform"]
+    local = templated("terraform", inp.prompt, requirements, "hcl_validation", inp.use_templates)
+    if local is not None:
+        return instant_stream(local.pop("output"), local)
+    generation_config = {"temperature": inp.temperature, "max_output_tokens": inp.max_output_tokens}
+    parts = plan(requirements, inp.decompose)
+    if parts:
+        async def part_events():
+            try:
+                async for event, data in terraform_parts(inp.prompt, inp.model, requirements, parts, generation_config):
+                    if event == "result":
+                        data.pop("output")
+                        yield sse("done", data)
+                    else:
+                        yield sse(event, data)
+            except Exception as e:
+                yield sse("error", {"error": str(e)})
+
+        return await sse_response(request, "terraform", part_events())
+    r = route("terraform", inp.prompt, inp.model, requirements)
+    refs = grounding(terraform_query(inp.prompt, requirements))
+
+    async def finalize(output_text: str, tokens: Dict[str, int]) -> Dict[str, Any]:
+        return {
+            **await validation_fields(output_text, "hcl", "hcl_validation"),
+            "requirements": requirements,
+            "references": cite(refs),
+            "tokens": tokens,
+            "route": r.served(),
+        }
+
+    flight_key = make_key("terraform", inp.prompt, inp.model, TERRAFORM_SYSTEM_PROMPT, generation_config)
+    events = stream_events(
+        r.model,
+        TERRAFORM_SYSTEM_PROMPT,
+        build_terraform_prompt(inp.prompt, requirements, refs),
+        generation_config,
+        finalize=finalize,
+        fallback=TERRAFORM_FALLBACK,
+        flight_key=flight_key,
+    )
+    return await sse_response(request, "terraform", events, flight_key)
+
+
 @app.get("/")
 def root():
     return {"status": "ok", "service": "gemini-devops-bot"}
 
 
+@app.get("/ready")
+def ready():
+    """Readiness: 200 once the SDK, model handles, upstream channel and parser pool are warm"""
+    return JSONResponse(status_code=200 if readiness["ready"] else 503, content=readiness)
+
+
+@app.get("/singleflight/stats")
+def singleflight_stats():
+    if generation_flights is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "requests": {**generation_flights.stats, "in_flight": generation_flights.in_flight()},
+        "streams": {**stream_flights.stats, "in_flight": stream_flights.in_flight()},
+    }
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics, summed across workers when PROMETHEUS_MULTIPROC_DIR is set"""
+    return Response(render(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/upstream/stats")
+def upstream_stats():
+    return governor_stats()
+
+
+@app.get("/admission/stats")
+def admission_stats():
+    if admission is None:
+        return {"enabled": False}
+    return {"enabled": True, **admission.snapshot()}
+
+
+@app.get("/admin/profile")
+async def admin_profile(request: Request, seconds: float = 10, interval: Optional[float] = None, idle: bool = False):
+    """Sample this worker's stacks under live traffic; returns collapsed stacks for flamegraph.pl or speedscope"""
+    allowed = admin_allowed(request.headers)
+    if allowed is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not allowed:
+        raise HTTPException(status_code=401, detail="admin token required")
+    if seconds <= 0:
+        raise HTTPException(status_code=400, detail="seconds must be positive")
+    args = (seconds,) if interval is None else (seconds, max(0.001, interval))
+    try:
+        stacks, samples = await asyncio.to_thread(sample, *args, idle=idle)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(collapsed(stacks), headers={"X-Profile-Samples": str(samples), "X-Profile-Pid": str(os.getpid())})
+
+
+@app.get("/templates/stats")
+def templates_stats():
+    if templates is None:
+        return {"enabled": False}
+    return templates.snapshot()
+
+
+@app.get("/retrieval/stats")
+def retrieval_stats():
+    return retrieval_snapshot()
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    if response_cache is None:
+        return {"enabled": False}
+    stats = {"enabled": True, **response_cache.snapshot()}
+    if semantic_cache is not None:
+        stats["semantic"] = semantic_cache.snapshot()
+    return stats
+
+
 # --- Spinnaker Pipeline Generator ---
+# JSON mode asks Gemini for application/json output instead of relying on the prompt alone
+SPINNAKER_JSON_MODE = os.getenv("SPINNAKER_JSON_MODE", "1") not in ("0", "false", "no")
+# How many times a pipeline cut off at max_output_tokens is continued before giving up
+SPINNAKER_MAX_CONTINUATIONS = int(os.getenv("SPINNAKER_MAX_CONTINUATIONS", "2"))
+
+
 class SpinnakerGenerateIn(BaseModel):
     prompt: str
-    model: Optional[str] = "gemini-2.5-flash"
+    model: Optional[str] = None
     temperature: Optional[float] = 0.2
     max_output_tokens: Optional[int] = 4096
+    json_mode: Optional[bool] = None
 
 
 SPINNAKER_SYSTEM_PROMPT = (
@@ -480,25 +1167,252 @@ SPINNAKER_SYSTEM_PROMPT = (
     "Prefer parameters where reasonable. Return only JSON (no commentary)."
 )
 
+SPINNAKER_CONTINUE_PROMPT = (
+    "Your previous reply was cut off. Continue the JSON exactly where it stops. "
+    "Do not repeat anything, add commentary or open a code fence."
+)
+
+_LEADING_FENCE = re.compile(r"^\s*```[\w-]*[ \t]*\n?")
+
+
+def build_spinnaker_prompt(prompt: str, refs: Optional[List[Dict[str, Any]]] = None) -> str:
+    return format_references(refs or []) + (
+        "Generate a Spinnaker pipeline JSON for the following request.\n"
+        f"Requirements: {prompt}\n"
+        "Return only JSON."
+    )
+
+
+def spinnaker_config(inp: SpinnakerGenerateIn) -> Dict[str, Any]:
+    generation_config: Dict[str, Any] = {"temperature": inp.temperature, "max_output_tokens": inp.max_output_tokens}
+    if SPINNAKER_JSON_MODE if inp.json_mode is None else inp.json_mode:
+        generation_config["response_mime_type"] = "application/json"
+    return generation_config
+
+
+async def _single(response: Awaitable[Any]):
+    yield await response
+
+
+async def spinnaker_pipeline(
+    inp: SpinnakerGenerateIn, model_name: str, generation_config: Dict[str, Any], streaming: bool = True
+):
+    """Generate a pipeline, yielding (event, data) as it streams.
+
+    Events are chunk ({"text"}), stage ({"index", "stage"}) as each element of "stages" closes,
+    continued ({"continuations"}) when a pipeline cut off mid-JSON is resumed from where it
+    stopped, and finally result with the response body. Without streaming, each pass is one
+    generate call and arrives as a single chunk.
+    """
+    refs = grounding("spinnaker pipeline " + inp.prompt)
+    with stage("prompt"):
+        prompt = build_spinnaker_prompt(inp.prompt, refs)
+    scanner = StageScanner()
+    contents: Any = prompt
+    config = generation_config
+    tokens = {"input": 0, "output": 0, "total": 0}
+    stages = 0
+    continuations = 0
+    while True:
+        pass_parts: List[str] = []
+        last = None
+        if streaming:
+            chunks = stream_generate(model_name, SPINNAKER_SYSTEM_PROMPT, contents, config)
+        else:
+            chunks = _single(generate(model_name, SPINNAKER_SYSTEM_PROMPT, contents, config))
+        async for chunk in chunks:
+            last = chunk
+            text = response_text(chunk, explain_finish=False)
+            if continuations and not pass_parts:
+                text = _LEADING_FENCE.sub("", text)
+            if not text:
+                continue
+            pass_parts.append(text)
+            yield "chunk", {"text": text}
+            for element in scanner.feed(text):
+                yield "stage", {"index": stages, "stage": element}
+                stages += 1
+        usage = await token_usage(model_name, SPINNAKER_SYSTEM_PROMPT, contents, "".join(pass_parts), last)
+        tokens = {k: tokens[k] + usage[k] for k in tokens}
+
+        if scanner.complete or not scanner.started or continuations >= SPINNAKER_MAX_CONTINUATIONS:
+            break
+        # Cut off mid-value (usually max_output_tokens): ask for the rest rather than starting over.
+        # The continuation is a JSON suffix, not a JSON document, so it's requested as plain text.
+        continuations += 1
+        contents = [
+            {"role": "user", "parts": [prompt]},
+            {"role": "model", "parts": [scanner.text]},
+            {"role": "user", "parts": [SPINNAKER_CONTINUE_PROMPT]},
+        ]
+        config = {k: v for k, v in generation_config.items() if k != "response_mime_type"}
+        yield "continued", {"continuations": continuations}
+
+    pipeline = scanner.value()
+    output_text = scanner.text[scanner.start : scanner.end] if pipeline is not None else scanner.text
+    result = {
+        "output": output_text,
+        "pipeline": pipeline,
+        "truncated": scanner.started and not scanner.complete,
+        "continuations": continuations,
+        "references": cite(refs),
+        "tokens": tokens,
+    }
+    if output_text:
+        result.update(await validation_fields(output_text, "json", "json_validation"))
+    yield "result", result
+
+
+async def run_spinnaker(inp: SpinnakerGenerateIn, headers: MutableMapping[str, str], bypass_cache: bool = False) -> Dict[str, Any]:
+    if not guardrail(inp.prompt)["allowed"]:
+        return {"output": REFUSAL, "tokens": {"input": 0, "output": 0, "total": 0}}
+
+    generation_config = spinnaker_config(inp)
+    cache_key = make_key("spinnaker", inp.prompt, inp.model, SPINNAKER_SYSTEM_PROMPT, generation_config)
+    cache_scope = scope_key("spinnaker", inp.model, generation_config, {})
+    cached = await cached_response(headers, cache_key, "spinnaker", inp.prompt, cache_scope, bypass_cache)
+    if cached is not None:
+        return cached
+
+    r = route("spinnaker", inp.prompt, inp.model)
+
+    async def produce() -> Dict[str, Any]:
+        try:
+            while True:
+                async for event, data in spinnaker_pipeline(inp, r.model, generation_config, streaming=False):
+                    if event == "result":
+                        result = data
+                # A pipeline that doesn't parse even after continuations moves up a tier
+                if result["pipeline"] is not None or not r.escalate("invalid" if result["output"] else "empty", result["tokens"]):
+                    break
+        except (QuotaExhausted, Overloaded, DeadlineExceeded):
+            # Shed, throttled or late: the handlers answer 429/503/504 so clients back off and retry
+            raise
+        except Exception as e:
+            return {"output": f"Error generating Spinnaker pipeline: {str(e)}", "tokens": {"input": 0, "output": 0, "total": 0}}
+        result["route"] = r.served()
+
+        # Only pipelines that parsed are cached, so truncated or malformed answers are retried
+        if result["pipeline"] is not None:
+            await store_response(cache_key, result, inp.prompt, cache_scope)
+        return result
+
+    return await coalesced(cache_key, produce, headers)
+
 
 @app.post("/spinnaker-generate")
-def generate_spinnaker_pipeline(inp: SpinnakerGenerateIn):
-    if not is_allowed(inp.prompt):
-        return {"output": "Sorry, I can only assist with DevOps/CI/CD topics.", "tokens": {"input": 0, "output": 0, "total": 0}}
+async def generate_spinnaker_pipeline(inp: SpinnakerGenerateIn, request: Request, response: Response):
+    return await guarded(request, "spinnaker", run_spinnaker(inp, response.headers, cache_bypassed(request)))
+
+
+@app.post("/spinnaker-generate/stream")
+async def generate_spinnaker_pipeline_stream(inp: SpinnakerGenerateIn, request: Request):
+    """Stream a Spinnaker pipeline as Server-Sent Events, with a `stage` event as each stage completes"""
+    if not guardrail(inp.prompt)["allowed"]:
+        return refusal_stream(REFUSAL)
+
+    generation_config = spinnaker_config(inp)
+    r = route("spinnaker", inp.prompt, inp.model)
+
+    flight_key = make_key("spinnaker", inp.prompt, inp.model, SPINNAKER_SYSTEM_PROMPT, generation_config)
 
+    def pipeline_events():
+        return spinnaker_pipeline(inp, r.model, generation_config)
+
+    async def events():
+        if stream_flights is not None:
+            items, _ = stream_flights.stream(flight_key, pipeline_events)
+        else:
+            items = pipeline_events()
+        try:
+            async for event, data in items:
+                if event == "result":
+                    yield sse("done", {**data, "route": r.served()})
+                else:
+                    yield sse(event, data)
+        except Exception as e:
+            yield sse("error", {"error": str(e)})
+
+    return await sse_response(request, "spinnaker", events(), flight_key)
+
+
+# --- Batch Generation ---
+BATCH_MAX_JOBS = int(os.getenv("BATCH_MAX_JOBS", "200"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+
+# job type -> (input model, runner(inp, headers, bypass_cache))
+BATCH_RUNNERS = {
+    "chat": (ChatIn, lambda inp, headers, bypass_cache: run_chat(inp, headers)),
+    "ansible": (AnsibleGenerateIn, run_ansible),
+    "terraform": (TerraformGenerateIn, run_terraform),
+    "spinnaker": (SpinnakerGenerateIn, run_spinnaker),
+}
+
+
+class BatchJob(BaseModel):
+    type: str
+    input: Dict[str, Any]
+    id: Optional[str] = None
+
+
+class BatchGenerateIn(BaseModel):
+    jobs: List[BatchJob]
+    concurrency: Optional[int] = 8
+
+
+async def run_batch_job(index: int, job: BatchJob, bypass_cache: bool) -> Dict[str, Any]:
+    """Run one batch item; failures are reported on the item instead of raised"""
+    line: Dict[str, Any] = {"index": index, "id": job.id, "type": job.type}
+    started = time.perf_counter()
     try:
-        model = genai.GenerativeModel(inp.model, system_instruction=SPINNAKER_SYSTEM_PROMPT)
-        prompt = (
-            "Generate a Spinnaker pipeline JSON for the following request.\n"
-            f"Requirements: {inp.prompt}\n"
-            "Return only JSON."
-        )
-        resp = model.generate_content(
-            prompt,
-            generation_config={"temperature": inp.temperature, "max_output_tokens": inp.max_output_tokens},
-        )
-        output_text = resp.text if hasattr(resp, "text") and resp.text else str(resp)
+        if job.type not in BATCH_RUNNERS:
+            raise ValueError(f"unknown job type '{job.type}' (expected one of {', '.join(BATCH_RUNNERS)})")
+        model_cls, runner = BATCH_RUNNERS[job.type]
+        headers: Dict[str, str] = {}
+        result = await runner(model_cls(**job.input), headers, bypass_cache)
+        line.update(status="ok", result=result)
+        if "X-Cache" in headers:
+            line["cache"] = headers["X-Cache"]
+    except ValidationError as e:
+        line.update(status="error", error=f"invalid input: {e.errors(include_url=False)}")
     except Exception as e:
-        output_text = f"Error generating Spinnaker pipeline: {str(e)}"
+        line.update(status="error", error=str(e))
+    line["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return line
+
+
+@app.post("/batch-generate")
+async def batch_generate(inp: BatchGenerateIn, request: Request):
+    """Run generation jobs concurrently and stream each result as an NDJSON line as soon as it finishes"""
+    if len(inp.jobs) > BATCH_MAX_JOBS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_JOBS} jobs per batch")
+
+    limit = asyncio.Semaphore(max(1, min(inp.concurrency or 1, BATCH_MAX_CONCURRENCY)))
+    bypass_cache = cache_bypassed(request)
+
+    async def bounded(index: int, job: BatchJob) -> Dict[str, Any]:
+        async with limit:
+            return await run_batch_job(index, job, bypass_cache)
+
+    async def lines():
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(bounded(i, job)) for i, job in enumerate(inp.jobs)]
+        ok = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                line = await next_done
+                ok += line["status"] == "ok"
+                yield json.dumps(line) + "\n"
+            summary = {
+                "jobs": len(tasks),
+                "ok": ok,
+                "errors": len(tasks) - ok,
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            }
+            yield json.dumps({"summary": summary}) + "\n"
+        finally:
+            # Client went away or the stream ended early: don't leave jobs burning quota
+            for task in tasks:
+                task.cancel()
 
-    return {"output": output_text, "tokens": {"input": 0, "output": 0, "total": 0}}
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -0,0 +1,175 @@
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Send each response's per-stage durations in a Server-Timing header
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "1") not in ("0", "false", "no")
+# With several uvicorn workers, point this at an empty directory shared by all of them before start;
+# each worker writes its samples there and /metrics sums them
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Generations routinely take tens of seconds, so the buckets run well past the defaults
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+REQUEST_SECONDS = Histogram(
+    "devops_bot_request_seconds", "Request latency until the last body byte", ["endpoint"], buckets=LATENCY_BUCKETS
+)
+REQUESTS = Counter("devops_bot_requests_total", "Requests by endpoint and status code", ["endpoint", "status"])
+IN_FLIGHT = Gauge(
+    "devops_bot_requests_in_flight", "Requests being served", ["endpoint"], multiprocess_mode="livesum"
+)
+STAGE_SECONDS = Histogram(
+    "devops_bot_stage_seconds", "Time spent per request stage", ["endpoint", "stage"], buckets=LATENCY_BUCKETS
+)
+UPSTREAM_ERRORS = Counter("devops_bot_upstream_errors_total", "Failed Gemini calls by error type", ["model", "type"])
+FINISH_REASONS = Counter(
+    "devops_bot_finish_reasons_total", "Gemini responses by candidate finish_reason", ["model", "finish_reason"]
+)
+TOKENS = Counter("devops_bot_tokens_total", "Tokens per model", ["model", "direction"])
+REFUSALS = Counter("devops_bot_guardrail_refusals_total", "Prompts refused by the guardrail", ["endpoint"])
+ROUTED = Counter(
+    "devops_bot_routed_requests_total", "Requests by the model tier that answered them", ["endpoint", "model", "escalated"]
+)
+ESCALATIONS = Counter(
+    "devops_bot_escalations_total", "Answers that sent a request up a model tier", ["endpoint", "model", "reason"]
+)
+HEDGES = Counter(
+    "devops_bot_hedges_total", "Hedged Gemini calls: fired, won by the hedge, or denied by the budget", ["model", "outcome"]
+)
+TEMPLATED = Counter(
+    "devops_bot_templated_responses_total", "Answers rendered from a local template instead of Gemini", ["endpoint", "template"]
+)
+SHED = Counter("devops_bot_shed_requests_total", "Requests refused by admission control", ["endpoint", "reason"])
+ABANDONED = Counter(
+    "devops_bot_abandoned_requests_total", "Requests cancelled mid-generation: deadline or client disconnect", ["endpoint", "reason"]
+)
+
+# Route template of the request being served; tasks spawned for it inherit the value
+current_endpoint: contextvars.ContextVar[str] = contextvars.ContextVar("current_endpoint", default="other")
+# Seconds per stage of the request being served; spawned tasks share (and add to) the same dict
+request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block as one stage of the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(current_endpoint.get(), name).observe(elapsed)
+        timings = request_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def server_timing(timings: Dict[str, float], total: float) -> str:
+    """Server-Timing header value, in milliseconds; stages that ran concurrently may add up past total"""
+    parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items()]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+def record_refusal():
+    REFUSALS.labels(current_endpoint.get()).inc()
+
+
+def record_template(name: str):
+    TEMPLATED.labels(current_endpoint.get(), name).inc()
+
+
+def record_tokens(model_name: str, tokens: Dict[str, int]):
+    TOKENS.labels(model_name, "input").inc(tokens.get("input", 0))
+    TOKENS.labels(model_name, "output").inc(tokens.get("output", 0))
+
+
+def record_upstream_error(model_name: str, exc: BaseException):
+    UPSTREAM_ERRORS.labels(model_name, type(exc).__name__).inc()
+
+
+def record_finish(model_name: str, resp: Any):
+    """Count the finish_reason of a response's first candidate, if it has one"""
+    candidates = getattr(resp, "candidates", None)
+    if not candidates:
+        return
+    reason = getattr(candidates[0], "finish_reason", None)
+    if reason is None:
+        return
+    FINISH_REASONS.labels(model_name, getattr(reason, "name", str(reason))).inc()
+
+
+def render() -> bytes:
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def worker_exited():
+    """Drop this worker's live gauges from the shared directory"""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+class MetricsMiddleware:
+    """Per-endpoint latency, status and in-flight metrics; streamed bodies are timed to their end.
+
+    Also adds a Server-Timing header with the stages the request has been through by the time
+    its response starts: everything for JSON responses, the stages before the first byte for streams.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._paths: Optional[set] = None
+
+    def _endpoint(self, scope) -> str:
+        # Label only registered routes so stray paths can't blow up the label set
+        if self._paths is None:
+            self._paths = {getattr(route, "path", None) for route in scope["app"].routes}
+        path = scope["path"]
+        return path if path in self._paths else "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        endpoint = self._endpoint(scope)
+        token = current_endpoint.set(endpoint)
+        timings: Dict[str, float] = {}
+        timings_token = request_timings.set(timings)
+        status = {"code": 500}
+        started = time.perf_counter()
+        IN_FLIGHT.labels(endpoint).inc()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if SERVER_TIMING_ENABLED:
+                    value = server_timing(timings, time.perf_counter() - started).encode("latin-1")
+                    message = {**message, "headers": [*message.get("headers", ()), (b"server-timing", value)]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            IN_FLIGHT.labels(endpoint).dec()
+            REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+            REQUESTS.labels(endpoint, str(status["code"])).inc()
+            request_timings.reset(timings_token)
+            current_endpoint.reset(token)
+
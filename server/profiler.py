@@ -0,0 +1,81 @@
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Mapping, Optional, Tuple
+
+# Shared secret for /admin endpoints; they answer 404 while it is unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# Seconds between samples; 100 Hz costs well under 1% CPU with a handful of threads
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.01"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+# (file, function) of leaf frames that mean a thread is parked, not working
+IDLE_LEAVES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+_running = threading.Lock()
+
+
+def admin_allowed(headers: Mapping[str, str]) -> Optional[bool]:
+    """None when admin endpoints are off, else whether the request carries the admin token"""
+    if not ADMIN_TOKEN:
+        return None
+    auth = headers.get("Authorization", "")
+    token = auth[7:] if auth.startswith("Bearer ") else headers.get("X-Admin-Token", "")
+    return hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+class ProfilerBusy(Exception):
+    """Another profile is already running in this worker"""
+
+
+def sample(seconds: float, interval: float = PROFILE_INTERVAL, idle: bool = False) -> Tuple[Dict[str, int], int]:
+    """Sample every thread's Python stack for `seconds`; returns (collapsed stack -> count, samples).
+
+    Runs on its own thread, so the event loop keeps serving while it samples and shows up in
+    the profile like any other thread. Stacks are "thread;outer;...;inner", the folded format
+    flamegraph.pl and speedscope read. Parked threads are dropped unless idle is set.
+    """
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusy("a profile is already running")
+    try:
+        me = threading.get_ident()
+        labels: Dict[object, str] = {}
+        stacks: Counter = Counter()
+        samples = 0
+        ends = time.monotonic() + min(seconds, PROFILE_MAX_SECONDS)
+        while time.monotonic() < ends:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                code = frame.f_code
+                if not idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_LEAVES:
+                    continue
+                parts = []
+                while frame is not None:
+                    code = frame.f_code
+                    label = labels.get(code)
+                    if label is None:
+                        label = labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                    parts.append(label)
+                    frame = frame.f_back
+                parts.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(parts))] += 1
+            samples += 1
+            time.sleep(interval)
+        return dict(stacks), samples
+    finally:
+        _running.release()
+
+
+def collapsed(stacks: Dict[str, int]) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items(), key=lambda item: -item[1]))
@@ -0,0 +1,232 @@
+import json
+import math
+import mmap
+import os
+import shutil
+import time
+import zlib
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from semantic_cache import features
+from tokens import estimate_tokens
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "docs-index")
+
+RETRIEVAL_ENABLED = os.getenv("RETRIEVAL_ENABLED", "1") not in ("0", "false", "no")
+# Built by scripts/build_doc_index.py; without an index, prompts are sent ungrounded
+RETRIEVAL_INDEX_PATH = os.getenv("RETRIEVAL_INDEX_PATH", DEFAULT_PATH)
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+# Snippets added to one prompt stop at this many (estimated) tokens
+RETRIEVAL_TOKENS = int(os.getenv("RETRIEVAL_TOKENS", "600"))
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", "3.0"))
+RETRIEVAL_PER_SOURCE = int(os.getenv("RETRIEVAL_PER_SOURCE", "2"))
+
+INDEX_VERSION = 1
+CHUNK_WORDS = 120
+CHUNK_OVERLAP = 20
+# BM25 parameters; scores are precomputed per (term, chunk) at build time
+K1 = 1.2
+B = 0.75
+
+
+def term_hash(term: str) -> int:
+    return zlib.crc32(term.encode("utf-8"))
+
+
+def chunk_text(text: str, words: int = CHUNK_WORDS, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """Overlapping passages of about `words` words"""
+    tokens = text.split()
+    step = max(1, words - overlap)
+    return [" ".join(tokens[i : i + words]) for i in range(0, max(1, len(tokens) - overlap), step) if tokens[i : i + words]]
+
+
+def build_index(documents: Iterable[Dict[str, str]], path: str) -> Dict[str, Any]:
+    """Chunk documents ({"url", "title", "text"}) and write a BM25 index directory.
+
+    Postings are stored as flat arrays sorted by term hash, each with its precomputed BM25
+    score, so a query is a binary search per term plus one bincount. The directory is written
+    next to `path` and swapped in, so a running server never sees a half-built index.
+    """
+    sources: List[Dict[str, str]] = []
+    chunk_source: List[int] = []
+    texts: List[bytes] = []
+    term_counts: List[Counter] = []
+    for doc in documents:
+        passages = chunk_text(doc.get("text", ""))
+        if not passages:
+            continue
+        sources.append({"url": doc["url"], "title": doc.get("title") or doc["url"]})
+        for passage in passages:
+            counts = Counter(term_hash(t) for t in features(passage))
+            if not counts:
+                continue
+            chunk_source.append(len(sources) - 1)
+            texts.append(passage.encode("utf-8"))
+            term_counts.append(counts)
+
+    n = len(term_counts)
+    lengths = np.array([sum(c.values()) for c in term_counts], dtype=np.float64)
+    avgdl = float(lengths.mean()) if n else 0.0
+    df: Counter = Counter()
+    for counts in term_counts:
+        df.update(counts.keys())
+
+    postings_term, postings_doc, postings_score = [], [], []
+    for doc_id, counts in enumerate(term_counts):
+        norm = K1 * (1 - B + B * lengths[doc_id] / avgdl)
+        for term, tf in counts.items():
+            idf = math.log(1 + (n - df[term] + 0.5) / (df[term] + 0.5))
+            postings_term.append(term)
+            postings_doc.append(doc_id)
+            postings_score.append(idf * tf * (K1 + 1) / (tf + norm))
+
+    term_arr = np.array(postings_term, dtype=np.uint32)
+    order = np.argsort(term_arr, kind="stable")
+    term_arr = term_arr[order]
+    terms, starts = np.unique(term_arr, return_index=True)
+    ptr = np.append(starts, len(term_arr)).astype(np.int64)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum([len(t) for t in texts], out=offsets[1:])
+
+    tmp = path.rstrip("/") + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    np.save(os.path.join(tmp, "terms.npy"), terms.astype(np.uint32))
+    np.save(os.path.join(tmp, "ptr.npy"), ptr)
+    np.save(os.path.join(tmp, "docs.npy"), np.array(postings_doc, dtype=np.int32)[order])
+    np.save(os.path.join(tmp, "scores.npy"), np.array(postings_score, dtype=np.float32)[order])
+    np.save(os.path.join(tmp, "chunk_source.npy"), np.array(chunk_source, dtype=np.int32))
+    np.save(os.path.join(tmp, "offsets.npy"), offsets)
+    with open(os.path.join(tmp, "text.bin"), "wb") as f:
+        for t in texts:
+            f.write(t)
+    meta = {
+        "version": INDEX_VERSION,
+        "built": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "chunks": n,
+        "terms": int(len(terms)),
+        "postings": int(len(term_arr)),
+        "avgdl": round(avgdl, 2),
+        "sources": sources,
+    }
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    old = path.rstrip("/") + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, old)
+    os.rename(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+    return {k: v for k, v in meta.items() if k != "sources"} | {"sources": len(sources)}
+
+
+class DocIndex:
+    """Read-only BM25 index; arrays and text are memory-mapped, so workers share the page cache"""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"index version {self.meta.get('version')} != {INDEX_VERSION}; rebuild it")
+        load = lambda name: np.load(os.path.join(path, name), mmap_mode="r")  # noqa: E731
+        self.terms = load("terms.npy")
+        self.ptr = load("ptr.npy")
+        self.docs = load("docs.npy")
+        self.scores = load("scores.npy")
+        self.chunk_source = load("chunk_source.npy")
+        self.offsets = load("offsets.npy")
+        self.sources = self.meta["sources"]
+        with open(os.path.join(path, "text.bin"), "rb") as f:
+            self._text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    def text(self, chunk: int) -> str:
+        return bytes(self._text[int(self.offsets[chunk]) : int(self.offsets[chunk + 1])]).decode("utf-8")
+
+    def search(self, query: str, k: int = RETRIEVAL_TOP_K, per_source: int = RETRIEVAL_PER_SOURCE, min_score: float = 0.0) -> List[Dict[str, Any]]:
+        """Top chunks for a query by BM25, at most per_source from one page"""
+        n = len(self.offsets) - 1
+        hashes = np.unique(np.fromiter((term_hash(t) for t in features(query)), dtype=np.uint32))
+        if not n or not len(hashes) or not len(self.terms):
+            return []
+        at = np.searchsorted(self.terms, hashes)
+        inside = at < len(self.terms)
+        at = at[inside][self.terms[at[inside]] == hashes[inside]]
+        if not len(at):
+            return []
+        spans = [(int(self.ptr[i]), int(self.ptr[i + 1])) for i in at]
+        docs = np.concatenate([self.docs[s:e] for s, e in spans])
+        weights = np.concatenate([self.scores[s:e] for s, e in spans])
+        totals = np.bincount(docs, weights=weights, minlength=n)
+        # Enough candidates to fill k after the per-page cap
+        pool = min(n, k * max(1, per_source) * 4)
+        candidates = np.argpartition(-totals, pool - 1)[:pool] if pool < n else np.arange(n)
+        hits: List[Dict[str, Any]] = []
+        taken: Counter = Counter()
+        for chunk in candidates[np.argsort(-totals[candidates], kind="stable")]:
+            score = float(totals[chunk])
+            if score <= min_score or len(hits) >= k:
+                break
+            source = int(self.chunk_source[chunk])
+            if taken[source] >= per_source:
+                continue
+            taken[source] += 1
+            hits.append({**self.sources[source], "score": round(score, 2), "text": self.text(int(chunk))})
+        return hits
+
+
+_index: Optional[DocIndex] = None
+_index_error: Optional[str] = None
+
+
+def get_index() -> Optional[DocIndex]:
+    """The shared index, opened on first use; None when retrieval is off or no index is built"""
+    global _index, _index_error
+    if _index is None and _index_error is None and RETRIEVAL_ENABLED:
+        if not os.path.exists(os.path.join(RETRIEVAL_INDEX_PATH, "meta.json")):
+            _index_error = "no index built"
+        else:
+            try:
+                _index = DocIndex(RETRIEVAL_INDEX_PATH)
+            except (OSError, ValueError, KeyError) as e:
+                _index_error = str(e)
+    return _index
+
+
+def references(query: str, budget_tokens: int = RETRIEVAL_TOKENS, k: int = RETRIEVAL_TOP_K) -> List[Dict[str, Any]]:
+    """Best snippets for a prompt that fit in budget_tokens together"""
+    index = get_index()
+    if index is None or budget_tokens <= 0:
+        return []
+    picked, used = [], 0
+    for hit in index.search(query, k=k, min_score=RETRIEVAL_MIN_SCORE):
+        cost = estimate_tokens(hit["text"])
+        if used + cost > budget_tokens:
+            continue
+        picked.append(hit)
+        used += cost
+    return picked
+
+
+def format_references(refs: List[Dict[str, Any]]) -> str:
+    """Prompt section quoting the snippets with their sources"""
+    if not refs:
+        return ""
+    lines = ["Reference excerpts from official documentation (use where relevant, ignore otherwise):"]
+    for i, ref in enumerate(refs, 1):
+        lines.append(f"[{i}] {ref['title']} ({ref['url']}):\n{ref['text']}")
+    return "\n\n".join(lines) + "\n"
+
+
+def cite(refs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """What a response reports about the snippets its prompt was grounded on"""
+    return [{"url": r["url"], "title": r["title"], "score": r["score"]} for r in refs]
+
+
+def snapshot() -> Dict[str, Any]:
+    index = get_index()
+    if index is None:
+        return {"enabled": RETRIEVAL_ENABLED, "loaded": False, "error": _index_error}
+    return {"enabled": True, "loaded": True, **{k: v for k, v in index.meta.items() if k != "sources"}, "sources": len(index.sources)}
@@ -0,0 +1,92 @@
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from metrics import ESCALATIONS, ROUTED
+from tokens import estimate_tokens
+
+# Model tiers, cheapest and fastest first. Requests that name a model are pinned to it.
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "1") not in ("0", "false", "no")
+ROUTER_TIERS = [t.strip() for t in os.getenv("ROUTER_TIERS", "gemini-2.5-flash-lite,gemini-2.5-flash,gemini-2.5-pro").split(",") if t.strip()]
+# Model used when routing is off and the request doesn't name one
+DEFAULT_MODEL = os.getenv("GEMINI_DEFAULT_MODEL", "gemini-2.5-flash")
+# Each complexity signal moves the first attempt up one tier
+ROUTER_LONG_PROMPT_TOKENS = int(os.getenv("ROUTER_LONG_PROMPT_TOKENS", "400"))
+ROUTER_COMPLEX_ITEMS = int(os.getenv("ROUTER_COMPLEX_ITEMS", "3"))
+ROUTER_HARD_PROVIDERS = {p.strip() for p in os.getenv("ROUTER_HARD_PROVIDERS", "").split(",") if p.strip()}
+# How many times one request may move up a tier after an empty or invalid answer
+ROUTER_MAX_ESCALATIONS = int(os.getenv("ROUTER_MAX_ESCALATIONS", "1"))
+
+
+def start_tier(endpoint: str) -> int:
+    """Lowest tier for an endpoint, from ROUTER_START_<ENDPOINT> (default 0)"""
+    env_name = "ROUTER_START_" + re.sub(r"[^A-Za-z0-9]", "_", endpoint).upper()
+    return int(os.getenv(env_name, "0"))
+
+
+class Route:
+    """The model tier serving one request, and how it got there"""
+
+    def __init__(self, endpoint: str, tiers: List[str], tier: int, reasons: List[str], pinned: bool):
+        self.endpoint = endpoint
+        self.tiers = tiers
+        self.tier = tier
+        self.reasons = reasons
+        self.pinned = pinned
+        self.escalations: List[Dict[str, Any]] = []
+
+    @property
+    def model(self) -> str:
+        return self.tiers[self.tier]
+
+    def can_escalate(self) -> bool:
+        return (
+            not self.pinned
+            and self.tier + 1 < len(self.tiers)
+            and len(self.escalations) < ROUTER_MAX_ESCALATIONS
+        )
+
+    def escalate(self, reason: str, tokens: Optional[Dict[str, int]] = None) -> bool:
+        """Move to the next tier after an empty or invalid answer; False when there is none"""
+        if not self.can_escalate():
+            return False
+        ESCALATIONS.labels(self.endpoint, self.model, reason).inc()
+        self.escalations.append({"model": self.model, "reason": reason, "tokens": tokens})
+        self.tier += 1
+        return True
+
+    def served(self) -> Dict[str, Any]:
+        """Count the request against the tier that answered it; returns the response's route field"""
+        ROUTED.labels(self.endpoint, self.model, "true" if self.escalations else "false").inc()
+        return {
+            "model": self.model,
+            "tier": None if self.pinned else self.tier,
+            "reasons": self.reasons,
+            "escalations": self.escalations,
+        }
+
+
+def cheapest_model() -> str:
+    """Model for internal housekeeping calls, such as summarizing chat history"""
+    return ROUTER_TIERS[0] if ROUTER_ENABLED and ROUTER_TIERS else DEFAULT_MODEL
+
+
+def route(endpoint: str, prompt: str, requested: Optional[str] = None, requirements: Optional[Dict[str, Any]] = None) -> Route:
+    """Pick the first model tier for a request from its size and extracted requirements"""
+    if requested:
+        return Route(endpoint, [requested], 0, ["requested"], pinned=True)
+    if not ROUTER_ENABLED or not ROUTER_TIERS:
+        return Route(endpoint, [DEFAULT_MODEL], 0, ["default"], pinned=True)
+
+    reasons = []
+    if estimate_tokens(prompt) > ROUTER_LONG_PROMPT_TOKENS:
+        reasons.append("long_prompt")
+    if requirements:
+        items = len(requirements.get("resources") or []) + len(requirements.get("tasks") or [])
+        if items >= ROUTER_COMPLEX_ITEMS:
+            reasons.append("many_items")
+        provider = requirements.get("provider")
+        if provider in ROUTER_HARD_PROVIDERS:
+            reasons.append(f"provider:{provider}")
+    tier = min(len(ROUTER_TIERS) - 1, max(0, start_tier(endpoint)) + len(reasons))
+    return Route(endpoint, ROUTER_TIERS, tier, reasons, pinned=False)
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import re
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "1") not in ("0", "false", "no")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "100000"))
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+_PRIME = np.uint64((1 << 61) - 1)
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+# Filler words that don't change what gets generated
+STOPWORDS = {
+    "a", "an", "the", "to", "for", "on", "in", "of", "with", "and", "or", "into", "onto", "using", "use",
+    "me", "my", "our", "i", "we", "you", "please", "can", "could", "would", "should", "that", "which",
+    "create", "make", "write", "generate", "give", "build", "need", "want", "some", "all", "new",
+    "is", "are", "be", "it", "its", "this", "so", "sure", "just", "also",
+}
+# "es" is a plural ending only after a sibilant (boxes, patches); elsewhere (pages, services) just "s" is
+_SIBILANT_ES = re.compile(r"(?:[sxz]|ch|sh)es$")
+# Two-word spellings folded into one feature, so "web servers" and "webservers" match
+COMPOUNDS = {
+    ("web", "server"): "webserver",
+    ("load", "balancer"): "loadbalancer",
+    ("data", "base"): "database",
+    ("play", "book"): "playbook",
+    ("app", "server"): "appserver",
+    ("db", "server"): "dbserver",
+}
+
+
+# Words that only phrase a request. Every other content word (package and service names, instance types,
+# numbers, versions, OS names) is an entity, and a near-duplicate must name exactly the same entities:
+# "install apache" is not a rephrasing of "install nginx", however similar the rest of the prompt is.
+# Providers, resource kinds, hosts and task kinds are in the scope already, so they count as phrasing here.
+COMMON_WORDS = (
+    "install installation setup set up configure configuration config deploy deployment provision run running start "
+    "enable enabled ensure manage add update apply launch serve automate automation include provide define support "
+    "allow also just then via each every one single ansible playbook role task handler variable inventory terraform "
+    "module resource provider output hcl yaml code script file template example sample server host machine node "
+    "instance cluster environment service package application app web webserver database db network networking vpc "
+    "subnet bucket storage s3 ec2 rds alb lb loadbalancer load balancer vm compute aws amazon azure gcp google cloud "
+    "infrastructure simple basic quick standard default production ready complete full proper good best practice "
+    "practices work working way step steps copy is are be been it its this these those there sure type kind how what "
+    "do does has have will must so from at by as if any other it up out well like get got"
+).split()
+
+
+def _common(words: List[str]) -> frozenset:
+    return frozenset(features(" ".join(words + [word + "s" for word in words])))
+
+
+def entities(prompt: str) -> frozenset:
+    """Content words of a prompt that name something specific rather than phrase the request"""
+    return frozenset(features(prompt)) - _COMMON
+
+
+def threshold_for(endpoint: str) -> float:
+    """Similarity threshold for an endpoint, e.g. SEMANTIC_CACHE_THRESHOLD_TERRAFORM=0.9"""
+    return float(os.getenv(f"SEMANTIC_CACHE_THRESHOLD_{endpoint.upper()}", str(SEMANTIC_CACHE_THRESHOLD)))
+
+
+def scope_key(endpoint: str, model: str, generation_config: Dict[str, Any], requirements: Dict[str, Any]) -> str:
+    """Only prompts with the same endpoint, model, config and extracted requirements are compared"""
+    material = json.dumps([endpoint, model, generation_config, requirements], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(material.encode("utf-8")).hexdigest()
+
+
+def _stem(token: str) -> str:
+    """Crude suffix stripping that gives a word and its plural (and -ed/-ing forms) the same stem.
+
+    A final "e" goes too, so page/pages, cache/caches and configure/configured all agree.
+    """
+    if len(token) > 5 and token.endswith("ing"):
+        token = token[:-3]
+    elif len(token) > 4 and token.endswith("ed"):
+        token = token[:-2]
+    elif len(token) > 4 and _SIBILANT_ES.search(token):
+        token = token[:-2]
+    elif len(token) > 3 and token.endswith("s") and not token.endswith(("ss", "us")):
+        token = token[:-1]
+    if len(token) > 3 and token.endswith("e"):
+        token = token[:-1]
+    return token
+
+
+# Compounds are matched on stemmed tokens
+_COMPOUNDS = {(_stem(first), _stem(second)): word for (first, second), word in COMPOUNDS.items()}
+
+
+def features(prompt: str) -> List[str]:
+    """Stemmed content words of a prompt with known compounds folded together"""
+    tokens = [_stem(t) for t in _TOKEN.findall(prompt.lower()) if t not in STOPWORDS]
+    out: List[str] = []
+    i = 0
+    while i < len(tokens):
+        pair = _COMPOUNDS.get(tuple(tokens[i : i + 2]))
+        if pair:
+            out.append(pair)
+            i += 2
+        else:
+            out.append(tokens[i])
+            i += 1
+    return out
+
+
+_COMMON = _common(COMMON_WORDS)
+
+
+class SemanticCache:
+    """MinHash/LSH index from prompts to exact response-cache keys.
+
+    A candidate is served only when it names the same entities as the prompt (see COMMON_WORDS),
+    so similarity alone never swaps one package or instance size for another.
+    """
+
+    def __init__(self, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES):
+        rng = np.random.default_rng(20240818)
+        self._a = rng.integers(1, 1 << 31, NUM_PERM, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 31, NUM_PERM, dtype=np.uint64)
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[np.ndarray, List[tuple], frozenset]]" = OrderedDict()
+        self._buckets: Dict[tuple, List[str]] = {}
+        self.stats = {"hits": 0, "misses": 0, "indexed": 0, "evictions": 0, "entity_mismatches": 0}
+
+    def signature(self, prompt: str) -> Optional[np.ndarray]:
+        shingles = set(features(prompt))
+        if not shingles:
+            return None
+        hashes = np.fromiter((zlib.crc32(s.encode()) for s in shingles), dtype=np.uint64, count=len(shingles))
+        values = (hashes[:, None] * self._a + self._b) % _PRIME
+        return values.min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, scope: str, sig: np.ndarray) -> List[tuple]:
+        return [(scope, band, sig[band * ROWS : (band + 1) * ROWS].tobytes()) for band in range(BANDS)]
+
+    def lookup(self, scope: str, prompt: str, threshold: float) -> Optional[Tuple[str, float]]:
+        """Best (cache key, estimated Jaccard similarity) at or above threshold"""
+        sig = self.signature(prompt)
+        best: Optional[Tuple[str, float]] = None
+        if sig is not None:
+            named = entities(prompt)
+            seen = set()
+            for band_key in self._band_keys(scope, sig):
+                for key in self._buckets.get(band_key, ()):
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    stored, _, stored_entities = self._entries[key]
+                    similarity = float(np.count_nonzero(stored == sig)) / NUM_PERM
+                    if similarity < threshold or (best is not None and similarity <= best[1]):
+                        continue
+                    if stored_entities != named:
+                        self.stats["entity_mismatches"] += 1
+                        continue
+                    best = (key, similarity)
+        if best is None:
+            self.stats["misses"] += 1
+        else:
+            self.stats["hits"] += 1
+            self._entries.move_to_end(best[0])
+        return best
+
+    def add(self, scope: str, prompt: str, key: str):
+        sig = self.signature(prompt)
+        if sig is None or key in self._entries:
+            return
+        band_keys = self._band_keys(scope, sig)
+        self._entries[key] = (sig, band_keys, entities(prompt))
+        for band_key in band_keys:
+            self._buckets.setdefault(band_key, []).append(key)
+        self.stats["indexed"] += 1
+        while len(self._entries) > self.max_entries:
+            self.discard(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+    def discard(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for band_key in entry[1]:
+            bucket = self._buckets.get(band_key)
+            if bucket is None:
+                continue
+            bucket.remove(key)
+            if not bucket:
+                del self._buckets[band_key]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "entries": len(self._entries)}
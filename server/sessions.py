@@ -0,0 +1,352 @@
+import asyncio
+import json
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from tokens import estimate_tokens
+
+SESSIONS_ENABLED = os.getenv("CHAT_SESSIONS_ENABLED", "1") not in ("0", "false", "no")
+# Idle sessions are dropped after this many seconds, in memory and on disk
+SESSION_TTL = float(os.getenv("CHAT_SESSION_TTL", "3600"))
+SESSION_MAX_SESSIONS = int(os.getenv("CHAT_SESSION_MAX_SESSIONS", "10000"))
+# Hard cap on history bytes held in memory across all sessions of this worker
+SESSION_MEMORY_BYTES = int(os.getenv("CHAT_SESSION_MEMORY_BYTES", str(64 << 20)))
+# History (summary included) sent upstream with each turn is compacted to this many tokens
+SESSION_HISTORY_TOKENS = int(os.getenv("CHAT_SESSION_HISTORY_TOKENS", "6000"))
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "sessions.db")
+# SQLite file shared by all workers; every turn is written through, so any worker can serve the next one.
+# Empty keeps sessions in this worker's memory only, which needs sticky routing by session id with several workers
+SESSION_PATH = os.getenv("CHAT_SESSION_PATH", DEFAULT_PATH)
+# With a path, sessions idle this long leave memory even when under the caps
+SESSION_IDLE_SECONDS = float(os.getenv("CHAT_SESSION_IDLE_SECONDS", "300"))
+# Summarize turns compacted out of the history (one extra call on the cheapest tier) instead of dropping them
+SESSION_SUMMARIZE = os.getenv("CHAT_SESSION_SUMMARIZE", "0") not in ("0", "false", "no")
+SESSION_SUMMARY_TOKENS = int(os.getenv("CHAT_SESSION_SUMMARY_TOKENS", "512"))
+
+# Ids are minted by the server (POST /chat/sessions), so only their holder can read or extend a session
+SESSION_ID_PATTERN = r"^[A-Za-z0-9_-]{32}$"
+_SESSION_ID = re.compile(SESSION_ID_PATTERN)
+
+# Turns at least this long are stored zlib-compressed
+_COMPRESS_AT = 256
+# Rough fixed cost of a session and of a turn beyond their text
+_SESSION_OVERHEAD = 256
+_TURN_OVERHEAD = 64
+
+
+def _encode(text: str) -> bytes:
+    raw = text.encode("utf-8")
+    if len(raw) >= _COMPRESS_AT:
+        packed = zlib.compress(raw, 6)
+        if len(packed) < len(raw):
+            return b"z" + packed
+    return b"r" + raw
+
+
+def _decode(data: bytes) -> str:
+    return (zlib.decompress(data[1:]) if data[:1] == b"z" else data[1:]).decode("utf-8")
+
+
+def new_session_id() -> str:
+    return secrets.token_urlsafe(24)
+
+
+def valid_session_id(session_id: str) -> bool:
+    return bool(_SESSION_ID.match(session_id))
+
+
+def _pack(state: Dict[str, Any]) -> bytes:
+    return zlib.compress(json.dumps(state, separators=(",", ":")).encode("utf-8"))
+
+
+def _unpack(data: bytes) -> Dict[str, Any]:
+    return json.loads(zlib.decompress(data))
+
+
+class Session:
+    """One conversation: a rolling summary of compacted turns plus the turns still kept verbatim"""
+
+    __slots__ = ("id", "turns", "summary", "summary_tokens", "accessed", "lock", "version", "deleted", "added")
+
+    def __init__(self, session_id: str):
+        self.id = session_id
+        # (role, encoded text, estimated tokens); roles alternate user/model
+        self.turns: List[Tuple[str, bytes, int]] = []
+        self.summary = ""
+        self.summary_tokens = 0
+        self.accessed = time.time()
+        self.lock = asyncio.Lock()
+        # Version of the stored copy this state matches; 0 until first written
+        self.version = 0
+        self.deleted = False
+        # Turns added since the stored version, re-applied on top of it if another worker saved first
+        self.added: List[Tuple[str, bytes, int]] = []
+
+    @property
+    def size(self) -> int:
+        return _SESSION_OVERHEAD + len(self.summary) + sum(len(t[1]) + _TURN_OVERHEAD for t in self.turns)
+
+    @property
+    def history_tokens(self) -> int:
+        return self.summary_tokens + sum(t[2] for t in self.turns)
+
+    def add(self, role: str, text: str):
+        turn = (role, _encode(text), estimate_tokens(text))
+        self.turns.append(turn)
+        self.added.append(turn)
+
+    def set_summary(self, summary: str):
+        self.summary = summary
+        self.summary_tokens = estimate_tokens(summary) if summary else 0
+
+    def compact(self, budget: int) -> List[Tuple[str, str]]:
+        """Drop the oldest user/model pairs until history fits the budget; returns what was dropped"""
+        dropped = []
+        while self.turns and self.history_tokens > budget:
+            for _ in range(2 if len(self.turns) > 1 else 1):
+                role, data, _ = self.turns.pop(0)
+                dropped.append((role, _decode(data)))
+        return dropped
+
+    def contents(self, message: str) -> List[Dict[str, Any]]:
+        """Gemini contents for the next turn: summary, kept turns, then the new message"""
+        contents = []
+        if self.summary:
+            contents.append({"role": "user", "parts": ["Summary of our conversation so far:\n" + self.summary]})
+            contents.append({"role": "model", "parts": ["Understood."]})
+        contents.extend({"role": role, "parts": [_decode(data)]} for role, data, _ in self.turns)
+        contents.append({"role": "user", "parts": [message]})
+        return contents
+
+    def dump(self) -> bytes:
+        turns = [[role, _decode(data), tokens] for role, data, tokens in self.turns]
+        return _pack({"summary": self.summary, "summary_tokens": self.summary_tokens, "turns": turns})
+
+    def restore(self, data: bytes, version: int):
+        """Replace the history with a stored state, which already holds every added turn"""
+        state = _unpack(data)
+        self.summary = state["summary"]
+        self.summary_tokens = state["summary_tokens"]
+        self.turns = [(role, _encode(text), tokens) for role, text, tokens in state["turns"]]
+        self.version = version
+        self.added = []
+
+    @classmethod
+    def load(cls, session_id: str, data: bytes, accessed: float, version: int) -> "Session":
+        session = cls(session_id)
+        session.restore(data, version)
+        session.accessed = accessed
+        return session
+
+
+class SessionStore:
+    """Chat sessions: LRU with idle TTL, a session count and a memory cap, over an optional SQLite file.
+
+    With a path, the file is the source of truth: each saved turn is written through and each
+    turn reads the stored version, so workers sharing the file see each other's turns and memory
+    only caches what is current. A save only replaces the version its turn started from; if
+    another worker saved first, the turn is appended to that version instead, so no turn is lost.
+    Sessions pushed out by the caps, or idle for a while, just leave memory. Without one, sessions
+    live in this worker's memory only and evicted ones are dropped.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = SESSION_PATH,
+        ttl: float = SESSION_TTL,
+        max_sessions: int = SESSION_MAX_SESSIONS,
+        memory_bytes: int = SESSION_MEMORY_BYTES,
+        idle_seconds: float = SESSION_IDLE_SECONDS,
+    ):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.memory_bytes = memory_bytes
+        self.idle_seconds = idle_seconds
+        self._memory: "OrderedDict[str, Session]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.stats = {
+            "created": 0, "memory_hits": 0, "disk_hits": 0, "merged": 0, "expired": 0, "evicted": 0, "dropped": 0,
+        }
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("PRAGMA busy_timeout=5000")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions "
+                "(id TEXT PRIMARY KEY, data BLOB NOT NULL, accessed REAL NOT NULL, version INTEGER NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS sessions_accessed ON sessions(accessed)")
+
+    def _disk_get(self, session_id: str, now: float) -> Optional[Tuple[bytes, float, int]]:
+        """(data, accessed, version) of the stored session, or None when missing or expired"""
+        with self._lock:
+            row = self._db.execute("SELECT data, accessed, version FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is not None and row[1] + self.ttl <= now:
+                self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+                return None
+        return row
+
+    def _disk_put(self, session: Session, data: bytes) -> Optional[Tuple[int, Optional[bytes]]]:
+        """Store a session over the version it was loaded at: (new version, merged state or None).
+
+        When another worker saved a turn in between, this session's added turns are appended to
+        the stored history instead, and that merged state is returned. None means the session was
+        deleted (or expired) meanwhile, so there is nothing to write to.
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT data, version FROM sessions WHERE id = ?", (session.id,)).fetchone()
+                merged = None
+                if row is None and session.version:
+                    self._db.execute("ROLLBACK")
+                    return None
+                if row is None:
+                    self._db.execute(
+                        "INSERT INTO sessions (id, data, accessed, version) VALUES (?, ?, ?, 1)",
+                        (session.id, data, session.accessed),
+                    )
+                    version = 1
+                else:
+                    if row[1] != session.version:
+                        state = _unpack(row[0])
+                        state["turns"] += [[role, _decode(text), tokens] for role, text, tokens in session.added]
+                        data = merged = _pack(state)
+                    version = row[1] + 1
+                    # Compare-and-swap: the row can't change under the IMMEDIATE transaction, but say so anyway
+                    self._db.execute(
+                        "UPDATE sessions SET data = ?, accessed = ?, version = ? WHERE id = ? AND version = ?",
+                        (data, session.accessed, version, session.id, row[1]),
+                    )
+                self._db.execute("DELETE FROM sessions WHERE accessed <= ?", (session.accessed - self.ttl,))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return version, merged
+
+    def _disk_delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount > 0
+
+    def _forget(self, session_id: str) -> Optional[Session]:
+        session = self._memory.pop(session_id, None)
+        self._bytes -= self._sizes.pop(session_id, 0)
+        return session
+
+    async def create(self) -> Session:
+        """A new empty session under a freshly minted id"""
+        session = Session(new_session_id())
+        if self._db is not None:
+            session.version, _ = await asyncio.to_thread(self._disk_put, session, session.dump())
+        self._memory[session.id] = session
+        self._sizes[session.id] = 0
+        self.stats["created"] += 1
+        self._evict(keep=session.id)
+        return session
+
+    async def get(self, session_id: str) -> Optional[Session]:
+        """The current state of a session, from memory when it is up to date; None if there is none"""
+        now = time.time()
+        row = None
+        if self._db is not None:
+            row = await asyncio.to_thread(self._disk_get, session_id, now)
+        # Looked up after the read: a concurrent turn on this id may have loaded or created it meanwhile,
+        # and every turn on an id must share one Session (and its lock)
+        session = self._memory.get(session_id)
+        if session is not None and session.accessed + self.ttl <= now:
+            self._forget(session_id)
+            self.stats["expired"] += 1
+            session = None
+        if session is not None and self._db is not None and (row is None or row[2] > session.version):
+            # Deleted or expired by another worker, or it saved a newer version
+            self._forget(session_id)
+            session = None
+        if session is not None:
+            self._memory.move_to_end(session_id)
+            self.stats["memory_hits"] += 1
+        elif row is not None:
+            session = Session.load(session_id, row[0], row[1], row[2])
+            self.stats["disk_hits"] += 1
+        else:
+            return None
+        if session_id not in self._memory:
+            self._memory[session_id] = session
+            self._sizes[session_id] = 0
+        session.accessed = now
+        return session
+
+    async def save(self, session: Session):
+        """Store a session after a turn, then enforce the TTL and caps; call it while holding session.lock"""
+        if session.deleted:
+            return
+        if self._db is not None:
+            stored = await asyncio.to_thread(self._disk_put, session, session.dump())
+            if stored is None:
+                # Deleted by another worker while this turn ran
+                session.deleted = True
+                if self._memory.get(session.id) is session:
+                    self._forget(session.id)
+                return
+            session.version, merged = stored
+            if merged is not None:
+                session.restore(merged, session.version)
+                self.stats["merged"] += 1
+        session.added = []
+        if self._memory.get(session.id) is not session:
+            # Evicted before its turn took the lock; the stored copy is current
+            return
+        size = session.size
+        self._bytes += size - self._sizes[session.id]
+        self._sizes[session.id] = size
+        self._evict(keep=session.id)
+
+    def _evict(self, keep: Optional[str] = None):
+        now = time.time()
+        # Least recently used first, so the sweep can stop at the first session worth keeping
+        for session_id in list(self._memory):
+            session = self._memory[session_id]
+            if session.accessed + self.ttl <= now:
+                self._forget(session_id)
+                self.stats["expired"] += 1
+                continue
+            over = len(self._memory) > self.max_sessions or self._bytes > self.memory_bytes
+            idle = self._db is not None and session.accessed + self.idle_seconds <= now
+            if not over and not idle:
+                break
+            if session_id == keep or session.lock.locked():
+                # Mid-turn; it is accounted again when its turn saves
+                continue
+            self._forget(session_id)
+            # With a file, the stored copy is current and the next turn reads it back
+            self.stats["evicted" if self._db is not None else "dropped"] += 1
+
+    async def delete(self, session_id: str) -> bool:
+        session = self._forget(session_id)
+        if session is not None:
+            session.deleted = True
+        found = session is not None
+        if self._db is not None:
+            found = await asyncio.to_thread(self._disk_delete, session_id) or found
+        return found
+
+    def snapshot(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = dict(self.stats)
+        out["memory_sessions"] = len(self._memory)
+        out["memory_bytes"] = self._bytes
+        if self._db is not None:
+            with self._lock:
+                out["disk_sessions"] = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return out
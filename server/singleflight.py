@@ -0,0 +1,137 @@
+import asyncio
+import os
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "1") not in ("0", "false", "no")
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Concurrent callers with the same key share one in-flight call and its result.
+
+    The call runs in its own task, so the first caller disconnecting doesn't fail the
+    others; it is only cancelled once every caller has gone. Errors reach every caller
+    and the key is forgotten, so the next request retries.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self.stats = {"leaders": 0, "coalesced": 0, "errors": 0, "abandoned": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Return (result, shared), where shared is True when this caller joined an existing call"""
+        call = self._calls.get(key)
+        shared = call is not None
+        if call is None:
+            call = _Call(asyncio.create_task(fn()))
+            self._calls[key] = call
+            self.stats["leaders"] += 1
+            call.task.add_done_callback(lambda task, key=key: self._finished(key, task))
+        else:
+            self.stats["coalesced"] += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task), shared
+        except asyncio.CancelledError:
+            if call.task.cancelled() or call.waiters > 1:
+                raise
+            # Last interested caller went away; stop spending quota on it
+            call.task.cancel()
+            self.stats["abandoned"] += 1
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _finished(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is not None and self._calls[key].task is task:
+            del self._calls[key]
+        if not task.cancelled() and task.exception() is not None:
+            self.stats["errors"] += 1
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+
+class _Broadcast:
+    def __init__(self):
+        self.items: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.changed = asyncio.Condition()
+        self.pump: Optional[asyncio.Task] = None
+
+
+class StreamFlight:
+    """Single-flight for streams: late joiners replay the chunks so far, then follow live"""
+
+    def __init__(self):
+        self._streams: Dict[str, _Broadcast] = {}
+        self.stats = {"leaders": 0, "coalesced": 0, "errors": 0, "abandoned": 0}
+
+    def stream(self, key: str, factory: Callable[[], AsyncIterator[Any]]) -> Tuple[AsyncIterator[Any], bool]:
+        broadcast = self._streams.get(key)
+        shared = broadcast is not None
+        if broadcast is None:
+            broadcast = _Broadcast()
+            self._streams[key] = broadcast
+            broadcast.pump = asyncio.create_task(self._pump(key, broadcast, factory))
+            self.stats["leaders"] += 1
+        else:
+            self.stats["coalesced"] += 1
+        return self._follow(broadcast), shared
+
+    def joining(self, key: str) -> bool:
+        """Whether a stream for key would follow one already in flight"""
+        return key in self._streams
+
+    async def _pump(self, key: str, broadcast: _Broadcast, factory: Callable[[], AsyncIterator[Any]]):
+        try:
+            async for item in factory():
+                async with broadcast.changed:
+                    broadcast.items.append(item)
+                    broadcast.changed.notify_all()
+        except asyncio.CancelledError:
+            broadcast.error = asyncio.CancelledError()
+        except Exception as e:
+            broadcast.error = e
+            self.stats["errors"] += 1
+        finally:
+            if self._streams.get(key) is broadcast:
+                del self._streams[key]
+            async with broadcast.changed:
+                broadcast.done = True
+                broadcast.changed.notify_all()
+
+    async def _follow(self, broadcast: _Broadcast) -> AsyncIterator[Any]:
+        # Counted once iteration starts: only then is the finally below sure to run
+        broadcast.subscribers += 1
+        i = 0
+        try:
+            while True:
+                async with broadcast.changed:
+                    while i >= len(broadcast.items) and not broadcast.done:
+                        await broadcast.changed.wait()
+                    pending = broadcast.items[i:]
+                    finished = broadcast.done
+                for item in pending:
+                    yield item
+                i += len(pending)
+                if finished and i >= len(broadcast.items):
+                    break
+            if broadcast.error is not None:
+                raise broadcast.error
+        finally:
+            broadcast.subscribers -= 1
+            if broadcast.subscribers == 0 and not broadcast.done and broadcast.pump is not None:
+                broadcast.pump.cancel()
+                self.stats["abandoned"] += 1
+
+    def in_flight(self) -> int:
+        return len(self._streams)
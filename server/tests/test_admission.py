@@ -0,0 +1,101 @@
+import asyncio
+import math
+
+import pytest
+
+import admission as admission_module
+from admission import Admission, Overloaded
+from upstream import MAX_CONCURRENCY
+
+
+def test_default_max_active_follows_upstream_concurrency():
+    assert admission_module.ADMISSION_MAX_ACTIVE == math.ceil(MAX_CONCURRENCY * admission_module.ADMISSION_QUEUE_FACTOR)
+
+
+def test_slots_are_handed_over_in_arrival_order():
+    gate = Admission(max_active=1, max_queue=4, queue_timeout=5)
+    order = []
+
+    async def worker(name, hold):
+        async with gate.slot():
+            order.append(name)
+            await asyncio.sleep(hold)
+
+    async def main():
+        first = asyncio.create_task(worker("a", 0.05))
+        await asyncio.sleep(0)
+        rest = [asyncio.create_task(worker(name, 0)) for name in "bcd"]
+        await asyncio.gather(first, *rest)
+
+    asyncio.run(main())
+    assert order == ["a", "b", "c", "d"]
+    assert gate.stats["admitted"] == 4 and gate.stats["queued"] == 3
+    assert gate.snapshot()["active"] == 0
+
+
+def test_full_queue_sheds_at_once():
+    gate = Admission(max_active=1, max_queue=0, queue_timeout=5)
+
+    async def main():
+        await gate.acquire()
+        with pytest.raises(Overloaded) as shed:
+            await gate.acquire()
+        return shed.value
+
+    error = asyncio.run(main())
+    assert error.reason == "queue_full"
+    assert error.retry_after >= 1
+    assert gate.stats["shed"] == 1
+
+
+def test_queue_timeout_sheds_and_frees_the_queue():
+    gate = Admission(max_active=1, max_queue=4, queue_timeout=0.02)
+
+    async def main():
+        await gate.acquire()
+        with pytest.raises(Overloaded) as shed:
+            await gate.acquire()
+        return shed.value
+
+    assert asyncio.run(main()).reason == "queue_timeout"
+    assert gate.snapshot()["queued_now"] == 0
+
+
+def test_shorter_deadline_sheds_as_deadline():
+    gate = Admission(max_active=1, max_queue=4, queue_timeout=5)
+
+    async def main():
+        await gate.acquire()
+        with pytest.raises(Overloaded) as shed:
+            await gate.acquire(within=0.02)
+        return shed.value
+
+    assert asyncio.run(main()).reason == "deadline"
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    gate = Admission(max_active=1, max_queue=4, queue_timeout=5)
+
+    async def main():
+        await gate.acquire()
+        waiting = asyncio.create_task(gate.acquire())
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        gate.release(0.0)
+
+    asyncio.run(main())
+    assert gate.snapshot()["active"] == 0 and gate.snapshot()["queued_now"] == 0
+
+
+def test_stream_release_is_idempotent():
+    gate = Admission(max_active=2, max_queue=4, queue_timeout=5)
+
+    async def main():
+        release = await gate.enter()
+        release()
+        release()
+
+    asyncio.run(main())
+    assert gate.snapshot()["active"] == 0
@@ -0,0 +1,73 @@
+import re
+
+import pytest
+
+from analyzer import RULES, WHOLE_WORDS, analyze_prompt
+
+PROMPTS = [
+    "Write an ansible playbook to install nginx on the webservers",
+    "terraform for an ec2 instance in a vpc with an s3 bucket and rds database behind an alb",
+    "azure vm with storage, terraform please",
+    "gcp network and load   balancer via terraform",
+    "abcd efci installing packages on db hosts with ansible",
+    "What's the weather like today?",
+    "configure and start the service, copy the file; devops",
+    "kubernetes helm chart for argo rollouts",
+    "my_cd_tool and ci/cd pipelines",
+    "",
+]
+
+
+def reference(text):
+    """The analyzer's rules applied one keyword at a time, the way the old scans did"""
+    lowered = text.lower()
+    hits = []
+    for rank, (field, value, keywords) in enumerate(RULES):
+        for keyword in keywords:
+            pattern = r"(?<![\w])" + r"\s+".join(map(re.escape, keyword.split(" ")))
+            if keyword in WHOLE_WORDS:
+                pattern += r"(?!\w)"
+            if re.search(pattern, lowered):
+                hits.append((rank, field, value))
+                break
+    chosen = {}
+    for _, field, value in hits:
+        chosen.setdefault(field, value)
+    return {
+        "allowed": "topic" in chosen,
+        "target_hosts": chosen.get("target_hosts", "all"),
+        "tasks": [value for _, field, value in hits if field == "tasks"],
+        "provider": chosen.get("provider", "aws"),
+        "resources": [value for _, field, value in hits if field == "resources"],
+    }
+
+
+@pytest.mark.parametrize("prompt", PROMPTS)
+def test_single_pass_matches_keyword_by_keyword_rules(prompt):
+    analysis = analyze_prompt(prompt)
+    assert {
+        "allowed": analysis["allowed"],
+        "target_hosts": analysis["ansible"]["target_hosts"],
+        "tasks": analysis["ansible"]["tasks"],
+        "provider": analysis["terraform"]["provider"],
+        "resources": analysis["terraform"]["resources"],
+    } == reference(prompt)
+
+
+def test_whole_words_do_not_fire_inside_other_words():
+    assert not analyze_prompt("abcd and efci")["allowed"]
+    assert analyze_prompt("a ci/cd pipeline")["allowed"]
+
+
+def test_prefix_keywords_cover_longer_forms():
+    assert analyze_prompt("ansible for installing nginx")["ansible"]["tasks"] == ["package_installation"]
+
+
+def test_multi_word_keywords_allow_any_spacing():
+    assert analyze_prompt("terraform a load\n  balancer")["terraform"]["resources"] == ["load_balancer"]
+
+
+def test_single_valued_fields_take_the_first_rule():
+    analysis = analyze_prompt("terraform on azure or aws for db and web servers")
+    assert analysis["terraform"]["provider"] == "aws"
+    assert analysis["ansible"]["target_hosts"] == "webservers"
@@ -0,0 +1,107 @@
+from decompose import build_part_prompt, contract, merge, overall_route, part_hcl, part_requirements, plan
+from validation import cross_references, extract_blocks
+
+FULL = {"provider": "aws", "resources": ["compute_instance", "storage", "database", "load_balancer"]}
+
+NETWORK = '''```hcl
+resource "aws_vpc" "network_main" {
+  cidr_block = "10.0.0.0/16"
+}
+
+resource "aws_subnet" "network_public" {
+  vpc_id     = aws_vpc.network_main.id
+  cidr_block = "10.0.1.0/24"
+}
+
+locals {
+  network_id         = aws_vpc.network_main.id
+  public_subnet_ids  = [aws_subnet.network_public.id]
+  private_subnet_ids = [aws_subnet.network_public.id]
+}
+```'''
+
+COMPUTE = '''```hcl
+resource "aws_security_group" "compute_app" {
+  vpc_id = local.network_id
+}
+
+resource "aws_instance" "compute_web" {
+  ami       = "ami-123"
+  subnet_id = local.public_subnet_ids[0]
+}
+
+locals {
+  instance_ids          = [aws_instance.compute_web.id]
+  app_security_group_id = aws_security_group.compute_app.id
+}
+```'''
+
+
+def merged_problems(requirements, sections):
+    parts = plan(requirements, True)
+    text = merge(parts, requirements, [part_hcl(part, section) for part, section in zip(parts, sections)])
+    return cross_references([(body, line) for language, body, line in extract_blocks(text, "hcl") if language == "hcl"])
+
+
+def test_plan_splits_by_part_and_adds_the_network():
+    assert [part.name for part in plan(FULL)] == ["network", "compute", "data", "lb"]
+    assert [part.name for part in plan({"provider": "aws", "resources": ["compute_instance"]}, True)] == ["network", "compute"]
+
+
+def test_plan_keeps_small_or_unknown_requests_whole():
+    assert plan({"provider": "aws", "resources": ["compute_instance"]}) == []
+    assert plan({"provider": "aws", "resources": ["storage"]}, True) == []
+    assert plan({"provider": "oracle", "resources": FULL["resources"]}, True) == []
+    assert plan(FULL, False) == []
+
+
+def test_contract_only_exposes_values_of_requested_resources():
+    requirements = {"provider": "aws", "resources": ["compute_instance", "storage"]}
+    values = contract(plan(requirements, True), requirements)
+    assert values["bucket_name"]["part"] == "data"
+    assert "db_endpoint" not in values
+    assert values["network_id"]["part"] == "network"
+
+
+def test_part_prompt_states_what_the_part_owns_and_reads():
+    parts = plan(FULL)
+    compute = parts[1]
+    prompt = build_part_prompt("web app", compute, parts, FULL)
+    assert "local.network_id" in prompt
+    assert "- instance_ids:" in prompt
+    assert 'Start every resource and data source name with "compute_"' in prompt
+    assert part_requirements(compute, FULL)["resources"] == ["compute_instance"]
+
+
+def test_merged_parts_that_keep_the_contract_pass_the_reference_check():
+    requirements = {"provider": "aws", "resources": ["compute_instance"]}
+    assert merged_problems(requirements, [NETWORK, COMPUTE]) == []
+
+
+def test_part_that_skips_a_value_it_owes_fails_the_reference_check():
+    requirements = {"provider": "aws", "resources": ["compute_instance"]}
+    compute = COMPUTE.replace("  instance_ids          = [aws_instance.compute_web.id]\n", "")
+    problems = merged_problems(requirements, [NETWORK, compute])
+    assert any("local.instance_ids" in p["message"] for p in problems)
+
+
+def test_empty_part_is_marked_in_the_merge():
+    parts = plan(FULL)
+    assert "nothing was generated" in part_hcl(parts[0], "")
+    assert part_hcl(parts[0], 'resource "aws_vpc" "a" {}').startswith("\n# --- network ---\n")
+
+
+def test_overall_route_takes_the_highest_tier_and_every_escalation():
+    escalation = {"model": "lite", "reason": "invalid", "tokens": None}
+    reports = [
+        {"part": "network", "route": {"model": "lite", "tier": 0, "reasons": [], "escalations": []}},
+        {"part": "compute", "route": {"model": "flash", "tier": 1, "reasons": [], "escalations": [escalation]}},
+    ]
+    route = overall_route(reports)
+    assert route["model"] == "flash" and route["tier"] == 1
+    assert route["escalations"] == [{**escalation, "part": "compute"}]
+
+
+def test_overall_route_of_a_pinned_model():
+    reports = [{"part": "network", "route": {"model": "pro", "tier": None, "reasons": ["requested"], "escalations": []}}]
+    assert overall_route(reports)["model"] == "pro"
@@ -0,0 +1,77 @@
+import pytest
+
+from analyzer import analyze_prompt
+from fastpath import DEFAULT_PATH, TemplateLibrary
+
+
+@pytest.fixture(scope="module")
+def library():
+    return TemplateLibrary(DEFAULT_PATH, min_confidence=1.0)
+
+
+def answer(library, kind, prompt):
+    return library.match(kind, prompt, analyze_prompt(prompt)[kind])
+
+
+def test_shipped_templates_all_load(library):
+    assert library.errors == {}
+    assert len(library.templates) >= 6
+
+
+@pytest.mark.parametrize(
+    "kind, prompt, name",
+    [
+        ("ansible", "ansible playbook to install nginx on webservers", "ansible-nginx"),
+        ("ansible", "install apache on web servers", "ansible-apache"),
+        ("ansible", "Ansible playbook to install docker", "ansible-docker"),
+        ("terraform", "terraform EC2 in a VPC", "terraform-aws-ec2-vpc"),
+        ("terraform", "terraform s3 bucket with versioning", "terraform-aws-s3"),
+        ("terraform", "aws vpc with public and private subnets", "terraform-aws-vpc"),
+    ],
+)
+def test_boilerplate_prompts_render_a_valid_template(library, kind, prompt, name):
+    hit = answer(library, kind, prompt)
+    assert hit is not None and hit["name"] == name
+    assert hit["confidence"] == 1.0
+    assert hit["report"]["valid"] is not False
+
+
+@pytest.mark.parametrize(
+    "kind, prompt",
+    [
+        # The S3 template blocks all public access
+        ("terraform", "terraform s3 bucket with public access"),
+        ("terraform", "EC2 in a VPC using spot instances"),
+        ("ansible", "install nginx on webservers with TLS"),
+        ("ansible", "install nginx on windows servers"),
+        ("ansible", "install nginx on webservers with TLS on port 8443 and a reverse proxy"),
+        ("ansible", "Install and configure apache web server"),
+        ("terraform", "s3 bucket on azure"),
+        ("terraform", "EC2 + RDS database in a VPC"),
+    ],
+)
+def test_prompts_asking_for_more_go_to_gemini(library, kind, prompt):
+    assert answer(library, kind, prompt) is None
+
+
+@pytest.mark.parametrize(
+    "kind, prompt",
+    [("terraform", "terraform s3 bucket with public access"), ("terraform", "EC2 in a VPC using spot instances"), ("ansible", "install nginx with tls")],
+)
+def test_excludes_hold_at_a_lower_threshold(kind, prompt):
+    assert answer(TemplateLibrary(DEFAULT_PATH, min_confidence=0.5), kind, prompt) is None
+
+
+def test_target_hosts_come_from_the_prompt(library):
+    hit = answer(library, "ansible", "install nginx on databases")
+    assert "hosts: databases" in hit["output"]
+
+
+def test_broken_templates_are_rejected(tmp_path):
+    (tmp_path / "undefined.yaml").write_text("kind: ansible\nbody: |\n  - hosts: [[ target_hosts ]]\n    tasks: []\n")
+    (tmp_path / "unparsable.yaml").write_text('kind: terraform\nbody: |\n  resource "x" "y" {\n')
+    (tmp_path / "kind.yaml").write_text("kind: helm\nbody: x\n")
+    library = TemplateLibrary(str(tmp_path))
+    assert library.templates == []
+    assert set(library.errors) == {"undefined.yaml", "unparsable.yaml", "kind.yaml"}
+    assert "target_hosts" in library.errors["undefined.yaml"]
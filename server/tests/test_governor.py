@@ -0,0 +1,127 @@
+import asyncio
+import time
+
+import pytest
+
+import governor
+from governor import AdaptiveLimit, Governor, QuotaExhausted, TokenBucket, retry_after, status_of
+
+
+class UpstreamError(Exception):
+    def __init__(self, code, retry_after=None):
+        super().__init__(f"status {code}")
+        self.code = code
+        if retry_after is not None:
+            self.retry_after = retry_after
+
+
+def test_disabled_bucket_never_waits():
+    bucket = TokenBucket(0)
+
+    async def main():
+        for _ in range(1000):
+            await bucket.acquire(100)
+
+    asyncio.run(main())
+    assert bucket.rate == 0
+
+
+def test_bucket_spends_its_burst_then_waits_for_refill():
+    # 600 per minute is 10 per second; one second of burst holds 10
+    bucket = TokenBucket(600, burst=1)
+
+    async def main():
+        started = time.monotonic()
+        for _ in range(10):
+            await bucket.acquire()
+        burst = time.monotonic() - started
+        await bucket.acquire(2)
+        return burst, time.monotonic() - started
+
+    burst, total = asyncio.run(main())
+    assert burst < 0.05
+    assert total >= 0.15
+
+
+def test_charge_can_overdraw_the_bucket():
+    bucket = TokenBucket(600, burst=1)
+    bucket.charge(25)
+    assert bucket.tokens < 0
+
+
+def test_adaptive_limit_bounds_concurrency():
+    limit = AdaptiveLimit(2)
+    peak = 0
+
+    async def work():
+        nonlocal peak
+        async with limit:
+            peak = max(peak, limit.in_use)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(*(work() for _ in range(6)))
+
+    asyncio.run(main())
+    assert peak == 2 and limit.in_use == 0
+
+
+def test_adaptive_limit_halves_once_per_round_trip_and_regrows():
+    limit = AdaptiveLimit(16, minimum=2)
+    limit.on_throttle()
+    limit.on_throttle()
+    assert limit.limit == 8
+    for _ in range(40):
+        limit.on_success(0.1)
+    assert 8 < limit.limit <= 16
+    limit._last_decrease = 0.0
+    for _ in range(10):
+        limit.on_throttle()
+        limit._last_decrease = 0.0
+    assert limit.limit == 2
+
+
+def test_status_and_retry_after_from_errors():
+    assert status_of(UpstreamError(429)) == 429
+    assert status_of(ValueError()) is None
+    assert retry_after(UpstreamError(429, retry_after=3)) == 3.0
+    assert retry_after(UpstreamError(429)) is None
+
+
+def test_call_retries_server_errors(monkeypatch):
+    monkeypatch.setattr(governor, "backoff", lambda attempt, server_delay=None: 0.0)
+    gov = Governor("test-model", 4)
+    failures = [UpstreamError(503), UpstreamError(500)]
+
+    async def fn():
+        if failures:
+            raise failures.pop(0)
+        return "ok"
+
+    assert asyncio.run(gov.call(fn)) == "ok"
+    assert gov.stats["retries"] == 2 and gov.stats["server_errors"] == 2
+
+
+def test_client_errors_are_not_retried():
+    gov = Governor("test-model", 4)
+
+    async def fn():
+        raise UpstreamError(400)
+
+    with pytest.raises(UpstreamError):
+        asyncio.run(gov.call(fn))
+    assert gov.stats["retries"] == 0
+
+
+def test_persistent_throttling_exhausts_the_quota(monkeypatch):
+    monkeypatch.setattr(governor, "backoff", lambda attempt, server_delay=None: 0.0)
+    gov = Governor("test-model", 4)
+    gov.max_retries = 2
+
+    async def fn():
+        raise UpstreamError(429, retry_after=0.01)
+
+    with pytest.raises(QuotaExhausted) as exhausted:
+        asyncio.run(gov.call(fn))
+    assert exhausted.value.retry_after == 0.01
+    assert gov.stats["throttled"] == 3 and gov.stats["exhausted"] == 1
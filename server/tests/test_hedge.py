@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+import hedge
+from hedge import Hedger
+
+
+@pytest.fixture(autouse=True)
+def quick_hedges(monkeypatch):
+    monkeypatch.setattr(hedge, "HEDGE_MIN_SAMPLES", 3)
+    monkeypatch.setattr(hedge, "HEDGE_MIN_DELAY", 0.01)
+    monkeypatch.setattr(hedge, "HEDGE_BUDGET", 1.0)
+
+
+def trained(model="m"):
+    h = Hedger(model)
+    for _ in range(3):
+        h.observe("k", 0.01)
+    return h
+
+
+def test_no_threshold_until_enough_samples():
+    h = Hedger("m")
+    h.observe("k", 0.5)
+    assert h.threshold("k") is None
+    assert trained().threshold("k") == 0.01
+
+
+def test_slow_call_is_hedged_and_the_hedge_wins():
+    h = trained()
+    calls = []
+
+    async def fn():
+        calls.append(len(calls))
+        await asyncio.sleep(1.0 if len(calls) == 1 else 0.0)
+        return len(calls)
+
+    assert asyncio.run(h.call("k", fn)) == 2
+    assert h.stats["fired"] == 1 and h.stats["won"] == 1
+
+
+def test_fast_call_is_not_hedged():
+    h = trained()
+
+    async def fn():
+        return "ok"
+
+    assert asyncio.run(h.call("k", fn)) == "ok"
+    assert h.stats["fired"] == 0
+
+
+def test_empty_budget_denies_the_hedge(monkeypatch):
+    monkeypatch.setattr(hedge, "HEDGE_BUDGET", 0.0)
+    h = trained()
+
+    async def fn():
+        await asyncio.sleep(0.05)
+        return "slow"
+
+    assert asyncio.run(h.call("k", fn)) == "slow"
+    assert h.stats["denied"] == 1 and h.stats["fired"] == 0
+
+
+def test_failed_hedge_leaves_the_primary_to_finish():
+    h = trained()
+    calls = []
+
+    async def fn():
+        calls.append(None)
+        if len(calls) == 2:
+            raise RuntimeError("hedge failed")
+        await asyncio.sleep(0.05)
+        return "primary"
+
+    assert asyncio.run(h.call("k", fn)) == "primary"
+    assert h.stats["fired"] == 1 and h.stats["won"] == 0
+
+
+def test_stream_hedges_on_time_to_first_chunk_and_closes_the_loser():
+    h = trained()
+    closed = []
+
+    def factory():
+        index = len(closed)
+        closed.append(False)
+
+        async def chunks():
+            try:
+                if index == 0:
+                    await asyncio.sleep(1.0)
+                for i in range(3):
+                    yield (index, i)
+            finally:
+                closed[index] = True
+
+        return chunks()
+
+    async def main():
+        return [chunk async for chunk in h.stream("k", factory)]
+
+    assert asyncio.run(main()) == [(1, 0), (1, 1), (1, 2)]
+    assert closed == [True, True]
+    assert h.stats["won"] == 1
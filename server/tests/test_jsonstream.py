@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+from jsonstream import StageScanner
+
+PIPELINE = {
+    "name": "deploy",
+    "notes": "braces in strings: { [ \" } ]",
+    "stages": [
+        {"refId": "1", "type": "bakeManifest", "config": {"stages": [{"nested": True}]}},
+        {"refId": "2", "type": "deployManifest", "requisiteStageRefIds": ["1"]},
+        {"refId": "3", "type": "manualJudgment", "instructions": "ok?\\n"},
+    ],
+    "triggers": [{"type": "git"}],
+}
+
+
+def scan(text, size):
+    scanner = StageScanner()
+    stages = []
+    for i in range(0, len(text), size):
+        stages += scanner.feed(text[i : i + size])
+    return scanner, stages
+
+
+@pytest.mark.parametrize("size", [1, 3, 17, 10_000])
+def test_stages_come_out_whole_however_the_text_is_split(size):
+    text = "Here is the pipeline:\n```json\n" + json.dumps(PIPELINE, indent=2) + "\n```\nDone."
+    scanner, stages = scan(text, size)
+    assert stages == PIPELINE["stages"]
+    assert scanner.complete
+    assert scanner.value() == PIPELINE
+
+
+def test_each_stage_is_returned_as_soon_as_it_closes():
+    text = json.dumps(PIPELINE)
+    # The first stage's closing brace sits just before the comma that leads to the second
+    first_end = text.index(', {"refId": "2"') - 1
+    scanner = StageScanner()
+    assert scanner.feed(text[:first_end]) == []
+    assert scanner.feed(text[first_end]) == [PIPELINE["stages"][0]]
+
+
+def test_bracket_in_prose_is_not_the_answer():
+    scanner, stages = scan('Use a list [like this] for stages.\n{"stages": [{"refId": "1"}]}', 5)
+    assert stages == [{"refId": "1"}]
+    assert scanner.value() == {"stages": [{"refId": "1"}]}
+
+
+def test_truncated_answer_is_incomplete():
+    text = json.dumps(PIPELINE)
+    scanner, stages = scan(text[: text.index('"refId": "3"')], 8)
+    assert stages == PIPELINE["stages"][:2]
+    assert scanner.started and not scanner.complete
+    assert scanner.value() is None
+
+
+def test_only_the_first_stages_array_is_scanned():
+    scanner, stages = scan('{"stages": [{"a": 1}], "later": {"stages": [{"b": 2}]}}', 4)
+    assert stages == [{"a": 1}]
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+import main
+from governor import QuotaExhausted
+from router import Route
+
+
+class Resp:
+    usage_metadata = None
+    candidates = []
+
+    def __init__(self, text):
+        self.text = text
+
+
+@pytest.fixture
+def escalating(monkeypatch):
+    """The first tier answers empty and the second answers; exact input counts differ per model"""
+    calls = []
+
+    async def generate(model_name, system_instruction, contents, **kwargs):
+        calls.append(model_name)
+        return Resp("" if model_name == "small" else "```hcl\nok\n```")
+
+    async def count(model_name):
+        return {"small": 100, "large": 200}[model_name]
+
+    async def validation_fields(output_text, expected, summary_field):
+        return {summary_field: "ok", "validation": {"valid": True, "blocks": [{"language": expected}]}}
+
+    monkeypatch.setattr(main, "generate", generate)
+    monkeypatch.setattr(main, "response_text", lambda resp, explain_finish=True: resp.text)
+    monkeypatch.setattr(main, "start_input_count", lambda model_name, *args: asyncio.ensure_future(count(model_name)))
+    monkeypatch.setattr(main, "validation_fields", validation_fields)
+    return calls
+
+
+def route():
+    return Route("test", ["small", "large"], 0, [], pinned=False)
+
+
+def test_cascade_charges_each_tier_its_own_input_count(escalating):
+    r = route()
+    resp, generated, checks, tokens = asyncio.run(main.cascade(r, "policy", "prompt", {}, "hcl", "hcl_validation"))
+
+    assert escalating == ["small", "large"]
+    assert r.escalations[0]["tokens"]["input"] == 100
+    assert tokens["input"] == 200
+
+
+def test_chat_charges_the_tier_that_answered(escalating):
+    r = route()
+    result, generated = asyncio.run(main.answer_chat(r, "prompt", {}))
+
+    assert result["route"]["model"] == "large"
+    assert r.escalations[0]["tokens"]["input"] == 100
+    assert result["tokens"]["input"] == 200
+
+
+def test_spinnaker_lets_throttling_reach_its_handler(monkeypatch):
+    async def spinnaker_pipeline(inp, model_name, generation_config, streaming):
+        raise QuotaExhausted(model_name, 2.0, RuntimeError("429"))
+        yield
+
+    monkeypatch.setattr(main, "spinnaker_pipeline", spinnaker_pipeline)
+    inp = main.SpinnakerGenerateIn(prompt="spinnaker pipeline that deploys nginx to kubernetes")
+
+    with pytest.raises(QuotaExhausted):
+        asyncio.run(main.run_spinnaker(inp, {}, bypass_cache=True))
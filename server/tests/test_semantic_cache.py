@@ -0,0 +1,60 @@
+from semantic_cache import SemanticCache, entities
+
+NGINX = "Create an Ansible playbook for installing nginx on web servers and make sure the service is enabled"
+APACHE = "Create an Ansible playbook for installing apache on web servers and make sure the service is enabled"
+MICRO = "Terraform config for an AWS EC2 instance of type t3.micro in a VPC with a public subnet"
+LARGE = "Terraform config for an AWS EC2 instance of type t3.large in a VPC with a public subnet"
+
+
+def cache_with(prompt: str, key: str = "cached") -> SemanticCache:
+    cache = SemanticCache()
+    cache.add("scope", prompt, key)
+    return cache
+
+
+def test_rephrased_prompt_hits():
+    cache = cache_with(NGINX)
+    match = cache.lookup("scope", "Write an ansible playbook that installs nginx on the webservers, with the service enabled", 0.9)
+    assert match is not None and match[0] == "cached"
+
+
+def test_plural_rephrasing_hits():
+    cache = cache_with("deploy nginx service with ansible on ubuntu hosts")
+    match = cache.lookup("scope", "deploy nginx services with ansible on ubuntu host", 0.9)
+    assert match is not None and match[0] == "cached"
+    for singular, plural in [("page", "pages"), ("service", "services"), ("cache", "caches"), ("box", "boxes"), ("status", "statuses")]:
+        assert entities(f"nginx {singular}") == entities(f"nginx {plural}")
+
+
+def test_other_package_misses_despite_similarity():
+    cache = cache_with(NGINX)
+    assert cache.lookup("scope", APACHE, 0.5) is None
+    assert cache.stats["entity_mismatches"] == 1
+
+
+def test_other_instance_size_misses_despite_similarity():
+    cache = cache_with(MICRO)
+    assert cache.lookup("scope", LARGE, 0.5) is None
+    assert cache.lookup("scope", MICRO, 0.9)[0] == "cached"
+
+
+def test_numbers_and_versions_are_entities():
+    assert entities("open port 8080") != entities("open port 8443")
+    assert entities("install kubernetes 1.29") != entities("install kubernetes 1.30")
+    assert entities("install nginx on web servers") == entities("installing nginx on webservers")
+
+
+def test_scopes_are_separate():
+    cache = cache_with(NGINX)
+    assert cache.lookup("other-scope", NGINX, 0.9) is None
+
+
+def test_discard_and_eviction():
+    cache = SemanticCache(max_entries=2)
+    for i, word in enumerate(["nginx", "apache", "docker"]):
+        cache.add("scope", f"install {word} on web servers", f"k{i}")
+    assert cache.snapshot()["entries"] == 2
+    assert cache.lookup("scope", "install nginx on web servers", 0.9) is None
+    cache.discard("k2")
+    assert cache.lookup("scope", "install docker on web servers", 0.9) is None
+    assert cache.lookup("scope", "install apache on web servers", 0.9)[0] == "k1"
@@ -0,0 +1,169 @@
+import asyncio
+import time
+
+from sessions import SessionStore, new_session_id, valid_session_id
+
+
+def run_turn(store, session_id, message):
+    async def turn():
+        session = await store.get(session_id)
+        async with session.lock:
+            session.add("user", message)
+            session.add("model", "ok")
+            await store.save(session)
+        return session
+
+    return turn()
+
+
+def texts(store, session_id):
+    async def main():
+        session = await store.get(session_id)
+        return [session.contents("")[i]["parts"][0] for i in range(len(session.turns))]
+
+    return asyncio.run(main())
+
+
+def test_ids_are_minted_and_validated():
+    assert valid_session_id(new_session_id())
+    assert new_session_id() != new_session_id()
+    assert not valid_session_id("abc")
+    assert not valid_session_id("x" * 31 + "/")
+
+
+def test_unknown_ids_have_no_session(tmp_path):
+    for path in ("", str(tmp_path / "sessions.db")):
+        store = SessionStore(path=path)
+        assert asyncio.run(store.get(new_session_id())) is None
+
+
+def test_memory_only_store_keeps_history():
+    store = SessionStore(path="")
+
+    async def main():
+        session_id = (await store.create()).id
+        await run_turn(store, session_id, "one")
+        return await store.get(session_id)
+
+    session = asyncio.run(main())
+    assert [role for role, _, _ in session.turns] == ["user", "model"]
+    assert store.stats["created"] == 1 and store.stats["memory_hits"] == 2
+
+
+def test_concurrent_gets_on_a_stored_session_share_one_session(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    first = SessionStore(path=path)
+    session_id = asyncio.run(first.create()).id
+    asyncio.run(run_turn(first, session_id, "one"))
+
+    # A fresh worker has the session on disk only; two turns arrive at once
+    store = SessionStore(path=path)
+
+    async def main():
+        return await asyncio.gather(run_turn(store, session_id, "two"), run_turn(store, session_id, "three"))
+
+    left, right = asyncio.run(main())
+    assert left is right
+    assert len(left.turns) == 6
+    assert store.stats["disk_hits"] == 1 and store.stats["memory_hits"] == 1
+
+    # Both turns reached the file
+    assert len(texts(SessionStore(path=path), session_id)) == 6
+
+
+def test_workers_sharing_the_file_see_each_others_turns(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    worker1, worker2 = SessionStore(path=path), SessionStore(path=path)
+    session_id = asyncio.run(worker1.create()).id
+
+    asyncio.run(run_turn(worker1, session_id, "one"))
+    asyncio.run(run_turn(worker2, session_id, "two"))
+    session = asyncio.run(run_turn(worker1, session_id, "three"))
+
+    assert len(session.turns) == 6
+    assert worker1.stats["disk_hits"] == 1
+
+
+def test_concurrent_turns_in_two_workers_both_survive(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    worker1, worker2 = SessionStore(path=path), SessionStore(path=path)
+    session_id = asyncio.run(worker1.create()).id
+
+    async def main():
+        # Both workers load the same version before either saves
+        one, two = await worker1.get(session_id), await worker2.get(session_id)
+        one.add("user", "from worker 1")
+        one.add("model", "ok")
+        two.add("user", "from worker 2")
+        two.add("model", "ok")
+        await worker1.save(one)
+        await worker2.save(two)
+        return two
+
+    merged = asyncio.run(main())
+    assert worker2.stats["merged"] == 1
+    assert len(merged.turns) == 4
+    stored = texts(SessionStore(path=path), session_id)
+    assert stored == ["from worker 1", "ok", "from worker 2", "ok"]
+    # Worker 1's copy is stale now and is reloaded on its next turn
+    assert texts(worker1, session_id) == stored
+
+
+def test_turn_on_a_session_deleted_elsewhere_is_dropped(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    worker1, worker2 = SessionStore(path=path), SessionStore(path=path)
+    session_id = asyncio.run(worker1.create()).id
+    asyncio.run(run_turn(worker1, session_id, "one"))
+
+    async def main():
+        session = await worker1.get(session_id)
+        await worker2.delete(session_id)
+        session.add("user", "late")
+        await worker1.save(session)
+
+    asyncio.run(main())
+    assert asyncio.run(worker1.get(session_id)) is None
+    assert worker1.snapshot()["disk_sessions"] == 0
+
+
+def test_delete_reaches_other_workers(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    worker1, worker2 = SessionStore(path=path), SessionStore(path=path)
+    session_id = asyncio.run(worker1.create()).id
+    asyncio.run(run_turn(worker1, session_id, "one"))
+
+    assert asyncio.run(worker2.delete(session_id)) is True
+    assert asyncio.run(worker1.get(session_id)) is None
+    assert asyncio.run(worker2.delete(new_session_id())) is False
+
+
+def test_eviction_keeps_the_stored_copy(tmp_path):
+    store = SessionStore(path=str(tmp_path / "sessions.db"), max_sessions=1)
+    a = asyncio.run(store.create()).id
+    asyncio.run(run_turn(store, a, "one"))
+    b = asyncio.run(store.create()).id
+    asyncio.run(run_turn(store, b, "two"))
+
+    assert store.stats["evicted"] == 1
+    assert len(asyncio.run(store.get(a)).turns) == 2
+
+
+def test_memory_only_eviction_drops():
+    store = SessionStore(path="", max_sessions=1)
+    a = asyncio.run(store.create()).id
+    asyncio.run(run_turn(store, a, "one"))
+    asyncio.run(store.create())
+
+    assert store.stats["dropped"] == 1
+    assert asyncio.run(store.get(a)) is None
+
+
+def test_expired_sessions_are_gone(tmp_path):
+    store = SessionStore(path=str(tmp_path / "sessions.db"), ttl=0.05)
+    session_id = asyncio.run(store.create()).id
+    asyncio.run(run_turn(store, session_id, "one"))
+    time.sleep(0.1)
+
+    assert asyncio.run(store.get(session_id)) is None
+    assert store.stats["expired"] == 1
+    assert store.snapshot()["disk_sessions"] == 0
@@ -0,0 +1,158 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight, StreamFlight
+
+
+def test_concurrent_callers_share_one_call():
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"output": "x"}
+
+    async def run():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("k", work) for _ in range(5)))
+        return flight, results
+
+    flight, results = asyncio.run(run())
+    assert calls == 1
+    assert [shared for _, shared in results].count(False) == 1
+    assert all(result == {"output": "x"} for result, _ in results)
+    assert flight.stats["coalesced"] == 4
+    assert flight.in_flight() == 0
+
+
+def test_error_reaches_every_caller_and_key_is_forgotten():
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def run():
+        flight = SingleFlight()
+        results = await asyncio.gather(flight.do("k", fail), flight.do("k", fail), return_exceptions=True)
+        return flight, results
+
+    flight, results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert flight.in_flight() == 0
+    assert flight.stats["errors"] == 1
+
+
+def test_first_caller_leaving_does_not_cancel_the_others():
+    async def work():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def run():
+        flight = SingleFlight()
+        first = asyncio.ensure_future(flight.do("k", work))
+        second = asyncio.ensure_future(flight.do("k", work))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second, first
+
+    (result, shared), first = asyncio.run(run())
+    assert result == "done" and shared
+    assert first.cancelled()
+
+
+def test_last_caller_leaving_cancels_the_call():
+
+    async def run():
+        flight = SingleFlight()
+        cancelled = []
+
+        async def work():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        caller = asyncio.ensure_future(flight.do("k", work))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        await asyncio.sleep(0)
+        return flight, cancelled
+
+    flight, cancelled = asyncio.run(run())
+    assert cancelled == [True]
+    assert flight.stats["abandoned"] == 1
+
+
+def test_stream_late_joiner_replays_then_follows():
+    async def chunks():
+        for i in range(4):
+            await asyncio.sleep(0.01)
+            yield i
+
+    async def collect(stream):
+        return [item async for item in stream]
+
+    async def run():
+        flight = StreamFlight()
+        assert not flight.joining("k")
+        first, shared_first = flight.stream("k", chunks)
+        first_task = asyncio.ensure_future(collect(first))
+        await asyncio.sleep(0.025)
+        assert flight.joining("k")
+        second, shared_second = flight.stream("k", chunks)
+        return await first_task, await collect(second), shared_first, shared_second, flight
+
+    first, second, shared_first, shared_second, flight = asyncio.run(run())
+    assert first == second == [0, 1, 2, 3]
+    assert (shared_first, shared_second) == (False, True)
+    assert flight.in_flight() == 0
+
+
+def test_stream_error_reaches_followers():
+    async def chunks():
+        yield 1
+        raise RuntimeError("upstream failed")
+
+    async def run():
+        flight = StreamFlight()
+        stream, _ = flight.stream("k", chunks)
+        items = []
+        with pytest.raises(RuntimeError):
+            async for item in stream:
+                items.append(item)
+        return items
+
+    assert asyncio.run(run()) == [1]
+
+
+def test_follower_that_never_reads_does_not_keep_the_stream_alive():
+    cancelled = []
+
+    async def chunks():
+        try:
+            for i in range(100):
+                await asyncio.sleep(0.01)
+                yield i
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def run():
+        flight = StreamFlight()
+        leader, _ = flight.stream("k", chunks)
+        await leader.__anext__()
+        # A follower joins, then its client goes before the stream is ever read
+        follower, shared = flight.stream("k", chunks)
+        del follower
+        await leader.aclose()
+        await asyncio.sleep(0.02)
+        return flight, shared
+
+    flight, shared = asyncio.run(run())
+    assert shared
+    assert cancelled == [True]
+    assert flight.stats["abandoned"] == 1 and flight.in_flight() == 0
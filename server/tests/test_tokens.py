@@ -0,0 +1,39 @@
+import asyncio
+
+import tokens
+import upstream
+
+
+def test_background_calibration_counts_the_output_alone(monkeypatch):
+    calls = []
+
+    async def count_tokens(model_name, system_instruction, contents):
+        calls.append((system_instruction, contents))
+        return 10
+
+    monkeypatch.setattr(upstream, "count_tokens", count_tokens)
+    monkeypatch.setattr(tokens, "TOKEN_COUNT_MODE", "background")
+    monkeypatch.setattr(tokens, "_chars_per_token", {})
+
+    async def main():
+        used = await tokens.token_usage("m", "a long system policy", "prompt", "twenty characters!!!")
+        await asyncio.gather(*tokens._background)
+        return used
+
+    used = asyncio.run(main())
+    assert calls == [(None, "twenty characters!!!")]
+    assert used["output"] == tokens.estimate_tokens("twenty characters!!!")
+    # 20 chars over 10 tokens moves the default 4.0 chars per token a tenth of the way toward 2.0
+    assert abs(tokens._chars_per_token["m"] - 3.8) < 1e-9
+
+
+def test_usage_metadata_wins_over_estimates():
+    class Usage:
+        prompt_token_count = 7
+        candidates_token_count = 3
+
+    class Resp:
+        usage_metadata = Usage()
+
+    assert tokens.usage_counts(Resp()) == {"input": 7, "output": 3, "total": 10}
+    assert tokens.usage_counts(object()) is None
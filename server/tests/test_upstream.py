@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+import upstream
+
+
+class Chunk:
+    usage_metadata = None
+    candidates = []
+    text = "x"
+
+
+class FakeModel:
+    async def generate_content_async(self, contents, generation_config=None, safety_settings=None, stream=False):
+        await asyncio.sleep(0.005)
+        if not stream:
+            return Chunk()
+
+        async def chunks():
+            for _ in range(3):
+                await asyncio.sleep(0.005)
+                yield Chunk()
+
+        return chunks()
+
+    async def count_tokens_async(self, contents):
+        await asyncio.sleep(0.005)
+        return {"total_tokens": 3}
+
+
+@pytest.fixture
+def saturated(monkeypatch):
+    """One global slot and a model limit of one, so every call contends for both"""
+    monkeypatch.setattr(upstream, "_sdk", object())
+    monkeypatch.setattr(upstream, "get_model", lambda name, system_instruction=None: FakeModel())
+    monkeypatch.setattr(upstream, "model_limit", lambda name: 1)
+    monkeypatch.setattr(upstream, "MAX_CONCURRENCY", 1)
+    monkeypatch.setattr(upstream, "_global_slots", None)
+    monkeypatch.setattr(upstream, "_governors", {})
+
+
+def test_generate_stream_and_count_share_saturated_limits_without_deadlock(saturated):
+    async def stream():
+        return [chunk async for chunk in upstream.stream_generate("m", None, "hi", {})]
+
+    async def main():
+        calls = []
+        for _ in range(10):
+            calls += [
+                upstream.generate("m", None, "hi", {}),
+                stream(),
+                upstream.count_tokens("m", None, "hi"),
+            ]
+        return await asyncio.wait_for(asyncio.gather(*calls), timeout=5)
+
+    results = asyncio.run(main())
+    assert len(results) == 30
+    assert all(len(r) == 3 for r in results[1::3])
+    assert all(r == 3 for r in results[2::3])
+    assert upstream._global_slots._value == 1
@@ -0,0 +1,55 @@
+import asyncio
+
+import validation
+from validation import extract_blocks, summarize, validate_blocks
+
+HCL = 'resource "aws_s3_bucket" "logs" {\n  bucket = "logs"\n}\n'
+
+
+def check(text, expected):
+    return summarize(validate_blocks(extract_blocks(text, expected)), expected)
+
+
+def test_extract_blocks_labels_and_positions():
+    text = "intro\n```yaml\na: 1\n```\nthen\n```\n{}\n```\n"
+    assert extract_blocks(text, "json") == [("yaml", "a: 1\n", 3), ("json", "{}\n", 7)]
+
+
+def test_truncated_last_fence_is_still_a_block():
+    assert extract_blocks("```hcl\nresource \"a\" \"b\" {", "hcl") == [("hcl", 'resource "a" "b" {', 2)]
+
+
+def test_yaml_error_position_counts_from_the_full_output():
+    report = check("text\n```yaml\na: 1\nb: [\n```\n", "yaml")
+    assert report["valid"] is False
+    assert report["blocks"][0]["error"]["line"] >= 3
+    assert report["parser"] in ("libyaml", "pyyaml")
+
+
+def test_hcl_report_names_the_parser_that_ran():
+    report = check(f"```hcl\n{HCL}```", "hcl")
+    assert report["valid"] is True
+    assert report["parser"] == validation.parsers()["hcl"]
+    if report["parser"] == "structural":
+        assert report["summary"].endswith("(structural check only)")
+    else:
+        assert report["summary"] == "✅ Valid HCL format"
+
+
+def test_structural_check_catches_unclosed_blocks(monkeypatch):
+    monkeypatch.setattr(validation, "hcl2", None)
+    report = check('```hcl\nresource "a" "b" {\n  x = "y"\n```', "hcl")
+    assert report["valid"] is False
+    assert report["parser"] == "structural"
+    assert "never closed" in report["blocks"][0]["error"]["message"]
+
+
+def test_missing_block_is_not_validated():
+    report = check("no code here", "hcl")
+    assert report["valid"] is None and report["parser"] is None
+
+
+def test_validate_off_the_event_loop(monkeypatch):
+    monkeypatch.setattr(validation, "VALIDATION_WORKERS", 0)
+    report = asyncio.run(validation.validate('```json\n{"a": 1}\n```', "json"))
+    assert report["valid"] is True and report["parser"] in ("orjson", "json")
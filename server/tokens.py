@@ -0,0 +1,105 @@
+import asyncio
+import math
+import os
+from typing import Any, Dict, Optional, Set
+
+from metrics import record_tokens
+
+# usage:      usage metadata, local estimate when it's missing (no extra round trips)
+# parallel:   also count input tokens exactly alongside generation
+# background: like usage, plus exact count_tokens calls off the request path to calibrate the estimator
+TOKEN_COUNT_MODE = os.getenv("TOKEN_COUNT_MODE", "usage")
+
+DEFAULT_CHARS_PER_TOKEN = 4.0
+
+_chars_per_token: Dict[str, float] = {}
+_background: Set[asyncio.Task] = set()
+
+
+def text_of(contents: Any) -> str:
+    """Plain text of a prompt given as a string or a list of Gemini content dicts"""
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, dict):
+        return "".join(text_of(p) for p in contents.get("parts", []))
+    if isinstance(contents, (list, tuple)):
+        return "".join(text_of(c) for c in contents)
+    return str(contents)
+
+
+def estimate_tokens(text: str, model_name: Optional[str] = None) -> int:
+    """Local token estimate, calibrated per model from observed exact counts"""
+    if not text:
+        return 0
+    ratio = _chars_per_token.get(model_name or "", DEFAULT_CHARS_PER_TOKEN)
+    return max(1, math.ceil(len(text) / ratio))
+
+
+def calibrate(model_name: str, text: str, exact_tokens: int):
+    if not text or exact_tokens <= 0:
+        return
+    observed = len(text) / exact_tokens
+    current = _chars_per_token.get(model_name, DEFAULT_CHARS_PER_TOKEN)
+    _chars_per_token[model_name] = 0.9 * current + 0.1 * observed
+
+
+def usage_counts(resp) -> Optional[Dict[str, int]]:
+    """Token counts from a response's usage metadata, or None when it carries none"""
+    usage = getattr(resp, "usage_metadata", None)
+    input_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    if not (input_tokens or output_tokens):
+        return None
+    return {"input": input_tokens, "output": output_tokens, "total": input_tokens + output_tokens}
+
+
+def start_input_count(model_name: str, system_instruction: Optional[str], contents: Any) -> Optional[asyncio.Task]:
+    """In parallel mode, begin an exact input count to run alongside generation"""
+    if TOKEN_COUNT_MODE != "parallel":
+        return None
+    # upstream meters its calls with the estimator below, so it's imported lazily
+    from upstream import count_tokens
+
+    return asyncio.create_task(count_tokens(model_name, system_instruction, contents))
+
+
+async def _calibrate_output(model_name: str, output_text: str):
+    from upstream import count_tokens
+
+    # No system instruction: the count must cover the output text alone
+    calibrate(model_name, output_text, await count_tokens(model_name, None, output_text))
+
+
+async def token_usage(
+    model_name: str,
+    system_instruction: Optional[str],
+    contents: Any,
+    output_text: str,
+    resp=None,
+    input_task: Optional[asyncio.Task] = None,
+) -> Dict[str, int]:
+    """Input/output/total tokens for one generation without adding round trips to the request"""
+    prompt_text = (system_instruction or "") + text_of(contents)
+    usage = usage_counts(resp)
+    if usage is not None:
+        if input_task is not None:
+            input_task.cancel()
+        calibrate(model_name, prompt_text, usage["input"])
+        record_tokens(model_name, usage)
+        return usage
+
+    input_tokens = 0
+    if input_task is not None:
+        input_tokens = await input_task
+    if not input_tokens:
+        input_tokens = estimate_tokens(prompt_text, model_name)
+    output_tokens = estimate_tokens(output_text, model_name)
+
+    if TOKEN_COUNT_MODE == "background" and output_text:
+        task = asyncio.create_task(_calibrate_output(model_name, output_text))
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+
+    tokens = {"input": input_tokens, "output": output_tokens, "total": input_tokens + output_tokens}
+    record_tokens(model_name, tokens)
+    return tokens
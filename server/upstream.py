@@ -0,0 +1,303 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from governor import Governor
+from hedge import HEDGE_ENABLED, hedge_stats, hedger
+from metrics import STAGE_SECONDS, current_endpoint, record_finish, record_upstream_error, stage
+from tokens import estimate_tokens, text_of, usage_counts
+
+# Upper bound on concurrent Gemini calls across the whole worker process
+MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "256"))
+# Default per-model ceiling for the adaptive limit; override per model with e.g. GEMINI_CONCURRENCY_GEMINI_2_5_PRO=32
+MODEL_CONCURRENCY = int(os.getenv("GEMINI_MODEL_CONCURRENCY", "128"))
+# How many (model, system prompt) handles to keep around
+MODEL_CACHE_SIZE = int(os.getenv("GEMINI_MODEL_CACHE_SIZE", "64"))
+# google.generativeai pulls in grpc and protobuf and dominates startup; 0 imports it with this module
+LAZY_SDK_IMPORT = os.getenv("LAZY_SDK_IMPORT", "1") not in ("0", "false", "no")
+
+SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+]
+
+_models: "OrderedDict[Tuple[str, Optional[str]], Any]" = OrderedDict()
+_global_slots: Optional[asyncio.Semaphore] = None
+_governors: Dict[str, Governor] = {}
+_sdk: Any = None
+_sdk_lock = threading.Lock()
+_api_key: Optional[str] = None
+
+
+def configure(api_key: str):
+    """Set the API key; applied now if the SDK is loaded, else when it first loads"""
+    global _api_key
+    _api_key = api_key
+    if _sdk is not None:
+        _sdk.configure(api_key=api_key)
+
+
+def sdk():
+    """The google.generativeai module, imported and configured on first use"""
+    global _sdk
+    if _sdk is None:
+        with _sdk_lock:
+            if _sdk is None:
+                import google.generativeai as genai
+
+                if _api_key:
+                    genai.configure(api_key=_api_key)
+                _sdk = genai
+    return _sdk
+
+
+async def ensure_sdk():
+    """Load the SDK on a worker thread so a request arriving mid-import doesn't stall the loop"""
+    if _sdk is None:
+        await asyncio.to_thread(sdk)
+
+
+def get_model(name: str, system_instruction: Optional[str] = None):
+    """Return a shared GenerativeModel for (model, system prompt)"""
+    key = (name, system_instruction)
+    model = _models.get(key)
+    if model is None:
+        model = sdk().GenerativeModel(name, system_instruction=system_instruction)
+        _models[key] = model
+        if len(_models) > MODEL_CACHE_SIZE:
+            _models.popitem(last=False)
+    else:
+        _models.move_to_end(key)
+    return model
+
+
+def model_limit(name: str) -> int:
+    """Concurrency limit for a model, from GEMINI_CONCURRENCY_<MODEL> or the default"""
+    env_name = "GEMINI_CONCURRENCY_" + re.sub(r"[^A-Za-z0-9]", "_", name).upper()
+    return int(os.getenv(env_name, str(MODEL_CONCURRENCY)))
+
+
+def governor(name: str) -> Governor:
+    """Quota, backoff and adaptive concurrency state for a model"""
+    gov = _governors.get(name)
+    if gov is None:
+        gov = _governors[name] = Governor(name, model_limit(name))
+    return gov
+
+
+def _global() -> asyncio.Semaphore:
+    global _global_slots
+    if _global_slots is None:
+        _global_slots = asyncio.Semaphore(MAX_CONCURRENCY)
+    return _global_slots
+
+
+def _estimate(model_name: str, system_instruction: Optional[str], contents: Any) -> int:
+    return estimate_tokens((system_instruction or "") + text_of(contents), model_name)
+
+
+def _total_tokens(resp) -> int:
+    usage = usage_counts(resp)
+    return usage["total"] if usage else 0
+
+
+def governor_stats() -> Dict[str, Any]:
+    hedges = hedge_stats()
+    stats = {name: gov.snapshot() for name, gov in _governors.items()}
+    for name, snapshot in stats.items():
+        if name in hedges:
+            snapshot["hedge"] = hedges[name]
+    return stats
+
+
+async def generate(
+    model_name: str,
+    system_instruction: Optional[str],
+    contents: Any,
+    generation_config: Dict[str, Any],
+    safety_settings: Optional[list] = None,
+):
+    """Run one generate_content call on the event loop under quota and concurrency limits"""
+    await ensure_sdk()
+    model = get_model(model_name, system_instruction)
+    gov = governor(model_name)
+    estimated = _estimate(model_name, system_instruction, contents)
+
+    async def attempt():
+        try:
+            # gov.call already holds the model limit; the global slot is always taken second
+            async with _global():
+                if hasattr(model, "generate_content_async"):
+                    return await model.generate_content_async(
+                        contents,
+                        generation_config=generation_config,
+                        safety_settings=safety_settings,
+                    )
+                # Older SDKs have no async surface; fall back to a worker thread
+                return await asyncio.to_thread(
+                    model.generate_content,
+                    contents,
+                    generation_config=generation_config,
+                    safety_settings=safety_settings,
+                )
+        except Exception as e:
+            record_upstream_error(model_name, e)
+            raise
+
+    with stage("upstream"):
+        if HEDGE_ENABLED:
+            key = (current_endpoint.get(), "generate")
+            resp = await hedger(model_name).call(key, lambda: gov.call(attempt, estimated))
+        else:
+            resp = await gov.call(attempt, estimated)
+    gov.settle(estimated, _total_tokens(resp))
+    record_finish(model_name, resp)
+    return resp
+
+
+async def count_tokens(model_name: str, system_instruction: Optional[str], contents: Any) -> int:
+    """Best-effort token count; returns 0 when the SDK can't provide one"""
+    await ensure_sdk()
+    model = get_model(model_name, system_instruction)
+    try:
+        with stage("count_tokens"):
+            async with governor(model_name).limit, _global():
+                if hasattr(model, "count_tokens_async"):
+                    ct = await model.count_tokens_async(contents)
+                else:
+                    ct = await asyncio.to_thread(model.count_tokens, contents)
+        return getattr(ct, "total_tokens", 0) or (ct.get("total_tokens") if isinstance(ct, dict) else 0)
+    except Exception:
+        return 0
+
+
+async def stream_generate(
+    model_name: str,
+    system_instruction: Optional[str],
+    contents: Any,
+    generation_config: Dict[str, Any],
+    safety_settings: Optional[list] = None,
+):
+    """Yield response chunks as they arrive, holding a concurrency slot for the whole stream.
+
+    Throttling and 5xx errors are retried only until the first chunk has been yielded. With
+    hedging on, a stream slow to produce its first chunk races a second identical stream.
+    """
+    await ensure_sdk()
+    if not HEDGE_ENABLED:
+        async for chunk in _stream(model_name, system_instruction, contents, generation_config, safety_settings):
+            yield chunk
+        return
+    key = (current_endpoint.get(), "stream")
+    chunks = hedger(model_name).stream(
+        key, lambda: _stream(model_name, system_instruction, contents, generation_config, safety_settings)
+    )
+    async for chunk in chunks:
+        yield chunk
+
+
+async def _stream(
+    model_name: str,
+    system_instruction: Optional[str],
+    contents: Any,
+    generation_config: Dict[str, Any],
+    safety_settings: Optional[list] = None,
+):
+    model = get_model(model_name, system_instruction)
+    gov = governor(model_name)
+    estimated = _estimate(model_name, system_instruction, contents)
+    upstream_started = time.perf_counter()
+    attempt = 0
+    while True:
+        await gov.admit(estimated)
+        gov.stats["calls"] += 1
+        started = False
+        last = None
+        begun = time.monotonic()
+        try:
+            # Model limit first, then the global slot, as in generate(); the opposite order deadlocks
+            async with gov.limit, _global():
+                if not hasattr(model, "generate_content_async"):
+                    last = await asyncio.to_thread(
+                        model.generate_content,
+                        contents,
+                        generation_config=generation_config,
+                        safety_settings=safety_settings,
+                    )
+                    started = True
+                    yield last
+                else:
+                    resp = await model.generate_content_async(
+                        contents,
+                        generation_config=generation_config,
+                        safety_settings=safety_settings,
+                        stream=True,
+                    )
+                    async for chunk in resp:
+                        started = True
+                        last = chunk
+                        yield chunk
+        except Exception as e:
+            record_upstream_error(model_name, e)
+            delay = None if started else gov.failed(e, attempt)
+            if delay is None:
+                raise
+            attempt += 1
+            await asyncio.sleep(delay)
+            continue
+        gov.limit.on_success(time.monotonic() - begun)
+        # The final chunk carries usage for the whole stream
+        gov.settle(estimated, _total_tokens(last))
+        record_finish(model_name, last)
+        STAGE_SECONDS.labels(current_endpoint.get(), "upstream").observe(time.perf_counter() - upstream_started)
+        return
+
+
+async def prewarm(handles: Iterable[Tuple[str, Optional[str]]], connect: bool = True) -> Dict[str, Any]:
+    """Load the SDK, build model handles and open the upstream channel before traffic arrives.
+
+    The channel is opened with one count_tokens call per model (free, and it shares the
+    generate_content transport), so the first real request doesn't pay for TLS and channel
+    setup. Returns what was warmed and how long each step took; connection errors are reported,
+    not raised.
+    """
+    report: Dict[str, Any] = {}
+    started = time.perf_counter()
+    await ensure_sdk()
+    report["sdk_seconds"] = round(time.perf_counter() - started, 3)
+
+    started = time.perf_counter()
+    handles = list(dict.fromkeys(handles))
+    for name, system_instruction in handles:
+        get_model(name, system_instruction)
+    report["models"] = len(handles)
+    report["model_seconds"] = round(time.perf_counter() - started, 3)
+
+    if connect:
+        started = time.perf_counter()
+        names = list(dict.fromkeys(name for name, _ in handles))
+        results = await asyncio.gather(*(_touch(name) for name in names), return_exceptions=True)
+        report["connect"] = {
+            name: "ok" if not isinstance(result, BaseException) else f"{type(result).__name__}: {result}"
+            for name, result in zip(names, results)
+        }
+        report["connect_seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+async def _touch(model_name: str):
+    model = get_model(model_name)
+    if hasattr(model, "count_tokens_async"):
+        await model.count_tokens_async("ping")
+    else:
+        await asyncio.to_thread(model.count_tokens, "ping")
+
+
+if not LAZY_SDK_IMPORT:
+    sdk()
@@ -0,0 +1,370 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib parser gives the same answers, just slower
+    orjson = None
+
+try:
+    import hcl2
+except ImportError:  # optional; without it HCL gets a structural check only
+    hcl2 = None
+
+# Parser processes per server worker; 0 parses on a thread in-process, with no hard timeout
+VALIDATION_WORKERS = int(os.getenv("VALIDATION_WORKERS", "2"))
+VALIDATION_TIMEOUT = float(os.getenv("VALIDATION_TIMEOUT", "2.0"))
+# Outputs and blocks past these sizes are reported as not validated rather than parsed
+VALIDATION_MAX_BYTES = int(os.getenv("VALIDATION_MAX_BYTES", str(1 << 20)))
+VALIDATION_MAX_BLOCK_BYTES = int(os.getenv("VALIDATION_MAX_BLOCK_BYTES", str(256 << 10)))
+VALIDATION_MAX_BLOCKS = int(os.getenv("VALIDATION_MAX_BLOCKS", "20"))
+
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+LANGUAGES = {
+    "yaml": "yaml", "yml": "yaml", "ansible": "yaml",
+    "hcl": "hcl", "terraform": "hcl", "tf": "hcl", "hcl2": "hcl",
+    "json": "json",
+}
+LABELS = {"yaml": "YAML", "hcl": "HCL", "json": "JSON"}
+
+# Fenced blocks in one pass; an unterminated last fence (truncated output) runs to the end
+_FENCE = re.compile(r"^[ \t]*```[ \t]*([\w+.-]*)[^\n]*\n(.*?)(?:^[ \t]*```[ \t]*$|\Z)", re.M | re.S)
+_HCL_BLOCK = re.compile(r"^\s*(terraform|provider|resource|data|variable|output|module|locals)\b", re.M)
+_CLOSERS = {"}": "{", "]": "[", ")": "("}
+
+
+def extract_blocks(text: str, default: Optional[str] = None) -> List[Tuple[str, str, int]]:
+    """(language, body, first body line) for every fenced block.
+
+    Unlabelled blocks take the default language. An answer with no fences at all is treated as
+    one block of the default language when it looks like one (YAML document or bare JSON).
+    """
+    blocks = []
+    for m in _FENCE.finditer(text):
+        label = m.group(1).lower()
+        language = LANGUAGES.get(label, label) if label else (default or "")
+        blocks.append((language, m.group(2), text.count("\n", 0, m.start(2)) + 1))
+    if not blocks and default:
+        stripped = text.strip()
+        if (default == "yaml" and "---" in text) or (default == "json" and stripped.startswith(("{", "["))):
+            blocks.append((default, text, 1))
+    return blocks
+
+
+def _position(line: Optional[int], column: Optional[int], first_line: int) -> Dict[str, Optional[int]]:
+    """Block-relative 1-based position -> position in the whole output"""
+    return {"line": None if line is None else first_line + line - 1, "column": column}
+
+
+def _parse_yaml(body: str, first_line: int) -> Tuple[str, Optional[Dict[str, Any]]]:
+    parser = "libyaml" if YAML_LOADER is not yaml.SafeLoader else "pyyaml"
+    try:
+        for _ in yaml.load_all(body, Loader=YAML_LOADER):
+            pass
+    except yaml.MarkedYAMLError as e:
+        mark = e.problem_mark or e.context_mark
+        message = " ".join(filter(None, [e.context, e.problem])) or str(e)
+        if mark is None:
+            return parser, {"message": message, "line": None, "column": None}
+        return parser, {"message": message, **_position(mark.line + 1, mark.column + 1, first_line)}
+    except yaml.YAMLError as e:
+        return parser, {"message": str(e), "line": None, "column": None}
+    return parser, None
+
+
+def _parse_json(body: str, first_line: int) -> Tuple[str, Optional[Dict[str, Any]]]:
+    try:
+        if orjson is not None:
+            orjson.loads(body)
+            return "orjson", None
+        json.loads(body)
+        return "json", None
+    except json.JSONDecodeError as e:
+        # orjson's error subclasses JSONDecodeError, so both carry lineno/colno
+        return ("orjson" if orjson is not None else "json"), {"message": e.msg, **_position(e.lineno, e.colno, first_line)}
+
+
+def _hcl_structure(body: str) -> Optional[Tuple[str, int, int]]:
+    """First unbalanced bracket or unterminated string, skipping comments and heredocs"""
+    stack: List[Tuple[str, int, int]] = []
+    lines = body.split("\n")
+    in_comment = False
+    heredoc: Optional[str] = None
+    for ln, line in enumerate(lines, 1):
+        if heredoc is not None:
+            if line.strip() == heredoc:
+                heredoc = None
+            continue
+        col = 0
+        while col < len(line):
+            ch = line[col]
+            if in_comment:
+                if line.startswith("*/", col):
+                    in_comment = False
+                    col += 1
+            elif line.startswith("/*", col):
+                in_comment = True
+                col += 1
+            elif ch == "#" or line.startswith("//", col):
+                break
+            elif line.startswith("<<", col):
+                m = re.match(r"<<-?([A-Za-z_]\w*)\s*$", line[col:])
+                if m:
+                    heredoc = m.group(1)
+                    break
+            elif ch == '"':
+                end = col + 1
+                while end < len(line) and line[end] != '"':
+                    end += 2 if line[end] == "\\" else 1
+                if end >= len(line):
+                    return "unterminated string", ln, col + 1
+                col = end
+            elif ch in "{[(":
+                stack.append((ch, ln, col + 1))
+            elif ch in _CLOSERS:
+                if not stack or stack[-1][0] != _CLOSERS[ch]:
+                    return f"unexpected '{ch}'", ln, col + 1
+                stack.pop()
+            col += 1
+    if heredoc is not None:
+        return f"unterminated heredoc {heredoc}", len(lines), 1
+    if stack:
+        opener, ln, col = stack[-1]
+        return f"'{opener}' is never closed", ln, col
+    return None
+
+
+def _parse_hcl(body: str, first_line: int) -> Tuple[str, Optional[Dict[str, Any]]]:
+    if hcl2 is not None:
+        try:
+            hcl2.loads(body)
+            return "hcl2", None
+        except Exception as e:
+            # lark's UnexpectedInput carries line/column; other failures don't
+            line, column = getattr(e, "line", None), getattr(e, "column", None)
+            message = str(e).strip().splitlines()[0] if str(e).strip() else type(e).__name__
+            return "hcl2", {"message": message, **_position(line, column, first_line)}
+    problem = _hcl_structure(body)
+    if problem is not None:
+        message, line, column = problem
+        return "structural", {"message": message, **_position(line, column, first_line)}
+    if not _HCL_BLOCK.search(body):
+        return "structural", {"message": "no terraform, provider, resource or other top-level block", "line": None, "column": None}
+    return "structural", None
+
+
+PARSERS = {"yaml": _parse_yaml, "json": _parse_json, "hcl": _parse_hcl}
+# A structural pass only checks brackets, strings and heredocs, so reports say which one ran
+STRUCTURAL_PARSERS = {"structural"}
+
+
+def parsers() -> Dict[str, str]:
+    """The parser each language gets in this install"""
+    return {
+        "yaml": "libyaml" if YAML_LOADER is not yaml.SafeLoader else "pyyaml",
+        "hcl": "hcl2" if hcl2 is not None else "structural",
+        "json": "orjson" if orjson is not None else "json",
+    }
+
+_STRING = re.compile(r'"(?:[^"\\]|\\.)*"')
+_COMMENT = re.compile(r"#|//")
+_DECLARATION = re.compile(r'^\s*(?:(resource|data)\s+"([^"]+)"\s+"([^"]+)"|(variable|module|output)\s+"([^"]+)"|(locals)\b)')
+_ATTRIBUTE = re.compile(r"^\s*([A-Za-z_][\w-]*)\s*=(?!=)")
+# Resource types are matched by provider prefix, so iterators like each.value or count.index are left alone
+_REFERENCE = re.compile(
+    r"(?<![\w.])(?:(var|local|module)\.([A-Za-z_][\w-]*)"
+    r"|data\.([A-Za-z_]\w*)\.([A-Za-z_][\w-]*)"
+    r"|((?:aws|azurerm|google|random|tls|null|time|kubernetes|helm)_\w+)\.([A-Za-z_][\w-]*))"
+)
+_PREFIXES = {"resource": "", "data": "data.", "variable": "var.", "module": "module.", "output": "output."}
+
+
+def cross_references(blocks: List[Tuple[str, int]]) -> List[Dict[str, Any]]:
+    """Undeclared references and duplicate declarations across the HCL blocks of one configuration.
+
+    Blocks are (body, first line). Catches var., local., module., data. and resource references
+    with no matching declaration, which HCL parsing alone accepts but terraform plan rejects.
+    """
+    declared: Dict[str, int] = {}
+    used: List[Tuple[str, int, int]] = []
+    problems: List[Dict[str, Any]] = []
+    for body, first_line in blocks:
+        depth = 0
+        in_locals = False
+        for ln, line in enumerate(body.split("\n"), first_line):
+            masked = _STRING.sub(lambda m: '"' + " " * (len(m.group()) - 2) + '"', line)
+            comment = _COMMENT.search(masked)
+            if comment is not None:
+                line, masked = line[: comment.start()], masked[: comment.start()]
+            names: List[str] = []
+            if depth == 0:
+                m = _DECLARATION.match(line)
+                if m and m.group(6):
+                    in_locals = True
+                elif m and m.group(1):
+                    names.append(_PREFIXES[m.group(1)] + f"{m.group(2)}.{m.group(3)}")
+                elif m:
+                    names.append(_PREFIXES[m.group(4)] + m.group(5))
+            elif depth == 1 and in_locals:
+                m = _ATTRIBUTE.match(masked)
+                if m:
+                    names.append(f"local.{m.group(1)}")
+            for name in names:
+                if name in declared:
+                    problems.append({"message": f"{name} is declared twice (first on line {declared[name]})", "line": ln, "column": None})
+                else:
+                    declared[name] = ln
+            for m in _REFERENCE.finditer(line):
+                if m.group(1):
+                    name = f"{m.group(1)}.{m.group(2)}"
+                elif m.group(3):
+                    name = f"data.{m.group(3)}.{m.group(4)}"
+                else:
+                    name = f"{m.group(5)}.{m.group(6)}"
+                used.append((name, ln, m.start() + 1))
+            depth += sum(masked.count(ch) for ch in "{[(") - sum(masked.count(ch) for ch in "}])")
+            if depth <= 0:
+                depth, in_locals = 0, False
+    reported = set()
+    for name, ln, column in used:
+        if name not in declared and name not in reported:
+            reported.add(name)
+            problems.append({"message": f"{name} is not declared", "line": ln, "column": column})
+    return sorted(problems, key=lambda p: p["line"])
+
+
+def validate_blocks(blocks: List[Tuple[str, str, int]]) -> List[Dict[str, Any]]:
+    """Parse each block with the parser for its language; runs in the validation pool"""
+    results = []
+    for index, (language, body, first_line) in enumerate(blocks):
+        result: Dict[str, Any] = {"index": index, "language": language, "line": first_line, "chars": len(body)}
+        parse = PARSERS.get(language)
+        if parse is None:
+            result.update(valid=None, parser=None, error=None)
+        elif len(body.encode("utf-8")) > VALIDATION_MAX_BLOCK_BYTES:
+            result.update(valid=None, parser=None, error={"message": "block too large to validate", "line": None, "column": None})
+        else:
+            parser, error = parse(body, first_line)
+            result.update(valid=error is None, parser=parser, error=error)
+        results.append(result)
+    return results
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: forking a process that runs an event loop and SDK threads isn't safe
+        _pool = ProcessPoolExecutor(max_workers=VALIDATION_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _discard_pool():
+    """Kill the pool's workers; a parse stuck on pathological input can't be cancelled any other way"""
+    global _pool
+    pool, _pool = _pool, None
+    if pool is None:
+        return
+    for process in list((getattr(pool, "_processes", None) or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def warm_up():
+    """Start the parser processes ahead of the first request"""
+    if VALIDATION_WORKERS > 0:
+        await asyncio.get_running_loop().run_in_executor(_get_pool(), validate_blocks, [])
+
+
+def shutdown():
+    _discard_pool()
+
+
+def _not_validated(blocks: List[Tuple[str, str, int]], message: str) -> List[Dict[str, Any]]:
+    return [
+        {
+            "index": index,
+            "language": language,
+            "line": first_line,
+            "chars": len(body),
+            "valid": None,
+            "parser": None,
+            "error": {"message": message, "line": None, "column": None},
+        }
+        for index, (language, body, first_line) in enumerate(blocks)
+    ]
+
+
+async def validate(text: str, expected: str, cross_check: bool = False) -> Dict[str, Any]:
+    """Validate every fenced block of a generated answer off the event loop.
+
+    Returns {"valid", "summary", "parser", "blocks"}: valid is True when every block in the
+    expected language parsed, False when one failed and None when none could be checked; summary
+    is the one-line string the UI shows and parser names what checked the expected language
+    ("hcl2" or "structural" for HCL). With cross_check, HCL blocks are also checked for references
+    to things nothing declares, reported under "cross_references".
+    """
+    if len(text.encode("utf-8")) > VALIDATION_MAX_BYTES:
+        blocks = extract_blocks(text[: VALIDATION_MAX_BYTES], expected)[:VALIDATION_MAX_BLOCKS]
+        results = _not_validated(blocks, "output too large to validate")
+    else:
+        blocks = extract_blocks(text, expected)[:VALIDATION_MAX_BLOCKS]
+        results = await _run(blocks)
+    report = summarize(results, expected)
+    if cross_check:
+        problems = cross_references([(body, first_line) for language, body, first_line in blocks if language == "hcl"])
+        report["cross_references"] = problems
+        if problems and report["valid"] is not False:
+            more = f" (+{len(problems) - 1} more)" if len(problems) > 1 else ""
+            report["valid"] = False
+            report["summary"] = f"⚠️ HCL reference warning: line {problems[0]['line']}: {problems[0]['message']}{more}"
+    return report
+
+
+async def _run(blocks: List[Tuple[str, str, int]]) -> List[Dict[str, Any]]:
+    if not blocks:
+        return []
+    if VALIDATION_WORKERS <= 0:
+        return await asyncio.to_thread(validate_blocks, blocks)
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.wait_for(loop.run_in_executor(_get_pool(), validate_blocks, blocks), VALIDATION_TIMEOUT)
+    except asyncio.TimeoutError:
+        _discard_pool()
+        return _not_validated(blocks, f"validation timed out after {VALIDATION_TIMEOUT:g}s")
+    except BrokenProcessPool:
+        # Another request's timeout recycled the pool under this one
+        _discard_pool()
+        return _not_validated(blocks, "validation interrupted")
+
+
+def summarize(results: List[Dict[str, Any]], expected: str) -> Dict[str, Any]:
+    label = LABELS.get(expected, expected.upper())
+    relevant = [r for r in results if r["language"] == expected]
+    failed = next((r for r in relevant if r["valid"] is False), None)
+    unchecked = next((r for r in relevant if r["valid"] is None), None)
+    if not relevant:
+        valid, summary = None, f"⚠️ No {label} block found"
+    elif failed is not None:
+        error = failed["error"]
+        where = f"line {error['line']}, column {error['column']}: " if error.get("line") else ""
+        valid, summary = False, f"⚠️ {label} validation warning: {where}{error['message']}"
+    elif unchecked is not None:
+        valid, summary = None, f"⚠️ {label} not validated: {unchecked['error']['message']}"
+    else:
+        count = f" ({len(relevant)} blocks)" if len(relevant) > 1 else ""
+        depth = " (structural check only)" if any(r["parser"] in STRUCTURAL_PARSERS for r in relevant) else ""
+        valid, summary = True, f"✅ Valid {label} format{count}{depth}"
+    parser = next((r["parser"] for r in relevant if r["parser"]), None)
+    return {"valid": valid, "summary": summary, "parser": parser, "blocks": results}